@@ -1,11 +1,38 @@
+import time
 from typing import List, Dict, Any, Union
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Request, Response
 from pydantic import BaseModel
 from db import get_session
 from services import get_fulfillment_centers, find_fulfillment_center
+from metrics import REQUEST_LATENCY, REQUEST_DB_QUERIES, REQUEST_DB_TIME, RequestStats, current_request, render_metrics
 
 app = FastAPI()
 
+@app.middleware("http")
+async def record_request_metrics(request: Request, call_next):
+    stats = RequestStats()
+    token = current_request.set(stats)
+    start = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        elapsed = time.perf_counter() - start
+        current_request.reset(token)
+        # Label by route template, not raw path, so unmatched URLs cannot grow the series without bound
+        route = request.scope.get("route")
+        endpoint = route.path if route is not None else "unmatched"
+        if endpoint != "/metrics":
+            REQUEST_LATENCY.observe(elapsed, request.method, endpoint, status)
+            REQUEST_DB_QUERIES.observe(stats.queries, request.method, endpoint)
+            REQUEST_DB_TIME.observe(stats.db_time, request.method, endpoint)
+
+@app.get("/metrics")
+def metrics():
+    return Response(content=render_metrics(), media_type="text/plain; version=0.0.4")
+
 class Order(BaseModel):
     latitude: float
     longitude: float
@@ -0,0 +1,145 @@
+import time
+import threading
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+
+# Upper bounds in seconds (Prometheus "le" buckets); +Inf is implicit
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_COUNT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200)
+
+
+class Histogram:
+    def __init__(self, name, help_text, labels, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.labels = labels
+        self.buckets = buckets
+        self.series = {}  # label values -> [per-bucket counts..., sum]
+        self.lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        # Counts are kept per bucket and made cumulative at render time, so observe is one increment
+        index = bisect_left(self.buckets, value)
+        with self.lock:
+            series = self.series.get(label_values)
+            if series is None:
+                series = self.series[label_values] = [0] * (len(self.buckets) + 2)
+            series[index] += 1
+            series[-1] += value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self.lock:
+            series = {k: list(v) for k, v in self.series.items()}
+        for label_values, counts in sorted(series.items()):
+            labels = format_labels(self.labels, label_values)
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), counts):
+                cumulative += count
+                le = f'le="{bound}"'
+                lines.append(f"{self.name}_bucket{{{labels + ',' if labels else ''}{le}}} {cumulative}")
+            lines.append(f"{self.name}_sum{braced(labels)} {counts[-1]}")
+            lines.append(f"{self.name}_count{braced(labels)} {cumulative}")
+        return lines
+
+
+class Counter:
+    def __init__(self, name, help_text, labels):
+        self.name = name
+        self.help_text = help_text
+        self.labels = labels
+        self.series = {}
+        self.lock = threading.Lock()
+
+    def inc(self, value, *label_values):
+        with self.lock:
+            self.series[label_values] = self.series.get(label_values, 0) + value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        with self.lock:
+            series = dict(self.series)
+        for label_values, value in sorted(series.items()):
+            lines.append(f"{self.name}{braced(format_labels(self.labels, label_values))} {value}")
+        return lines
+
+
+def format_labels(names, values):
+    escaped = (str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for v in values)
+    return ",".join(f'{n}="{v}"' for n, v in zip(names, escaped))
+
+
+def braced(labels):
+    return f"{{{labels}}}" if labels else ""
+
+
+REQUEST_LATENCY = Histogram(
+    "fulfill_smart_request_duration_seconds", "Request latency by endpoint.", ("method", "endpoint", "status")
+)
+REQUEST_DB_QUERIES = Histogram(
+    "fulfill_smart_request_db_queries", "Database queries per request by endpoint.", ("method", "endpoint"),
+    buckets=QUERY_COUNT_BUCKETS
+)
+REQUEST_DB_TIME = Histogram(
+    "fulfill_smart_request_db_duration_seconds", "Time spent in database queries per request by endpoint.",
+    ("method", "endpoint")
+)
+SPAN_LATENCY = Histogram("fulfill_smart_span_duration_seconds", "Duration of instrumented code sections.", ("span",))
+DB_QUERIES = Counter("fulfill_smart_db_queries_total", "Database queries executed, inside or outside requests.", ())
+
+REGISTRY = [REQUEST_LATENCY, REQUEST_DB_QUERIES, REQUEST_DB_TIME, SPAN_LATENCY, DB_QUERIES]
+
+
+class RequestStats:
+    __slots__ = ("queries", "db_time")
+
+    def __init__(self):
+        self.queries = 0
+        self.db_time = 0.0
+
+
+# Set by the request middleware. The stats object is shared by reference, so queries made from the threadpool
+# that runs sync endpoints (which copies the context) still land on the request.
+current_request = ContextVar("current_request", default=None)
+
+
+@event.listens_for(Engine, "before_cursor_execute")
+def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info["query_start"].pop()
+    DB_QUERIES.inc(1)
+    stats = current_request.get()
+    if stats is not None:
+        stats.queries += 1
+        stats.db_time += elapsed
+
+
+@event.listens_for(Engine, "handle_error")
+def handle_error(context):
+    # A failed query never reaches after_cursor_execute; drop its start time
+    if context.connection is not None and context.connection.info.get("query_start"):
+        context.connection.info["query_start"].pop()
+
+
+@contextmanager
+def span(name):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        SPAN_LATENCY.observe(time.perf_counter() - start, name)
+
+
+def render_metrics():
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
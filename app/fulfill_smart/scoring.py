@@ -0,0 +1,27 @@
+# Fulfillment center scoring, shared by services.find_fulfillment_center and the nightly bulk allocation in
+# smart_inventory/scripts/replenishment_allocation.py. Plain arithmetic, so it scores floats and numpy arrays alike.
+
+DISTANCE_WEIGHT = 0.5
+WORKLOAD_WEIGHT = 0.3
+COST_WEIGHT = 0.2
+
+BASE_FEE = 50  # Example base fee
+COST_PER_KM = 10  # Example cost per km
+WEIGHT_FEE = 5  # Example weight fee per kg
+UNIT_WEIGHT_KG = 0.5  # Assuming each item weighs 0.5 kg
+URGENCY_FEE = 20  # Example urgency fee
+
+
+def calculate_delivery_cost(base_fee, cost_per_km, distance, weight_fee, order_weight, urgency_fee):
+    return base_fee + (cost_per_km * distance) + (weight_fee * order_weight) + urgency_fee
+
+def score_fulfillment_center(distance, current_workload, handling_capacity, quantity):
+    cost = calculate_delivery_cost(
+        base_fee=BASE_FEE,
+        cost_per_km=COST_PER_KM,
+        distance=distance,
+        weight_fee=WEIGHT_FEE,
+        order_weight=quantity * UNIT_WEIGHT_KG,
+        urgency_fee=URGENCY_FEE
+    )
+    return (distance * DISTANCE_WEIGHT) + (current_workload/handling_capacity * WORKLOAD_WEIGHT) + (cost * COST_WEIGHT)
@@ -1,5 +1,7 @@
 from db import get_session
 from models import FulfillmentCenter, InventoryItem
+from metrics import span
+from scoring import calculate_delivery_cost, score_fulfillment_center
 import math
 
 
@@ -20,60 +22,52 @@ def find_dist(fc_lat, fc_lon, lat, lon):
     return haversine_distance(fc_lat, fc_lon, lat, lon)
 
 def get_fulfillment_centers(session):
-    fulfillment_centers = session.query(FulfillmentCenter).all()
-    fc_map = {}
-    
-    for fc in fulfillment_centers:
-        inventory_items = {item.sku: item.quantity for item in fc.inventory_items}
-        fc_map[fc.id] = {
-            "latitude": fc.latitude,
-            "longitude": fc.longitude,
-            "current_workload": fc.current_workload,
-            "handling_capacity": fc.handling_capacity,
-            "inventory_items": inventory_items
-        }
-    
-    return fc_map
+    with span("get_fulfillment_centers"):
+        fulfillment_centers = session.query(FulfillmentCenter).all()
+        fc_map = {}
 
-def calculate_delivery_cost(base_fee, cost_per_km, distance, weight_fee, order_weight, urgency_fee):
-    return base_fee + (cost_per_km * distance) + (weight_fee * order_weight) + urgency_fee
+        for fc in fulfillment_centers:
+            inventory_items = {item.sku: item.quantity for item in fc.inventory_items}
+            fc_map[fc.id] = {
+                "latitude": fc.latitude,
+                "longitude": fc.longitude,
+                "current_workload": fc.current_workload,
+                "handling_capacity": fc.handling_capacity,
+                "inventory_items": inventory_items
+            }
+
+    return fc_map
 
 def find_fulfillment_center(lat, lon, sku, quantity, fc_map):
     closest_fc = None
     min_score = float('inf')
 
-    for fc_id, fc_data in fc_map.items():
-        if sku in fc_data["inventory_items"] and fc_data["inventory_items"][sku] >= quantity:
-            distance = find_dist(fc_data["latitude"], fc_data["longitude"], lat, lon)
-            cost = calculate_delivery_cost(
-                base_fee=50,  # Example base fee
-                cost_per_km=10,  # Example cost per km
-                distance=distance,
-                weight_fee=5,  # Example weight fee per kg
-                order_weight=quantity * 0.5,  # Assuming each item weighs 0.5 kg
-                urgency_fee=20  # Example urgency fee
-            )
-            score = (distance * 0.5) + (fc_data["current_workload"]/fc_data["handling_capacity"] * 0.3) + (cost * 0.2)
-            if score < min_score:
-                min_score = score
-                closest_fc = fc_id
+    with span("score_fulfillment_centers"):
+        for fc_id, fc_data in fc_map.items():
+            if sku in fc_data["inventory_items"] and fc_data["inventory_items"][sku] >= quantity:
+                distance = find_dist(fc_data["latitude"], fc_data["longitude"], lat, lon)
+                score = score_fulfillment_center(distance, fc_data["current_workload"], fc_data["handling_capacity"], quantity)
+                if score < min_score:
+                    min_score = score
+                    closest_fc = fc_id
     
     if closest_fc:
         session = get_session()
         try:
-            fulfillment_center = session.query(FulfillmentCenter).filter_by(id=closest_fc, sku=sku).first()
-            inventory_item = session.query(InventoryItem).filter_by(fulfillment_center_id=closest_fc, sku=sku).first()
-            if fulfillment_center:
+            with span("reserve_commit"):
+                fulfillment_center = session.query(FulfillmentCenter).filter_by(id=closest_fc).first()
+                inventory_item = session.query(InventoryItem).filter_by(fulfillment_center_id=closest_fc, sku=sku).first()
+                if not fulfillment_center or not inventory_item:
+                    raise ValueError("Fulfillment center or SKU no longer exists.")
                 fulfillment_center.current_workload += quantity
-                if inventory_item:
-                    inventory_item.quantity -= quantity
-                    if inventory_item.quantity < 0:
-                        raise ValueError("Insufficient inventory for the requested SKU.")                
+                inventory_item.quantity -= quantity
+                if inventory_item.quantity < 0:
+                    raise ValueError("Insufficient inventory for the requested SKU.")
                 session.commit()
         except Exception as e:
             session.rollback()
             print(f"Error updating fulfillment center: {e}")
             return None, None
-    return closest_fc, min_score if closest_fc else None, None
-
-
+        finally:
+            session.close()
+    return closest_fc, min_score if closest_fc else None
@@ -0,0 +1,339 @@
+"""
+api/main.py
+Purpose: Read API for SmartInventory output (forecasts, reorder_alerts, delivery_routes, logistics_metrics,
+replenishment_allocations), served from an in-process, column-oriented cache so dashboard polls do not reach
+PostgreSQL. Each dataset is loaded once into numpy columns sorted by its key. It is reloaded when a pipeline run
+(main.py) or a route patch reports the dataset changed on the pipeline_runs channel. Both also add pipeline_runs rows,
+so a poll of pipeline_runs catches runs and patches missed while the listener was down.
+
+Responses are compact column-oriented JSON: {"columns": [...], "data": {column: [values]}, "next": cursor}. They
+are paginated by key (pass next back as ?after=), carry an ETag derived from the dataset's content hash, and
+answer If-None-Match with 304. Serialised pages are memoised per snapshot, so repeated polls are a dict lookup.
+
+Execution: Long-running service next to the dashboards.
+Command: uvicorn main:app --app-dir app/smart_inventory/api --port 8001
+"""
+import json
+import base64
+import select
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+import numpy as np
+import pandas as pd
+import psycopg2
+from psycopg2.extensions import ISOLATION_LEVEL_AUTOCOMMIT
+from fastapi import FastAPI, HTTPException, Request, Response
+from sqlalchemy import create_engine
+from dotenv import dotenv_values
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+ENV_VALUES = dotenv_values(".env")
+
+DB_PARAMS = {
+    "dbname": "walmart_db",
+    "user": "walmart_user",
+    "password": ENV_VALUES.get("DB_USER_PASSWORD", "securepassword"),
+    "host": "localhost",
+    "port": "5432"
+}
+
+SQLALCHEMY_URI = f"postgresql+psycopg2://{DB_PARAMS['user']}:{DB_PARAMS['password']}@{DB_PARAMS['host']}:{DB_PARAMS['port']}/{DB_PARAMS['dbname']}"
+engine = create_engine(SQLALCHEMY_URI, pool_size=2, max_overflow=2, pool_pre_ping=True)
+
+PIPELINE_CHANNEL = "pipeline_runs"  # Same channel main.py notifies on
+POLL_S = 30
+RECONNECT_S = 5
+RECONNECT_MAX_S = 300  # Reconnect delay doubles per consecutive failure up to this
+DEFAULT_LIMIT = 500
+MAX_LIMIT = 5000
+RESPONSE_CACHE_MAX = 256  # Serialised pages kept per dataset snapshot
+
+# Dataset -> query, key columns (pagination order), columns usable as ?column=value filters and the pipeline
+# artifacts whose change reloads it (default: the dataset's own name)
+DATASETS = {
+    "forecasts": {
+        "query": "SELECT store_id, sku_id, predicted_demand FROM forecasts",
+        "key": ["store_id", "sku_id"],
+        "filters": ["store_id", "sku_id"],
+    },
+    "reorder_alerts": {
+        "query": "SELECT store_id, sku_id, current_stock, reorder_threshold, priority_score FROM reorder_alerts",
+        "key": ["store_id", "sku_id"],
+        "filters": ["store_id", "sku_id"],
+    },
+    "delivery_routes": {
+        # dc_id is the depot the route starts from; source_fc_id is the FC reserving most of the stop's stock
+        "query": """
+            SELECT d.route_id, d.vehicle_id, d.dc_id, a.fc_id AS source_fc_id, d.store_id, d.sku_id, d.sequence,
+                   d.distance_km, d.estimated_time, d.eta_days, d.priority_score
+            FROM delivery_routes d
+            LEFT JOIN (
+                SELECT DISTINCT ON (store_id, sku_id) store_id, sku_id, fc_id
+                FROM replenishment_allocations
+                WHERE status IN ('reserved', 'shipped')
+                ORDER BY store_id, sku_id, quantity DESC, fc_id
+            ) a ON a.store_id = d.store_id AND a.sku_id = d.sku_id
+        """,
+        "key": ["route_id"],
+        "filters": ["vehicle_id", "dc_id", "source_fc_id", "store_id", "sku_id"],
+        "artifacts": ["delivery_routes", "replenishment_allocations"],
+    },
+    "replenishment_allocations": {
+        "query": """
+            SELECT allocation_id, store_id, sku_id, fc_id, inventory_item_id, quantity, unit_score, status
+            FROM replenishment_allocations
+        """,
+        "key": ["allocation_id"],
+        "filters": ["store_id", "sku_id", "fc_id"],
+    },
+    "logistics_metrics": {
+        "query": "SELECT metric_id, run_date, total_distance_km, total_fuel_cost, total_co2_kg FROM logistics_metrics",
+        "key": ["metric_id"],
+        "filters": [],
+    },
+}
+
+
+class Snapshot:
+    """One immutable load of a dataset. keys is a structured array so composite keys compare lexicographically."""
+
+    def __init__(self, name, frame, key):
+        frame = frame.sort_values(key, kind="stable").reset_index(drop=True)
+        self.name = name
+        self.columns = list(frame.columns)
+        self.data = {}
+        for column in self.columns:
+            values = frame[column]
+            if pd.api.types.is_datetime64_any_dtype(values) or values.dtype == object:
+                values = values.map(lambda v: v.isoformat() if hasattr(v, "isoformat") else v)
+            self.data[column] = values.to_numpy()
+        self.keys = np.rec.fromarrays([self.data[k].astype(np.int64) for k in key], names=key)
+        self.key = key
+        self.rows = len(frame)
+        self.version = hashlib.md5(pd.util.hash_pandas_object(frame, index=False).values.tobytes()).hexdigest()
+        self.responses = OrderedDict()
+        self.responses_lock = threading.Lock()
+
+
+def column_values(values):
+    """JSON-ready list; NaN becomes null."""
+    if values.dtype.kind == "f":
+        return [None if v != v else v for v in values.tolist()]
+    return values.tolist()
+
+
+def encode_cursor(values):
+    return base64.urlsafe_b64encode(json.dumps(values, separators=(",", ":")).encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor):
+    try:
+        return json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+class DatasetCache:
+    def __init__(self, datasets=DATASETS):
+        self.datasets = datasets
+        self.snapshots = {}
+        self.lock = threading.Lock()
+        self.last_run_id = None
+        self.runs_table = False  # pipeline_runs seen on the current listener connection
+
+    def load(self, name):
+        spec = self.datasets[name]
+        frame = pd.read_sql(spec["query"], engine)
+        snapshot = Snapshot(name, frame, spec["key"])
+        current = self.snapshots.get(name)
+        if current is not None and current.version == snapshot.version:
+            return current  # Same content: keep the warm response cache and ETags
+        self.snapshots[name] = snapshot
+        logging.info(f"Cached {name}: {snapshot.rows} rows, version {snapshot.version[:12]}")
+        return snapshot
+
+    def get(self, name):
+        snapshot = self.snapshots.get(name)
+        if snapshot is None:
+            with self.lock:
+                snapshot = self.snapshots.get(name) or self.load(name)
+        return snapshot
+
+    def reload(self, names):
+        with self.lock:
+            for name in names:
+                if name in self.datasets:
+                    try:
+                        self.load(name)
+                    except Exception as e:
+                        logging.error(f"Error reloading {name}, serving the previous snapshot: {e}")
+
+    def affected(self, artifacts):
+        """Datasets to reload for a set of changed pipeline artifacts."""
+        return {
+            name for name, spec in self.datasets.items()
+            if set(spec.get("artifacts", [name])) & set(artifacts)
+        }
+
+    def latest_run(self, cur):
+        """MAX(pipeline_runs.id), or None while the table does not exist yet (db_setup.py has not run)."""
+        if not self.runs_table:
+            cur.execute("SELECT to_regclass('pipeline_runs') IS NOT NULL;")
+            self.runs_table = cur.fetchone()[0]
+            if not self.runs_table:
+                return None
+        cur.execute("SELECT MAX(id) FROM pipeline_runs;")
+        return cur.fetchone()[0]
+
+    def listen(self, stop):
+        """Reloads datasets named in pipeline_runs notifications; polls pipeline_runs as a fallback."""
+        missed = False
+        delay = RECONNECT_S
+        while not stop.is_set():
+            conn = None
+            try:
+                conn = psycopg2.connect(**DB_PARAMS)
+                conn.set_isolation_level(ISOLATION_LEVEL_AUTOCOMMIT)
+                cur = conn.cursor()
+                cur.execute(f"LISTEN {PIPELINE_CHANNEL};")
+                self.runs_table = False
+                if self.latest_run(cur) is None and not self.runs_table:
+                    logging.warning("pipeline_runs does not exist yet; relying on notifications until it does")
+                delay = RECONNECT_S
+                if missed:
+                    # Runs may have finished while the listener was disconnected
+                    self.reload(list(self.snapshots))
+                    missed = False
+                while not stop.is_set():
+                    if select.select([conn], [], [], POLL_S) == ([], [], []):
+                        latest = self.latest_run(cur)
+                        if latest != self.last_run_id:
+                            if self.last_run_id is not None:
+                                self.reload(list(self.snapshots))
+                            self.last_run_id = latest
+                        continue
+                    conn.poll()
+                    changed = set()
+                    while conn.notifies:
+                        notify = conn.notifies.pop(0)
+                        try:
+                            changed.update(json.loads(notify.payload).get("changed", []))
+                        except ValueError:
+                            changed.update(self.datasets)
+                    self.last_run_id = self.latest_run(cur)
+                    if changed:
+                        self.reload(sorted(self.affected(changed) & set(self.snapshots)))
+            except Exception as e:
+                logging.error(f"Error listening on {PIPELINE_CHANNEL}, retrying in {delay}s: {e}")
+                missed = True
+                stop.wait(delay)
+                delay = min(delay * 2, RECONNECT_MAX_S)
+            finally:
+                if conn:
+                    conn.close()
+
+
+def render_page(snapshot, params):
+    """Serialised page for the given query parameters: (body bytes, etag)."""
+    spec = DATASETS[snapshot.name]
+    try:
+        limit = min(max(int(params.get("limit", DEFAULT_LIMIT)), 1), MAX_LIMIT)
+        filters = {c: int(params[c]) for c in spec["filters"] if c in params}
+    except ValueError:
+        raise HTTPException(status_code=400, detail="limit and filters must be integers")
+
+    start = 0
+    if params.get("after"):
+        after = decode_cursor(params["after"])
+        if not isinstance(after, list) or len(after) != len(snapshot.key):
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+        probe = np.rec.fromarrays([[int(v)] for v in after], names=snapshot.key)
+        start = int(np.searchsorted(snapshot.keys, probe[0], side="right"))
+
+    if filters:
+        mask = np.ones(snapshot.rows - start, dtype=bool)
+        for column, value in filters.items():
+            mask &= snapshot.data[column][start:] == value
+        rows = np.flatnonzero(mask)[:limit + 1] + start
+    else:
+        rows = np.arange(start, min(start + limit + 1, snapshot.rows))
+    more = len(rows) > limit
+    rows = rows[:limit]
+
+    body = {
+        "dataset": snapshot.name,
+        "version": snapshot.version,
+        "columns": snapshot.columns,
+        "count": len(rows),
+        "data": {c: column_values(snapshot.data[c][rows]) for c in snapshot.columns},
+        "next": encode_cursor([int(snapshot.keys[rows[-1]][k]) for k in snapshot.key]) if more else None,
+    }
+    return json.dumps(body, separators=(",", ":")).encode()
+
+
+def etag_matches(if_none_match, etag):
+    """
+    If-None-Match check: "*" or an exact entry of the comma-separated list. W/ tags match weakly, as GET requires.
+    """
+    for tag in if_none_match.split(","):
+        tag = tag.strip()
+        if tag == "*" or (tag[2:] if tag.startswith("W/") else tag) == etag:
+            return True
+    return False
+
+
+cache = DatasetCache()
+
+
+@asynccontextmanager
+async def lifespan(app):
+    stop = threading.Event()
+    listener = threading.Thread(target=cache.listen, args=(stop,), name="pipeline-listener", daemon=True)
+    listener.start()
+    yield
+    stop.set()
+
+
+app = FastAPI(lifespan=lifespan)
+
+
+@app.get("/health")
+def health():
+    return {
+        "datasets": {name: {"rows": s.rows, "version": s.version} for name, s in cache.snapshots.items()},
+        "last_run_id": cache.last_run_id,
+    }
+
+
+@app.get("/{dataset}")
+def read_dataset(dataset: str, request: Request):
+    if dataset not in DATASETS:
+        raise HTTPException(status_code=404, detail=f"Unknown dataset {dataset}")
+    try:
+        snapshot = cache.get(dataset)
+    except Exception as e:
+        logging.error(f"Error loading {dataset}: {e}")
+        raise HTTPException(status_code=503, detail="Dataset unavailable")
+
+    params = dict(request.query_params)
+    query = "&".join(f"{k}={params[k]}" for k in sorted(params))
+    etag = f'"{snapshot.version[:16]}-{hashlib.md5(query.encode()).hexdigest()[:8]}"'
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if etag_matches(request.headers.get("if-none-match", ""), etag):
+        return Response(status_code=304, headers=headers)
+
+    with snapshot.responses_lock:
+        body = snapshot.responses.get(query)
+        if body is not None:
+            snapshot.responses.move_to_end(query)
+    if body is None:
+        body = render_page(snapshot, params)
+        with snapshot.responses_lock:
+            snapshot.responses[query] = body
+            if len(snapshot.responses) > RESPONSE_CACHE_MAX:
+                snapshot.responses.popitem(last=False)
+    return Response(content=body, media_type="application/json", headers=headers)
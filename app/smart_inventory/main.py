@@ -0,0 +1,399 @@
+"""
+main.py
+Purpose: Nightly SmartInventory pipeline. The scripts in scripts/ run as stages of a DAG; a stage depends on the stages
+that output its declared inputs. Before a stage runs, its fingerprint is computed: a hash of its code, its inputs
+(content hashes of small tables, watermarks of append-only ones) and its current outputs. A stage whose fingerprint
+matches its last successful run is skipped. Independent stages run concurrently on one shared connection pool.
+
+Every stage's status, fingerprint and wall time go to pipeline_runs. When the run ends, a NOTIFY on PIPELINE_CHANNEL
+tells readers (api/main.py) which outputs changed.
+
+Execution: Nightly (cron), after db_setup.py has created walmart_db once. seed_data.py only runs on an empty database
+or with --seed, since it truncates everything.
+Command: python app/smart_inventory/main.py [--force] [--seed] [--stages forecast routes] [--workers 4]
+"""
+import os
+import sys
+import json
+import time
+import uuid
+import hashlib
+import logging
+import argparse
+import threading
+from dataclasses import dataclass, field
+from datetime import date, datetime
+from typing import Callable, Optional
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from sqlalchemy import create_engine, text
+from dotenv import dotenv_values
+
+# Configured before the scripts are imported, whose own basicConfig calls then keep this level
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(threadName)s - %(message)s')
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "scripts"))
+
+import db_setup
+import seed_data
+import road_distance
+import demand_forecasting
+import route_optimization
+import tracking_compaction
+import replenishment_allocation
+
+ENV_VALUES = dotenv_values(".env")
+
+DB_PARAMS = {
+    "dbname": "walmart_db",
+    "user": "walmart_user",
+    "password": ENV_VALUES.get("DB_USER_PASSWORD", "securepassword"),
+    "host": "localhost",
+    "port": "5432"
+}
+
+SQLALCHEMY_URI = f"postgresql+psycopg2://{DB_PARAMS['user']}:{DB_PARAMS['password']}@{DB_PARAMS['host']}:{DB_PARAMS['port']}/{DB_PARAMS['dbname']}"
+
+PIPELINE_CHANNEL = "pipeline_runs"
+DEFAULT_WORKERS = 4
+
+
+def table_hash(table, columns="t", order="t::text"):
+    """Content hash over every row; meant for the small tables (thousands of rows)."""
+    return f"SELECT md5(COALESCE(string_agg(({columns})::text, ',' ORDER BY {order}), '')) FROM {table} t"
+
+
+def change_watermark(table, key=None):
+    """
+    Change marker for the large tables that reads no rows: the key's high-water mark (an index lookup), the storage
+    files of the table and its partitions, which TRUNCATE replaces, and their cumulative insert/update/delete counters
+    from pg_stat_user_tables. A statistics reset only causes one spurious rerun.
+    """
+    high_water = f"(SELECT MAX({key}) FROM {table})" if key else "NULL"
+    return f"""
+        SELECT concat_ws(':', {high_water}, string_agg(c.relfilenode::text, ',' ORDER BY c.oid),
+                         SUM(s.n_tup_ins), SUM(s.n_tup_upd), SUM(s.n_tup_del))
+        FROM pg_class c
+        LEFT JOIN pg_stat_user_tables s ON s.relid = c.oid
+        WHERE c.oid = '{table}'::regclass
+           OR c.oid IN (SELECT inhrelid FROM pg_inherits WHERE inhparent = '{table}'::regclass)
+    """
+
+
+# Fingerprint queries (or callables) per artifact a stage can read or write. Artifacts without an entry
+# (dropped_deliveries, tracking_segments) still order the DAG but do not contribute to fingerprints. Tables that grow
+# with stores x SKUs or with days of sales use change_watermark, so an unchanged night reads no table rows.
+ARTIFACTS = {
+    "stores": table_hash("stores", "t.store_id, t.store_location, t.lat, t.lng", "t.store_id"),
+    "products": table_hash("products", order="t.sku_id"),
+    "inventory": change_watermark("inventory"),
+    "fulfillment_centers": table_hash("FulfillmentCenter", "t.id, t.latitude, t.longitude", "t.id"),
+    "vehicles": table_hash("vehicles", order="t.vehicle_id"),
+    "sales": change_watermark("sales", "sale_id"),
+    "forecasts": change_watermark("forecasts"),
+    "reorder_alerts": change_watermark("reorder_alerts"),
+    "delivery_routes": table_hash(
+        "delivery_routes", "t.vehicle_id, t.dc_id, t.store_id, t.sku_id, t.sequence", "t.vehicle_id, t.sequence"
+    ),
+    # fulfill_smart's stock, read from its own database
+    "fc_stock": replenishment_allocation.stock_fingerprint,
+    "replenishment_allocations": change_watermark("replenishment_allocations", "allocation_id"),
+    "logistics_metrics": table_hash("logistics_metrics", order="t.metric_id"),
+    # tracking_logs.timestamp is naive server-local time, so the cutoff is measured on LOCALTIMESTAMP
+    "cold_tracking_logs": (
+        "SELECT COUNT(*) FROM tracking_logs "
+        f"WHERE timestamp < LOCALTIMESTAMP - INTERVAL '{tracking_compaction.HOT_HOURS} hours'"
+    ),
+}
+
+
+@dataclass
+class Stage:
+    name: str
+    run: Callable  # run(conn) with a pooled DBAPI connection; returns False (or raises) on failure
+    inputs: list = field(default_factory=list)
+    outputs: list = field(default_factory=list)
+    modules: list = field(default_factory=list)  # Source files hashed into the fingerprint
+    extra: Optional[Callable] = None  # Additional fingerprint input, e.g. the date for daily maintenance
+    when: Optional[Callable] = None  # when(pipeline) -> False leaves the stage out of this run
+
+
+@dataclass
+class StageResult:
+    stage: str
+    status: str  # success, skipped, failed, blocked
+    wall_time_s: float = 0.0
+    fingerprint: Optional[str] = None
+    detail: str = ""
+
+
+class ErrorLogCounter(logging.Handler):
+    """
+    Counts ERROR records per thread. Stages report failure by returning False or raising; a stage whose helpers
+    logged an error and carried on (one SKU failing to forecast, say) is treated as failed as well.
+    """
+
+    def __init__(self):
+        super().__init__(level=logging.ERROR)
+        self.counts = {}
+
+    def emit(self, record):
+        self.counts[record.thread] = self.counts.get(record.thread, 0) + 1
+
+
+def run_schema(conn):
+    return db_setup.create_tables(conn) and db_setup.create_future_partitions(conn) is not None
+
+
+def run_seed(conn):
+    return seed_data.seed_data(conn)
+
+
+def run_compaction(conn):
+    return tracking_compaction.compact(conn=conn) is not None and tracking_compaction.apply_retention(conn=conn)
+
+
+def today():
+    return date.today().isoformat()
+
+
+STAGES = [
+    # Partitions roll daily, so the schema stage runs once a day; its table DDL is idempotent
+    Stage("schema", run_schema, outputs=["schema"], modules=[db_setup], extra=today),
+    Stage(
+        "seed", run_seed, inputs=["schema"],
+        outputs=["stores", "products", "inventory", "fulfillment_centers", "vehicles", "sales"],
+        modules=[seed_data], when=lambda pipeline: pipeline.seed or pipeline.database_empty()
+    ),
+    Stage(
+        "forecast", demand_forecasting.run_forecasting, inputs=["schema", "sales", "inventory", "products", "stores"],
+        outputs=["forecasts", "reorder_alerts"], modules=[demand_forecasting]
+    ),
+    Stage(
+        "routes", route_optimization.optimize_routes,
+        inputs=["schema", "reorder_alerts", "stores", "fulfillment_centers", "vehicles"],
+        outputs=["delivery_routes", "logistics_metrics", "dropped_deliveries"],
+        modules=[route_optimization, road_distance]
+    ),
+    Stage(
+        "replenishment", replenishment_allocation.allocate,
+        inputs=["schema", "reorder_alerts", "stores", "products", "fc_stock", "dropped_deliveries"],
+        outputs=["replenishment_allocations"], modules=[replenishment_allocation]
+    ),
+    Stage(
+        "compaction", run_compaction, inputs=["schema", "cold_tracking_logs"], outputs=["tracking_segments"],
+        modules=[tracking_compaction], extra=today
+    ),
+]
+
+
+def build_dag(stages):
+    """Maps each stage to the stages producing its inputs; raises ValueError on duplicate producers or cycles."""
+    producers = {}
+    for stage in stages:
+        for output in stage.outputs:
+            if output in producers:
+                raise ValueError(f"{output} is produced by both {producers[output]} and {stage.name}")
+            producers[output] = stage.name
+    deps = {
+        stage.name: {producers[i] for i in stage.inputs if i in producers and producers[i] != stage.name}
+        for stage in stages
+    }
+    remaining = {name: set(d) for name, d in deps.items()}
+    while remaining:
+        ready = [name for name, d in remaining.items() if not d]
+        if not ready:
+            raise ValueError(f"Stage dependency cycle among {sorted(remaining)}")
+        for name in ready:
+            del remaining[name]
+        for d in remaining.values():
+            d.difference_update(ready)
+    return deps
+
+
+def module_hash(module):
+    with open(module.__file__, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+class Pipeline:
+    def __init__(self, stages=STAGES, workers=DEFAULT_WORKERS, force=False, seed=False, only=None):
+        self.stages = {stage.name: stage for stage in stages}
+        self.deps = build_dag(stages)
+        self.workers = workers
+        self.force = force
+        self.seed = seed
+        self.only = set(only) if only else None
+        self.run_id = uuid.uuid4().hex
+        # One pool for the whole run: stage connections (passed to the scripts, which read and write through them)
+        # and fingerprint queries
+        self.engine = create_engine(SQLALCHEMY_URI, pool_size=workers + 1, max_overflow=workers, pool_pre_ping=True)
+        self.errors = ErrorLogCounter()
+        self.code_hashes = {}
+
+    def scalar(self, query):
+        with self.engine.connect() as conn:
+            return conn.execute(text(query)).scalar()
+
+    def database_empty(self):
+        return not self.scalar("SELECT EXISTS (SELECT 1 FROM stores)")
+
+    def last_fingerprints(self):
+        if not self.scalar("SELECT to_regclass('pipeline_runs') IS NOT NULL"):
+            return {}
+        with self.engine.connect() as conn:
+            rows = conn.execute(text("""
+                SELECT DISTINCT ON (stage) stage, fingerprint
+                FROM pipeline_runs
+                WHERE status = 'success'
+                ORDER BY stage, started_at DESC
+            """)).all()
+        return dict(rows)
+
+    def fingerprint(self, stage, inputs=None):
+        """Hash of the stage's code, extra input and artifacts. inputs reuses values read before the stage ran."""
+        parts = {"code": [self.code_hashes.setdefault(m.__name__, module_hash(m)) for m in stage.modules]}
+        if stage.extra:
+            parts["extra"] = stage.extra()
+        inputs = inputs if inputs is not None else self.artifact_values(stage.inputs)
+        parts["inputs"] = inputs
+        parts["outputs"] = self.artifact_values(stage.outputs)
+        return hashlib.sha256(json.dumps(parts, sort_keys=True, default=str).encode()).hexdigest(), inputs
+
+    def artifact_values(self, names):
+        values = {}
+        for name in names:
+            if name == "schema":
+                values[name] = self.code_hashes.setdefault(db_setup.__name__, module_hash(db_setup))
+            elif name in ARTIFACTS:
+                artifact = ARTIFACTS[name]
+                values[name] = artifact() if callable(artifact) else self.scalar(artifact)
+        return values
+
+    def record(self, result, started_at):
+        with self.engine.begin() as conn:
+            conn.execute(text("""
+                INSERT INTO pipeline_runs (run_id, stage, status, fingerprint, started_at, wall_time_s, detail)
+                VALUES (:run_id, :stage, :status, :fingerprint, :started_at, :wall, :detail)
+            """), {
+                "run_id": self.run_id, "stage": result.stage, "status": result.status,
+                "fingerprint": result.fingerprint, "started_at": started_at, "wall": result.wall_time_s,
+                "detail": result.detail[:1000]
+            })
+
+    def run_stage(self, stage, previous):
+        started_at = datetime.now()
+        started = time.perf_counter()
+        if stage.when and not stage.when(self):
+            return StageResult(stage.name, "skipped", time.perf_counter() - started, detail="not requested")
+        fingerprint, inputs = self.fingerprint(stage)
+        if not self.force and fingerprint == previous.get(stage.name):
+            result = StageResult(stage.name, "skipped", time.perf_counter() - started, fingerprint, "inputs unchanged")
+            self.record(result, started_at)
+            return result
+
+        logging.info(f"Running stage {stage.name}")
+        thread = threading.get_ident()
+        errors_before = self.errors.counts.get(thread, 0)
+        conn = self.engine.raw_connection()
+        try:
+            ok = stage.run(conn)
+            conn.commit()
+            failed = self.errors.counts.get(thread, 0) - errors_before
+            if ok is False:
+                status, detail, fingerprint = "failed", "stage reported failure", None
+            elif failed:
+                status, detail = "failed", f"{failed} errors logged"
+                fingerprint = None
+            else:
+                self.flush_stats(conn)
+                status, detail = "success", ""
+                # Recorded against the outputs as the stage left them, so the next run can compare
+                fingerprint, _ = self.fingerprint(stage, inputs)
+        except Exception as e:
+            logging.error(f"Stage {stage.name} raised: {e}")
+            conn.rollback()
+            status, detail, fingerprint = "failed", str(e), None
+        finally:
+            conn.close()  # Back to the pool
+        result = StageResult(stage.name, status, time.perf_counter() - started, fingerprint, detail)
+        self.record(result, started_at)
+        return result
+
+    def flush_stats(self, conn):
+        """
+        Publishes the stage connection's pending table counters (PostgreSQL 15+ batches them for up to a second), so
+        the change_watermark values recorded with the fingerprint include the stage's own writes.
+        """
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT pg_stat_force_next_flush();")
+            conn.commit()  # The flush happens as the backend goes idle, before the commit returns
+        except Exception as e:
+            conn.rollback()
+            logging.debug(f"Statistics flush unavailable: {e}")
+
+    def run(self):
+        started = time.perf_counter()
+        logging.getLogger().addHandler(self.errors)
+        results = {}
+        try:
+            previous = self.last_fingerprints()
+            pending = {name: set(d) for name, d in self.deps.items()}
+            with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="stage") as pool:
+                running = {}
+                while pending or running:
+                    for name in [n for n, d in pending.items() if all(x in results for x in d)]:
+                        del pending[name]
+                        if any(results[d].status in ("failed", "blocked") for d in self.deps[name]):
+                            results[name] = StageResult(name, "blocked", detail="an upstream stage failed")
+                        elif self.only is not None and name not in self.only:
+                            results[name] = StageResult(name, "skipped", detail="not selected")
+                        else:
+                            running[pool.submit(self.run_stage, self.stages[name], previous)] = name
+                    if not running:
+                        continue
+                    done, _ = wait(running, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        name = running.pop(future)
+                        try:
+                            results[name] = future.result()
+                        except Exception as e:
+                            logging.error(f"Stage {name} could not be run: {e}")
+                            results[name] = StageResult(name, "failed", detail=str(e))
+        finally:
+            logging.getLogger().removeHandler(self.errors)
+
+        total = time.perf_counter() - started
+        for name in self.stages:
+            r = results.get(name)
+            if r:
+                logging.info(f"{name:<12} {r.status:<8} {r.wall_time_s:8.2f} s  {r.detail}")
+        logging.info(f"Pipeline {self.run_id} finished in {total:.2f} s")
+        self.notify(results, total)
+        self.engine.dispose()
+        return results
+
+    def notify(self, results, total):
+        changed = sorted({o for r in results.values() if r.status == "success" for o in self.stages[r.stage].outputs})
+        payload = json.dumps({
+            "run_id": self.run_id,
+            "stages": {name: r.status for name, r in results.items()},
+            "changed": changed,
+            "wall_time_s": round(total, 3),
+        })
+        try:
+            with self.engine.begin() as conn:
+                conn.execute(text("SELECT pg_notify(:channel, :payload)"), {"channel": PIPELINE_CHANNEL, "payload": payload})
+        except Exception as e:
+            logging.error(f"Error notifying {PIPELINE_CHANNEL}: {e}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run the SmartInventory pipeline")
+    parser.add_argument("--force", action="store_true", help="Run stages even if their inputs are unchanged")
+    parser.add_argument("--seed", action="store_true", help="Reseed demo data (truncates every table)")
+    parser.add_argument("--stages", nargs="+", choices=[s.name for s in STAGES], help="Only run these stages")
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS, help="Stages run concurrently")
+    args = parser.parse_args()
+    results = Pipeline(workers=args.workers, force=args.force, seed=args.seed, only=args.stages).run()
+    sys.exit(1 if any(r.status in ("failed", "blocked") for r in results.values()) else 0)
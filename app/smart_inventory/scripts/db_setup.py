@@ -1,16 +1,66 @@
 """
 db_setup.py
 Purpose: Creates PostgreSQL databases and tables for RetailChain OS, supporting walmart_db (SmartInventory, RouteAI, TrackX) and postgres (Fulfillment).
+sales and tracking_logs are range-partitioned (monthly / daily); create_future_partitions() keeps partitions ahead of today.
 Execution: Run before seed_data.py.
 Command: python app/smart_inventory/db_setup.py
 """
 import psycopg2
 from psycopg2 import sql
 from psycopg2.extensions import ISOLATION_LEVEL_AUTOCOMMIT
+from datetime import date, timedelta
 from dotenv import dotenv_values
 
 ENV_VALUES = dotenv_values(".env")
 
+SALES_MONTHS_BACK = 24
+SALES_MONTHS_AHEAD = 3
+TRACKING_DAYS_BACK = 2  # Covers tracking_compaction.HOT_HOURS; older days are compacted and dropped, not recreated
+TRACKING_DAYS_AHEAD = 7
+
+# Indexes, default partitions and the partition maintenance function for the range-partitioned sales (monthly) and
+# tracking_logs (daily) tables. B-tree indexes serve get_sales_data and latest-position lookups; BRIN indexes keep
+# time-range scans cheap on the append-only history.
+PARTITIONING_SQL = """
+    CREATE TABLE IF NOT EXISTS sales_default PARTITION OF sales DEFAULT;
+    CREATE INDEX IF NOT EXISTS sales_store_sku_date_idx ON sales (store_id, sku_id, sale_date);
+    CREATE INDEX IF NOT EXISTS sales_sale_date_brin ON sales USING BRIN (sale_date);
+
+    CREATE TABLE IF NOT EXISTS tracking_logs_default PARTITION OF tracking_logs DEFAULT;
+    CREATE INDEX IF NOT EXISTS tracking_logs_vehicle_ts_idx ON tracking_logs (vehicle_id, timestamp DESC);
+    CREATE INDEX IF NOT EXISTS tracking_logs_ts_brin ON tracking_logs USING BRIN (timestamp);
+
+    -- Creates parent_YYYYMM (step 'month') or parent_YYYYMMDD (step 'day') partitions covering [from_ts, to_ts).
+    -- Rows already sitting in parent_default for a new range are moved into the partition before it is attached.
+    CREATE OR REPLACE FUNCTION ensure_partitions(parent TEXT, key_column TEXT, step TEXT, from_ts TIMESTAMP, to_ts TIMESTAMP)
+    RETURNS INTEGER AS $$
+    DECLARE
+        bucket TIMESTAMP := date_trunc(step, from_ts);
+        upper_bound TIMESTAMP;
+        part TEXT;
+        created INTEGER := 0;
+    BEGIN
+        WHILE bucket < to_ts LOOP
+            upper_bound := bucket + ('1 ' || step)::INTERVAL;
+            part := parent || '_' || to_char(bucket, CASE WHEN step = 'month' THEN 'YYYYMM' ELSE 'YYYYMMDD' END);
+            IF to_regclass(part) IS NULL THEN
+                EXECUTE format('CREATE TABLE %I (LIKE %I INCLUDING DEFAULTS INCLUDING CONSTRAINTS)', part, parent);
+                IF to_regclass(parent || '_default') IS NOT NULL THEN
+                    EXECUTE format(
+                        'WITH moved AS (DELETE FROM %I WHERE %I >= %L AND %I < %L RETURNING *) INSERT INTO %I SELECT * FROM moved',
+                        parent || '_default', key_column, bucket, key_column, upper_bound, part
+                    );
+                END IF;
+                EXECUTE format('ALTER TABLE %I ATTACH PARTITION %I FOR VALUES FROM (%L) TO (%L)', parent, part, bucket, upper_bound);
+                created := created + 1;
+            END IF;
+            bucket := upper_bound;
+        END LOOP;
+        RETURN created;
+    END;
+    $$ LANGUAGE plpgsql;
+"""
+
 def create_databases():
     try:
         conn = psycopg2.connect(
@@ -33,18 +83,12 @@ def create_databases():
         if conn:
             conn.close()
 
-def create_tables():
-    try:
-        conn = psycopg2.connect(
-            dbname="walmart_db",
-            user="walmart_user",
-            password=ENV_VALUES.get("DB_USER_PASSWORD", "securepassword"),
-            host="localhost",
-            port="5432"
-        )
-        cur = conn.cursor()
-
-        cur.execute("""
+def create_schema(cur):
+    """
+    Runs the walmart_db DDL on cur without committing, so it can be part of a larger transaction. Returns True when
+    sales and tracking_logs are partitioned, in which case their indexes and ensure_partitions() are created too.
+    """
+    cur.execute("""
             CREATE TABLE IF NOT EXISTS stores (
                 store_id SERIAL PRIMARY KEY,
                 store_location VARCHAR(100) NOT NULL,
@@ -133,13 +177,14 @@ def create_tables():
             );
 
             CREATE TABLE IF NOT EXISTS tracking_logs (
-                log_id SERIAL PRIMARY KEY,
+                log_id BIGSERIAL,
                 vehicle_id INTEGER,
                 latitude FLOAT,
                 longitude FLOAT,
-                timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                timestamp TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+                PRIMARY KEY (log_id, timestamp),
                 FOREIGN KEY (vehicle_id) REFERENCES vehicles(vehicle_id)
-            );
+            ) PARTITION BY RANGE (timestamp);
 
             CREATE TABLE IF NOT EXISTS logistics_metrics (
                 metric_id SERIAL PRIMARY KEY,
@@ -150,14 +195,15 @@ def create_tables():
             );
 
             CREATE TABLE IF NOT EXISTS sales (
-                sale_id SERIAL PRIMARY KEY,
+                sale_id BIGSERIAL,
                 sku_id INTEGER,
                 store_id INTEGER,
-                sale_date DATE,
+                sale_date DATE NOT NULL,
                 quantity INTEGER,
+                PRIMARY KEY (sale_id, sale_date),
                 FOREIGN KEY (sku_id) REFERENCES products(sku_id),
                 FOREIGN KEY (store_id) REFERENCES stores(store_id)
-            );
+            ) PARTITION BY RANGE (sale_date);
 
             CREATE TABLE IF NOT EXISTS InventoryItem (
                 id SERIAL PRIMARY KEY,
@@ -166,20 +212,158 @@ def create_tables():
                 fulfillment_center_id INTEGER,
                 FOREIGN KEY (fulfillment_center_id) REFERENCES FulfillmentCenter(id)
             );
+
+            CREATE TABLE IF NOT EXISTS dropped_deliveries (
+                store_id INTEGER PRIMARY KEY,
+                demand INTEGER NOT NULL,
+                priority_score FLOAT,
+                times_dropped INTEGER DEFAULT 1,
+                dropped_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                FOREIGN KEY (store_id) REFERENCES stores(store_id)
+            );
+
+            -- Compacted tracking_logs history: one row per vehicle hour (or trip within it). path holds the
+            -- delta/varint-encoded points (see tracking_compaction.py); resolution_s is 0 for full-resolution segments.
+            CREATE TABLE IF NOT EXISTS tracking_segments (
+                segment_id BIGSERIAL PRIMARY KEY,
+                vehicle_id INTEGER,
+                start_time TIMESTAMP NOT NULL,
+                end_time TIMESTAMP NOT NULL,
+                point_count INTEGER NOT NULL,
+                resolution_s INTEGER NOT NULL DEFAULT 0,
+                path BYTEA NOT NULL,
+                FOREIGN KEY (vehicle_id) REFERENCES vehicles(vehicle_id)
+            );
+            CREATE INDEX IF NOT EXISTS tracking_segments_vehicle_time_idx ON tracking_segments (vehicle_id, start_time);
+            CREATE INDEX IF NOT EXISTS tracking_segments_end_time_brin ON tracking_segments USING BRIN (end_time);
+            -- Varint deltas do not compress further; skip TOAST compression attempts
+            ALTER TABLE tracking_segments ALTER COLUMN path SET STORAGE EXTERNAL;
+
+            -- Nightly allocation lines from replenishment_allocation.py. fc_id and inventory_item_id refer to the
+            -- fulfill_smart database, where the stock of 'reserved' lines is held until the next run re-solves them;
+            -- 'shipped' lines have left the FC and are kept; 'unmet' rows record shortfalls left unsourced.
+            CREATE TABLE IF NOT EXISTS replenishment_allocations (
+                allocation_id SERIAL PRIMARY KEY,
+                store_id INTEGER NOT NULL,
+                sku_id INTEGER NOT NULL,
+                fc_id INTEGER,
+                inventory_item_id INTEGER,
+                quantity INTEGER NOT NULL,
+                unit_score FLOAT,
+                status VARCHAR(20) NOT NULL DEFAULT 'reserved',
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                FOREIGN KEY (store_id) REFERENCES stores(store_id),
+                FOREIGN KEY (sku_id) REFERENCES products(sku_id)
+            );
+            ALTER TABLE replenishment_allocations
+                DROP CONSTRAINT IF EXISTS replenishment_allocations_fc_id_fkey,
+                DROP CONSTRAINT IF EXISTS replenishment_allocations_inventory_item_id_fkey;
+            CREATE INDEX IF NOT EXISTS replenishment_allocations_status_idx ON replenishment_allocations (status);
+
+            -- One row per stage per orchestrator run (main.py). fingerprint hashes the stage's code, inputs and outputs
+            -- after a successful run; an unchanged fingerprint lets the next run skip the stage.
+            CREATE TABLE IF NOT EXISTS pipeline_runs (
+                id BIGSERIAL PRIMARY KEY,
+                run_id VARCHAR(32) NOT NULL,
+                stage VARCHAR(50) NOT NULL,
+                status VARCHAR(20) NOT NULL,
+                fingerprint VARCHAR(64),
+                started_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+                wall_time_s FLOAT,
+                detail TEXT
+            );
+            CREATE INDEX IF NOT EXISTS pipeline_runs_stage_idx ON pipeline_runs (stage, started_at DESC);
         """)
+    if is_partitioned(cur, "sales") and is_partitioned(cur, "tracking_logs"):
+        cur.execute(PARTITIONING_SQL)
+        return True
+    return False
+
+def create_tables(conn=None):
+    """Creates the walmart_db tables, on conn when given (e.g. a pooled connection). Returns False on error."""
+    own_conn = conn is None
+    cur = None
+    try:
+        if own_conn:
+            conn = psycopg2.connect(
+                dbname="walmart_db",
+                user="walmart_user",
+                password=ENV_VALUES.get("DB_USER_PASSWORD", "securepassword"),
+                host="localhost",
+                port="5432"
+            )
+        cur = conn.cursor()
+        if not create_schema(cur):
+            print("sales/tracking_logs are plain tables; run partition_migration.py to partition them")
 
         conn.commit()
         print("Tables created successfully")
+        return True
     except Exception as e:
         print(f"Error creating tables: {e}")
         if conn:
             conn.rollback()
+        return False
     finally:
         if cur:
             cur.close()
+        if own_conn and conn:
+            conn.close()
+
+def is_partitioned(cur, table):
+    cur.execute(
+        "SELECT EXISTS (SELECT 1 FROM pg_partitioned_table p JOIN pg_class c ON c.oid = p.partrelid WHERE c.relname = %s)",
+        (table,)
+    )
+    return cur.fetchone()[0]
+
+def create_partitions(cur, table, column, step, start, end):
+    """Creates the missing table_YYYYMM / table_YYYYMMDD partitions covering [start, end); returns how many."""
+    cur.execute("SELECT ensure_partitions(%s, %s, %s, %s, %s)", (table, column, step, start, end))
+    return cur.fetchone()[0]
+
+def create_future_partitions(conn=None):
+    """
+    Creates sales (monthly) and tracking_logs (daily) partitions around today. Idempotent; run it nightly so inserts
+    never land in the default partitions. Returns how many were created, or None on error.
+    """
+    own_conn = conn is None
+    cur = None
+    try:
+        if own_conn:
+            conn = psycopg2.connect(
+                dbname="walmart_db",
+                user="walmart_user",
+                password=ENV_VALUES.get("DB_USER_PASSWORD", "securepassword"),
+                host="localhost",
+                port="5432"
+            )
+        cur = conn.cursor()
+        today = date.today()
+        first_month = date(today.year, today.month, 1)
+        created = create_partitions(
+            cur, "sales", "sale_date", "month",
+            first_month - timedelta(days=31 * SALES_MONTHS_BACK), first_month + timedelta(days=31 * SALES_MONTHS_AHEAD)
+        )
+        created += create_partitions(
+            cur, "tracking_logs", "timestamp", "day",
+            today - timedelta(days=TRACKING_DAYS_BACK), today + timedelta(days=TRACKING_DAYS_AHEAD + 1)
+        )
+        conn.commit()
+        print(f"Created {created} partitions")
+        return created
+    except Exception as e:
+        print(f"Error creating partitions: {e}")
         if conn:
+            conn.rollback()
+        return None
+    finally:
+        if cur:
+            cur.close()
+        if own_conn and conn:
             conn.close()
 
 if __name__ == "__main__":
     create_databases()
     create_tables()
+    create_future_partitions()
@@ -5,7 +5,6 @@ Execution: Run after seed_data.py.
 Command: python app/smart_inventory/demand_forecasting.py
 """
 import pandas as pd
-from sqlalchemy import create_engine
 import psycopg2
 from datetime import datetime, timedelta
 import logging
@@ -20,10 +19,13 @@ DB_PARAMS = {
     "port": "5432"
 }
 
-SQLALCHEMY_URI = f"postgresql+psycopg2://{DB_PARAMS['user']}:{DB_PARAMS['password']}@{DB_PARAMS['host']}:{DB_PARAMS['port']}/{DB_PARAMS['dbname']}"
-engine = create_engine(SQLALCHEMY_URI)
+def read_frame(conn, query, params=None):
+    """Runs a read on conn (a DBAPI connection) and returns the rows as a DataFrame."""
+    with conn.cursor() as cur:
+        cur.execute(query, params)
+        return pd.DataFrame(cur.fetchall(), columns=[d[0] for d in cur.description])
 
-def get_sales_data(sku_id, store_id):
+def get_sales_data(sku_id, store_id, conn):
     try:
         query = """
             SELECT sale_date AS ds, quantity AS y
@@ -31,7 +33,7 @@ def get_sales_data(sku_id, store_id):
             WHERE sku_id = %s AND store_id = %s
             ORDER BY sale_date;
         """
-        df = pd.read_sql(query, engine, params=(sku_id, store_id))
+        df = read_frame(conn, query, (sku_id, store_id))
         if df.empty:
             logging.warning(f"No sales data for SKU {sku_id}, store {store_id}")
             return pd.DataFrame()
@@ -45,7 +47,7 @@ def get_sales_data(sku_id, store_id):
 def forecast_sku(sku_id, store_id, conn, cur):
     logging.info(f"Forecasting SKU {sku_id} for store {store_id}")
     try:
-        sales_df = get_sales_data(sku_id, store_id)
+        sales_df = get_sales_data(sku_id, store_id, conn)
         if sales_df.empty:
             return
         avg_daily_sales = sales_df['y'].mean()
@@ -71,7 +73,7 @@ def generate_reorder_alerts(conn, cur):
             JOIN inventory i ON f.store_id = i.store_id AND f.sku_id = i.sku_id
             WHERE i.store_id IS NOT NULL
         """
-        df = pd.read_sql(query, engine)
+        df = read_frame(conn, query)
         if df.empty:
             logging.warning("No forecast data for reorder alerts")
             return
@@ -99,14 +101,23 @@ def generate_reorder_alerts(conn, cur):
     except Exception as e:
         logging.error(f"Error generating reorder alerts: {e}")
 
-def run_forecasting():
+def run_forecasting(conn=None):
+    """
+    Recomputes forecasts and reorder alerts; uses conn (e.g. from the pipeline's pool) for every read and write when
+    given. Returns False on error.
+    """
+    own_conn = conn is None
+    cur = None
     try:
-        conn = psycopg2.connect(**DB_PARAMS)
+        if own_conn:
+            conn = psycopg2.connect(**DB_PARAMS)
         cur = conn.cursor()
         cur.execute("TRUNCATE TABLE forecasts RESTART IDENTITY;")
         conn.commit()
-        sku_ids = [1, 2, 3, 4, 5]
-        store_ids = [1, 2, 3, 4, 5, 6, 7]  # Updated to 7 stores
+        cur.execute("SELECT store_id FROM stores ORDER BY store_id;")
+        store_ids = [row[0] for row in cur.fetchall()]
+        cur.execute("SELECT sku_id FROM products ORDER BY sku_id;")
+        sku_ids = [row[0] for row in cur.fetchall()]
         for store_id in store_ids:
             for sku_id in sku_ids:
                 forecast_sku(sku_id, store_id, conn, cur)
@@ -114,14 +125,16 @@ def run_forecasting():
         generate_reorder_alerts(conn, cur)
         conn.commit()
         print("Demand forecasting and reorder alerts completed successfully")
+        return True
     except Exception as e:
         logging.error(f"Error during forecasting: {e}")
         if conn:
             conn.rollback()
+        return False
     finally:
         if cur:
             cur.close()
-        if conn:
+        if own_conn and conn:
             conn.close()
 
 if __name__ == "__main__":
@@ -0,0 +1,439 @@
+"""
+eta_engine.py
+Purpose: Fleet-wide ETAs computed once per position batch instead of per request. The engine keeps every active
+vehicle's latest position and remaining stop sequence (from delivery_routes) in padded numpy arrays. Each leg's road
+distance and duration come from the road distance service once per plan, as one pair lookup over every leg of the
+fleet. On every batch of new positions it, in one
+vectorised pass over the whole fleet:
+    - advances vehicles past stops they came within ARRIVAL_RADIUS_M of
+    - estimates the approach to the next stop from the great-circle distance, scaled by that leg's road detour and
+      speed
+    - adds the precomputed suffix of leg durations plus STOP_SERVICE_S per stop
+The results are published as an immutable table with a version counter. get(vehicle_id) and eta_for_store(store_id)
+are dict lookups into it, and changed_since(version) lets dashboards poll for deltas only.
+
+Execution: Runs inside telemetry_ingest.py (--eta), which feeds it every flushed batch and serves GET /eta/<vehicle_id>;
+standalone it prints the current fleet ETAs or times a synthetic fleet.
+Command: python scripts/eta_engine.py [--benchmark 5000]
+"""
+import math
+import time
+import logging
+import argparse
+import threading
+import numpy as np
+import pandas as pd
+from sqlalchemy import create_engine, text
+from dotenv import dotenv_values
+
+from road_distance import get_road_service, DETOUR_FACTOR, AVERAGE_SPEED_KMH, RoadDistanceService, HaversineBackend
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+ENV_VALUES = dotenv_values(".env")
+
+DB_PARAMS = {
+    "dbname": "walmart_db",
+    "user": "walmart_user",
+    "password": ENV_VALUES.get("DB_USER_PASSWORD", "securepassword"),
+    "host": "localhost",
+    "port": "5432"
+}
+
+SQLALCHEMY_URI = f"postgresql+psycopg2://{DB_PARAMS['user']}:{DB_PARAMS['password']}@{DB_PARAMS['host']}:{DB_PARAMS['port']}/{DB_PARAMS['dbname']}"
+engine = create_engine(SQLALCHEMY_URI)
+
+ARRIVAL_RADIUS_M = 150
+STOP_SERVICE_S = 15 * 60  # Same 15 min per stop as estimated_time in route_optimization.py
+POSITION_MAX_AGE_H = 48  # Older positions are ignored on load; the vehicle is assumed at its depot
+MIN_LEG_KM = 0.05  # Legs shorter than this use the default detour factor and speed
+EARTH_RADIUS_M = 6_371_000
+
+
+def haversine_m(lat1, lng1, lat2, lng2):
+    """Element-wise great-circle distance in metres over broadcastable arrays."""
+    lat1, lng1, lat2, lng2 = (np.radians(a) for a in (lat1, lng1, lat2, lng2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lng2 - lng1) / 2) ** 2
+    return 2 * EARTH_RADIUS_M * np.arcsin(np.sqrt(np.clip(a, 0, 1)))
+
+
+class EtaEngine:
+    """
+    Arrays are indexed [vehicle row, stop column]; vehicle rows follow the sorted vehicle_ids so batches are mapped
+    with searchsorted. Column k of the leg arrays is the leg that ends at stop k (stop 0's leg starts at the depot).
+    """
+
+    def __init__(self, service=None, arrival_radius_m=ARRIVAL_RADIUS_M, service_time_s=STOP_SERVICE_S):
+        self.service = service or get_road_service()
+        self.arrival_radius_m = arrival_radius_m
+        self.service_time_s = service_time_s
+        self.lock = threading.Lock()  # Serialises writers; readers only dereference self.table once
+        self.version = 0
+        self.table = None
+        self.plan_watermark = None
+        self.set_plan(pd.DataFrame(columns=["vehicle_id", "sequence", "store_id", "lat", "lng", "depot_lat", "depot_lng"]))
+
+    # Plan
+
+    def set_plan(self, routes, positions=None):
+        """
+        routes: one row per stop with vehicle_id, sequence, store_id, lat, lng, depot_lat, depot_lng.
+        positions: optional vehicle_id, latitude, longitude, ts (epoch seconds) of the latest known positions.
+        """
+        with self.lock:
+            routes = routes.sort_values(["vehicle_id", "sequence"]).drop_duplicates(["vehicle_id", "store_id"])
+            vehicle_ids = np.unique(routes["vehicle_id"].to_numpy(dtype=np.int64))
+            rows = np.searchsorted(vehicle_ids, routes["vehicle_id"].to_numpy(dtype=np.int64))
+            n_stops = np.bincount(rows, minlength=len(vehicle_ids))
+            V, S = len(vehicle_ids), int(n_stops.max(initial=0))
+            cols = np.arange(len(routes)) - np.repeat(np.cumsum(n_stops) - n_stops, n_stops)
+
+            stop_lat = np.full((V, S), np.nan)
+            stop_lng = np.full((V, S), np.nan)
+            store_ids = np.full((V, S), -1, dtype=np.int64)
+            stop_lat[rows, cols] = routes["lat"].to_numpy(dtype=float)
+            stop_lng[rows, cols] = routes["lng"].to_numpy(dtype=float)
+            store_ids[rows, cols] = routes["store_id"].to_numpy(dtype=np.int64)
+            first = np.cumsum(n_stops) - n_stops
+            depot = routes[["depot_lat", "depot_lng"]].to_numpy(dtype=float)[first] if V else np.empty((0, 2))
+            depot = np.where(np.isnan(depot), np.column_stack((stop_lat[:, :1], stop_lng[:, :1])), depot) if V else depot
+
+            # Leg k runs from the previous stop (the depot for k = 0) to stop k
+            from_lat = np.column_stack((depot[:, 0], stop_lat[:, :-1])) if S else stop_lat
+            from_lng = np.column_stack((depot[:, 1], stop_lng[:, :-1])) if S else stop_lng
+            valid = np.arange(S) < n_stops[:, None]
+            straight_km = haversine_m(from_lat, from_lng, stop_lat, stop_lng) / 1000
+            self.leg_km = np.zeros((V, S))
+            self.leg_s = np.zeros((V, S))
+            self.leg_km[valid], self.leg_s[valid] = self.road_legs(
+                from_lat[valid], from_lng[valid], stop_lat[valid], stop_lng[valid]
+            )
+            long_leg = valid & (straight_km > MIN_LEG_KM) & (self.leg_s > 0)
+            self.detour = np.full((V, S), DETOUR_FACTOR)
+            self.speed_mps = np.full((V, S), AVERAGE_SPEED_KMH / 3.6)
+            self.detour[long_leg] = np.maximum(1.0, self.leg_km[long_leg] / straight_km[long_leg])
+            self.speed_mps[long_leg] = self.leg_km[long_leg] * 1000 / self.leg_s[long_leg]
+
+            # Inclusive prefix sums: value at k covers legs 0..k, so stops k..j cost cum[j] - cum[k]
+            self.cum_km = np.cumsum(self.leg_km, axis=1)
+            self.cum_s = np.cumsum(self.leg_s, axis=1)
+            self.total_km = self.cum_km[:, -1] if S else np.zeros(V)
+
+            self.vehicle_ids = vehicle_ids
+            self.vehicle_row = {int(v): i for i, v in enumerate(vehicle_ids)}
+            self.store_ids = store_ids
+            self.stop_lat = stop_lat
+            self.stop_lng = stop_lng
+            self.from_lat = from_lat
+            self.from_lng = from_lng
+            self.n_stops = n_stops
+            self.valid = valid
+            self.stop_index = {}
+            for v, k in zip(*np.nonzero(valid)):
+                self.stop_index.setdefault(int(store_ids[v, k]), []).append((int(v), int(k)))
+
+            now = time.time()
+            self.lat = depot[:, 0].copy()
+            self.lng = depot[:, 1].copy()
+            self.seen = np.full(V, -np.inf)
+            self.arrived_at = np.full((V, S), np.nan)
+            self.updated_version = np.zeros(V, dtype=np.int64)
+            if positions is not None and len(positions):
+                self._apply(positions["vehicle_id"], positions["latitude"], positions["longitude"], positions["ts"])
+            # Vehicles without a recent position count as leaving their depot now
+            self.seen[np.isinf(self.seen)] = now
+            self.next_stop = self.nearest_leg()
+            self._publish(np.ones(V, dtype=bool))
+        logging.info(f"ETA plan loaded: {V} vehicles, {int(n_stops.sum())} stops")
+
+    def road_legs(self, from_lat, from_lng, to_lat, to_lng):
+        """Road (km, s) of each leg from (from_lat, from_lng) to (to_lat, to_lng); only these pairs are requested."""
+        if not len(from_lat):
+            return np.empty(0), np.empty(0)
+        km, seconds = self.service.pairs(np.column_stack((from_lat, from_lng)), np.column_stack((to_lat, to_lng)))
+        # Unroutable legs fall back to the haversine estimate rather than an infinite ETA
+        missing = ~np.isfinite(km) | ~np.isfinite(seconds)
+        if missing.any():
+            fallback = haversine_m(from_lat[missing], from_lng[missing], to_lat[missing], to_lng[missing]) / 1000 * DETOUR_FACTOR
+            km[missing] = fallback
+            seconds[missing] = fallback / AVERAGE_SPEED_KMH * 3600
+        return km, seconds
+
+    def nearest_leg(self):
+        """
+        Next stop for vehicles whose progress is unknown (plan load, restart mid-route): the end of the route leg closest
+        to the current position, using an equirectangular projection around the vehicle.
+        """
+        V, S = self.store_ids.shape
+        if not S:
+            return np.zeros(V, dtype=np.int64)
+        scale = np.cos(np.radians(self.lat))[:, None]
+        ax, ay = (self.from_lng - self.lng[:, None]) * scale, self.from_lat - self.lat[:, None]
+        bx, by = (self.stop_lng - self.lng[:, None]) * scale, self.stop_lat - self.lat[:, None]
+        dx, dy = bx - ax, by - ay
+        length2 = dx * dx + dy * dy
+        t = np.clip(-(ax * dx + ay * dy) / np.where(length2 > 0, length2, 1), 0, 1)
+        offset = np.hypot(ax + t * dx, ay + t * dy)
+        offset[~self.valid] = np.inf
+        return np.argmin(offset, axis=1).astype(np.int64)
+
+    # Positions
+
+    def _apply(self, vehicle_ids, lat, lng, ts):
+        """Writes the latest position per known vehicle into the arrays; returns the touched row mask."""
+        vehicle_ids = np.asarray(vehicle_ids, dtype=np.int64)
+        ts = np.asarray(ts, dtype=float)
+        touched = np.zeros(len(self.vehicle_ids), dtype=bool)
+        if not len(self.vehicle_ids) or not len(vehicle_ids):
+            return touched
+        rows = np.searchsorted(self.vehicle_ids, vehicle_ids).clip(0, len(self.vehicle_ids) - 1)
+        known = self.vehicle_ids[rows] == vehicle_ids
+        order = np.argsort(ts, kind="stable")
+        order = order[known[order]]
+        rows = rows[order]
+        fresh = ts[order] >= self.seen[rows]
+        rows, order = rows[fresh], order[fresh]
+        # Fancy assignment keeps the last write per row, which is the newest after sorting by ts
+        self.lat[rows] = np.asarray(lat, dtype=float)[order]
+        self.lng[rows] = np.asarray(lng, dtype=float)[order]
+        self.seen[rows] = ts[order]
+        touched[rows] = True
+        return touched
+
+    def update_positions(self, vehicle_ids, lat, lng, ts):
+        """Applies a batch of positions and recomputes the whole fleet in one pass. Returns the new version."""
+        with self.lock:
+            touched = self._apply(vehicle_ids, lat, lng, ts)
+            if not touched.any():
+                return self.version
+            S = self.store_ids.shape[1]
+            rows = np.flatnonzero(touched)
+            if S:
+                # Any pending stop within the radius counts, so stops passed between two pings are not waited on
+                distance_m = haversine_m(self.lat[rows, None], self.lng[rows, None], self.stop_lat[rows], self.stop_lng[rows])
+                pending = self.valid[rows] & (np.arange(S) >= self.next_stop[rows, None])
+                at_stop = pending & (distance_m < self.arrival_radius_m)
+                reached = at_stop.any(axis=1)
+                if reached.any():
+                    rows = rows[reached]
+                    last = S - 1 - np.argmax(at_stop[reached, ::-1], axis=1)
+                    self.arrived_at[rows, last] = self.seen[rows]
+                    self.next_stop[rows] = last + 1
+            self._publish(touched)
+            return self.version
+
+    def _publish(self, touched):
+        """Computes remaining distance and per-stop ETAs for every vehicle and swaps in a new table."""
+        V, S = self.store_ids.shape
+        rows = np.arange(V)
+        now = time.time()
+        # A stale position says where the vehicle was, not when it leaves: the remaining trip starts no earlier than now
+        base = np.maximum(self.seen, now)
+        active = self.next_stop < self.n_stops
+        k = np.minimum(self.next_stop, max(S - 1, 0))
+        if S:
+            straight_m = haversine_m(self.lat, self.lng, self.stop_lat[rows, k], self.stop_lng[rows, k])
+            approach_km = np.where(active, straight_m * self.detour[rows, k] / 1000, 0)
+            approach_s = np.where(active, straight_m * self.detour[rows, k] / self.speed_mps[rows, k], 0)
+            done_km = self.cum_km[rows, k]
+            done_s = self.cum_s[rows, k]
+            columns = np.arange(S)
+            ahead = self.valid & (columns >= self.next_stop[:, None])
+            stop_eta = (
+                base[:, None] + approach_s[:, None] + (self.cum_s - done_s[:, None])
+                + self.service_time_s * (columns - k[:, None])
+            )
+            stop_eta = np.where(ahead, stop_eta, np.nan)
+            remaining_km = np.where(active, approach_km + self.total_km - done_km, 0)
+            last = np.maximum(self.n_stops - 1, 0)
+            final_eta = np.where(active, stop_eta[rows, last], np.nan)
+        else:
+            stop_eta = np.empty((V, 0))
+            remaining_km = np.zeros(V)
+            final_eta = np.full(V, np.nan)
+
+        self.version += 1
+        self.updated_version = np.where(touched, self.version, self.updated_version)
+        # Readers take self.table once and use nothing else, so the plan's index maps travel with the arrays they
+        # index. Nothing in the table is mutated after this single assignment; set_plan builds fresh plan arrays.
+        self.table = {
+            "version": self.version,
+            "vehicle_ids": self.vehicle_ids,
+            "vehicle_row": self.vehicle_row,
+            "store_ids": self.store_ids,
+            "n_stops": self.n_stops,
+            "stop_index": self.stop_index,
+            "computed_at": now,
+            "next_stop": self.next_stop.copy(),
+            "lat": self.lat.copy(),
+            "lng": self.lng.copy(),
+            "seen": self.seen.copy(),
+            "remaining_km": remaining_km,
+            "final_eta": final_eta,
+            "stop_eta": stop_eta,
+            "arrived_at": self.arrived_at.copy(),
+            "updated_version": self.updated_version,
+        }
+
+    # Reads
+
+    def get(self, vehicle_id):
+        """Precomputed ETA record for one vehicle, or None if it has no stops in the current plan."""
+        table = self.table
+        row = table["vehicle_row"].get(int(vehicle_id)) if table is not None else None
+        if row is None:
+            return None
+        store_ids = table["store_ids"]
+        n = int(table["n_stops"][row])
+        next_stop = int(table["next_stop"][row])
+        remaining_s = table["final_eta"][row] - table["computed_at"] if next_stop < n else 0.0
+        return {
+            "vehicle_id": int(vehicle_id),
+            "version": table["version"],
+            "updated_version": int(table["updated_version"][row]),
+            "position": {"lat": float(table["lat"][row]), "lng": float(table["lng"][row]),
+                         "timestamp": float(table["seen"][row])},
+            "next_store_id": int(store_ids[row, next_stop]) if next_stop < n else None,
+            "remaining_stops": n - next_stop,
+            "remaining_km": round(float(table["remaining_km"][row]), 3),
+            "eta": None if next_stop >= n else float(table["final_eta"][row]),
+            "eta_days": max(1, math.ceil(max(remaining_s, 0) / 86400)),
+            "stops": [
+                {
+                    "sequence": k + 1,
+                    "store_id": int(store_ids[row, k]),
+                    "eta": None if k < next_stop else float(table["stop_eta"][row, k]),
+                    "arrived_at": None if np.isnan(table["arrived_at"][row, k]) else float(table["arrived_at"][row, k]),
+                }
+                for k in range(n)
+            ],
+        }
+
+    def eta_for_store(self, store_id):
+        """Earliest pending arrival at a store across the vehicles serving it, or None."""
+        table = self.table
+        best = None
+        for row, k in table["stop_index"].get(int(store_id), []):
+            eta = table["stop_eta"][row, k]
+            if not np.isnan(eta) and (best is None or eta < best["eta"]):
+                best = {"store_id": int(store_id), "vehicle_id": int(table["vehicle_ids"][row]), "sequence": k + 1,
+                        "eta": float(eta), "version": table["version"]}
+        return best
+
+    def changed_since(self, version):
+        """Current version and the vehicle ids whose ETAs changed after the given version, from one table."""
+        table = self.table
+        return {
+            "version": table["version"],
+            "vehicle_ids": table["vehicle_ids"][table["updated_version"] > version].tolist(),
+        }
+
+    # Database
+
+    def load_from_db(self):
+        """Loads the current delivery_routes plan and the latest hot-window positions."""
+        try:
+            routes = pd.read_sql(
+                """
+                SELECT dr.vehicle_id, dr.sequence, dr.store_id, s.lat, s.lng,
+                       fc.latitude AS depot_lat, fc.longitude AS depot_lng
+                FROM delivery_routes dr
+                JOIN stores s ON s.store_id = dr.store_id
+                LEFT JOIN FulfillmentCenter fc ON fc.id = dr.dc_id
+                WHERE dr.vehicle_id IS NOT NULL
+                ORDER BY dr.vehicle_id, dr.sequence;
+                """,
+                engine
+            )
+            positions = pd.read_sql(
+                text("""
+                SELECT v.vehicle_id, t.latitude, t.longitude,
+                       EXTRACT(EPOCH FROM t.timestamp AT TIME ZONE current_setting('TimeZone'))::FLOAT AS ts
+                FROM unnest(CAST(:ids AS INTEGER[])) AS v (vehicle_id)
+                CROSS JOIN LATERAL (
+                    SELECT latitude, longitude, timestamp
+                    FROM tracking_logs
+                    WHERE vehicle_id = v.vehicle_id AND timestamp > LOCALTIMESTAMP - make_interval(hours => :max_age)
+                    ORDER BY timestamp DESC LIMIT 1
+                ) t;
+                """),
+                engine,
+                params={'ids': sorted(routes['vehicle_id'].unique().tolist()), 'max_age': POSITION_MAX_AGE_H}
+            )
+            self.set_plan(routes, positions)
+            self.plan_watermark = self.fetch_watermark()
+        except Exception as e:
+            logging.error(f"Error loading ETA plan: {e}")
+
+    def fetch_watermark(self):
+        with engine.connect() as conn:
+            return tuple(conn.execute(text("SELECT COUNT(*), MAX(route_id), MAX(created_at) FROM delivery_routes;")).one())
+
+    def refresh_if_changed(self):
+        """Reloads the plan when route_optimization.py or route_patching.py rewrote delivery_routes."""
+        try:
+            if self.fetch_watermark() != self.plan_watermark:
+                logging.info("delivery_routes changed, reloading ETA plan")
+                self.load_from_db()
+                return True
+        except Exception as e:
+            logging.error(f"Error checking delivery_routes for changes: {e}")
+        return False
+
+
+def synthetic_fleet(vehicles, stops_per_vehicle, seed=11):
+    """Random routes around Bengaluru for benchmarking without a database."""
+    rng = np.random.default_rng(seed)
+    n = vehicles * stops_per_vehicle
+    depot = rng.uniform([12.8, 77.4], [13.1, 77.8], size=(vehicles, 2))
+    routes = pd.DataFrame({
+        "vehicle_id": np.repeat(np.arange(1, vehicles + 1), stops_per_vehicle),
+        "sequence": np.tile(np.arange(1, stops_per_vehicle + 1), vehicles),
+        "store_id": np.arange(1, n + 1),
+        "lat": np.repeat(depot[:, 0], stops_per_vehicle) + rng.normal(0, 0.05, n),
+        "lng": np.repeat(depot[:, 1], stops_per_vehicle) + rng.normal(0, 0.05, n),
+        "depot_lat": np.repeat(depot[:, 0], stops_per_vehicle),
+        "depot_lng": np.repeat(depot[:, 1], stops_per_vehicle),
+    })
+    return routes, rng
+
+
+def benchmark(vehicles, stops_per_vehicle=20, rounds=50):
+    routes, rng = synthetic_fleet(vehicles, stops_per_vehicle)
+    eta = EtaEngine(service=RoadDistanceService(HaversineBackend()))
+    started = time.perf_counter()
+    eta.set_plan(routes)
+    logging.info(f"Plan build: {time.perf_counter() - started:.3f} s for {vehicles * stops_per_vehicle} stops")
+    ids = np.arange(1, vehicles + 1)
+    timings = []
+    for r in range(rounds):
+        lat = eta.lat + rng.normal(0, 0.001, vehicles)
+        lng = eta.lng + rng.normal(0, 0.001, vehicles)
+        started = time.perf_counter()
+        eta.update_positions(ids, lat, lng, np.full(vehicles, time.time()))
+        timings.append(time.perf_counter() - started)
+    started = time.perf_counter()
+    for v in ids[:1000]:
+        eta.get(v)
+    lookup = (time.perf_counter() - started) / min(1000, vehicles)
+    logging.info(
+        f"{vehicles} vehicles: fleet pass median {np.median(timings) * 1000:.2f} ms, "
+        f"get() {lookup * 1e6:.1f} us, version {eta.version}"
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Vectorised fleet ETA engine")
+    parser.add_argument("--benchmark", type=int, default=0, help="Time a synthetic fleet of this many vehicles")
+    args = parser.parse_args()
+    if args.benchmark:
+        benchmark(args.benchmark)
+    else:
+        eta = EtaEngine()
+        eta.load_from_db()
+        for vehicle_id in eta.vehicle_ids:
+            record = eta.get(vehicle_id)
+            logging.info(
+                f"Vehicle {record['vehicle_id']}: {record['remaining_stops']} stops, {record['remaining_km']} km left, "
+                f"next store {record['next_store_id']}, final ETA {pd.to_datetime(record['eta'], unit='s') if record['eta'] else '-'}"
+            )
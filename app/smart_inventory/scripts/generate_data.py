@@ -0,0 +1,259 @@
+"""
+generate_data.py
+Purpose: Generates a synthetic walmart_db at benchmark scale: N stores, M SKUs, D days of sales with weekly and yearly
+seasonality plus noise, K fulfillment centers, V vehicles and their tracking history. Every table is streamed in with
+COPY (binary COPY built from numpy arrays for the large ones), ids are assigned explicitly so foreign keys always
+hold, and the output depends only on the parameters and --seed. Replaces seed_data.py when testing at scale.
+
+Execution: Run after db_setup.py, instead of seed_data.py.
+Command: python scripts/generate_data.py --stores 2000 --skus 500 --days 100 --fcs 20 --vehicles 400 --workers 4
+"""
+import time
+import argparse
+import logging
+from datetime import date, datetime, timedelta
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import psycopg2
+from dotenv import dotenv_values
+
+from db_setup import create_partitions, is_partitioned
+from pg_copy import copy_binary, copy_csv
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+ENV_VALUES = dotenv_values(".env")
+
+DB_PARAMS = {
+    "dbname": "walmart_db",
+    "user": "walmart_user",
+    "password": ENV_VALUES.get("DB_USER_PASSWORD", "securepassword"),
+    "host": "localhost",
+    "port": "5432"
+}
+
+PG_EPOCH = date(2000, 1, 1)
+DEFAULT_END_DATE = date(2025, 7, 2)  # Last sale date in seed_data.py; fixed so output depends only on the seed
+SALES_ROWS_PER_BLOCK = 2_000_000
+# bcrypt of "password123" with a fixed salt; gensalt() per run would make the users table differ between runs
+PASSWORD_HASH = "$2b$12$CZgjoEMrtM4sB3WiwTyMoOC3LFMaxeYGTdmzHf.Xj0LAUj4pY2/NS"
+
+FC_ANCHORS = [(12.9716, 77.5946), (28.7041, 77.1025), (19.0760, 72.8777), (13.0827, 80.2707), (17.3850, 78.4867),
+              (22.5726, 88.3639), (23.0225, 72.5714), (26.9124, 75.7873), (18.5204, 73.8567), (21.1458, 79.0882)]
+CATEGORIES = ['Grocery', 'Personal Care', 'Household', 'Beverages', 'Snacks', 'Dairy', 'Frozen', 'Baby Care']
+VEHICLE_CAPACITIES = [800, 1000, 1200, 1500]
+WEEKDAY_FACTOR = np.array([0.90, 0.85, 0.90, 0.95, 1.10, 1.30, 1.20])  # Monday .. Sunday
+TABLES = """
+    stores, products, inventory, forecasts, reorder_alerts,
+    delivery_routes, tracking_logs, logistics_metrics, sales,
+    FulfillmentCenter, InventoryItem, vehicles, users, dropped_deliveries, tracking_segments,
+    replenishment_allocations, pipeline_runs
+"""
+
+def rng_for(seed, *stream):
+    """Independent generator per table/block, so output does not depend on block order or worker count."""
+    return np.random.default_rng([seed, *stream])
+
+
+def build_network(args):
+    """Fulfillment centers, stores (clustered around FCs) and each store's serving FC."""
+    rng = rng_for(args.seed, 1)
+    anchors = np.array(FC_ANCHORS, dtype=float)
+    fc_coords = anchors[np.arange(args.fcs) % len(anchors)]
+    fc_coords[len(anchors):] += rng.normal(0, 1.5, size=(max(0, args.fcs - len(anchors)), 2))
+    home = rng.integers(0, args.fcs, size=args.stores)
+    store_coords = fc_coords[home] + rng.normal(0, 1.2, size=(args.stores, 2))
+    store_coords[:, 0] = store_coords[:, 0].clip(8.0, 33.0)
+    store_coords[:, 1] = store_coords[:, 1].clip(69.0, 88.0)
+    return fc_coords, store_coords, home + 1
+
+
+def demand_model(args):
+    """Mean daily units per (store, sku): store size x SKU popularity (Zipf-like), plus per-category season phase."""
+    rng = rng_for(args.seed, 2)
+    store_scale = rng.lognormal(mean=0.0, sigma=0.4, size=args.stores)
+    popularity = 12.0 * (np.arange(1, args.skus + 1) ** -0.6)
+    rng.shuffle(popularity)
+    category = rng.integers(0, len(CATEGORIES), size=args.skus)
+    phase = rng.uniform(0, 2 * np.pi, size=len(CATEGORIES))[category]
+    return store_scale, popularity, category, phase
+
+
+def stores_per_sales_block(args):
+    return max(1, SALES_ROWS_PER_BLOCK // (args.skus * args.days))
+
+
+def sales_blocks(args, store_start, store_end):
+    """
+    Sales rows for stores [store_start, store_end) as binary COPY column blocks of about SALES_ROWS_PER_BLOCK.
+    store_start must be a multiple of stores_per_sales_block() so each block draws from the same generator.
+    """
+    store_scale, popularity, _, phase = demand_model(args)
+    first_day = args.end_date - timedelta(days=args.days - 1)
+    day_numbers = np.arange(args.days) + (first_day - PG_EPOCH).days
+    weekday = (np.arange(args.days) + first_day.weekday()) % 7
+    day_of_year = np.array([(first_day + timedelta(days=int(d))).timetuple().tm_yday for d in range(args.days)])
+    season = 1 + 0.25 * np.sin(2 * np.pi * day_of_year[None, :] / 365.25 + phase[:, None])  # (skus, days)
+    daily = season * WEEKDAY_FACTOR[weekday][None, :]
+    stores_per_block = stores_per_sales_block(args)
+    for block_start in range(store_start, store_end, stores_per_block):
+        block_stores = np.arange(block_start, min(block_start + stores_per_block, store_end))
+        rng = rng_for(args.seed, 3, int(block_start))
+        mean = store_scale[block_stores, None, None] * popularity[None, :, None] * daily[None, :, :]
+        noise = rng.lognormal(mean=0.0, sigma=0.15, size=mean.shape)
+        quantity = rng.poisson(mean * noise).astype(np.int32)
+        shape = quantity.shape
+        yield [
+            (np.broadcast_to(np.arange(1, args.skus + 1)[None, :, None], shape).ravel(), 'int4'),
+            (np.broadcast_to((block_stores + 1)[:, None, None], shape).ravel(), 'int4'),
+            (np.broadcast_to(day_numbers[None, None, :], shape).ravel(), 'date'),
+            (quantity.ravel(), 'int4'),
+        ]
+
+
+def load_sales_range(args, store_start, store_end):
+    """Worker entry point: COPYs one store range of sales over its own connection."""
+    conn = psycopg2.connect(**DB_PARAMS)
+    try:
+        cur = conn.cursor()
+        cur.execute("SET synchronous_commit = off;")
+        copy_binary(cur, "sales", ["sku_id", "store_id", "sale_date", "quantity"], sales_blocks(args, store_start, store_end))
+        conn.commit()
+        cur.close()
+        return (store_end - store_start) * args.skus * args.days
+    finally:
+        conn.close()
+
+
+def tracking_blocks(args, fc_coords):
+    """GPS pings every --ping-interval seconds over --tracking-days, as a random walk from each vehicle's FC."""
+    pings = int(args.tracking_days * 86400 // args.ping_interval)
+    if pings <= 0:
+        return
+    start = datetime.combine(args.end_date, datetime.min.time()) - timedelta(days=args.tracking_days)
+    start_us = int((start - datetime(2000, 1, 1)).total_seconds() * 1_000_000)
+    timestamps = start_us + np.arange(pings, dtype=np.int64) * args.ping_interval * 1_000_000
+    step_deg = args.ping_interval / 3600 * 40 / 111  # ~40 km/h average movement
+    for vehicle in range(args.vehicles):
+        rng = rng_for(args.seed, 4, vehicle)
+        origin = fc_coords[vehicle % args.fcs]
+        moving = rng.random(pings) < 0.6
+        steps = rng.normal(0, step_deg, size=(pings, 2)) * moving[:, None]
+        path = origin + np.cumsum(steps, axis=0)
+        yield [
+            (np.full(pings, vehicle + 1), 'int4'),
+            (path[:, 0], 'float8'),
+            (path[:, 1], 'float8'),
+            (timestamps, 'timestamp'),
+        ]
+
+
+def generate(args):
+    started = time.perf_counter()
+    fc_coords, store_coords, store_fc = build_network(args)
+    _, popularity, category, _ = demand_model(args)
+    conn = psycopg2.connect(**DB_PARAMS)
+    cur = conn.cursor()
+    try:
+        cur.execute("SET synchronous_commit = off;")
+        cur.execute(f"TRUNCATE TABLE {TABLES} RESTART IDENTITY CASCADE;")
+        if is_partitioned(cur, "sales") and is_partitioned(cur, "tracking_logs"):
+            day_after_end = args.end_date + timedelta(days=1)
+            created = create_partitions(cur, "sales", "sale_date", "month", day_after_end - timedelta(days=args.days), day_after_end)
+            created += create_partitions(cur, "tracking_logs", "timestamp", "day",
+                                         day_after_end - timedelta(days=args.tracking_days + 1), day_after_end)
+            logging.info(f"Created {created} partitions for the generated date range")
+
+        rng = rng_for(args.seed, 5)
+        capacity = rng.integers(300, 900, size=args.fcs) * max(1, args.stores // args.fcs)
+        workload = (capacity * rng.uniform(0.1, 0.6, size=args.fcs)).astype(int)
+        copy_csv(cur, "FulfillmentCenter", ["id", "latitude", "longitude", "current_workload", "handling_capacity"], (
+            (i + 1, round(lat, 6), round(lng, 6), int(workload[i]), int(capacity[i]))
+            for i, (lat, lng) in enumerate(fc_coords)
+        ))
+        copy_csv(cur, "stores", ["store_id", "store_location", "store_address", "lat", "lng", "verified"], (
+            (i + 1, f"Store {i + 1:06d}", f"{i + 1} Market Road", round(lat, 6), round(lng, 6), "true")
+            for i, (lat, lng) in enumerate(store_coords)
+        ))
+        copy_csv(cur, "products", ["sku_id", "name", "category"], (
+            (i + 1, f"SKU {i + 1:06d}", CATEGORIES[category[i]]) for i in range(args.skus)
+        ))
+        copy_csv(cur, "vehicles", ["vehicle_id", "capacity"], (
+            (i + 1, int(c)) for i, c in enumerate(rng.choice(VEHICLE_CAPACITIES, size=args.vehicles))
+        ))
+        copy_csv(cur, "users", ["username", "password", "role", "store_id", "vehicle_id"], [
+            *((f"store{i + 1}_owner", PASSWORD_HASH, "store_owner", i + 1, None) for i in range(args.stores)),
+            *((f"driver{i + 1}", PASSWORD_HASH, "delivery_partner", None, i + 1) for i in range(args.vehicles)),
+            ("admin", PASSWORD_HASH, "admin", None, None),
+        ])
+
+        # Store inventory: one row per (store, sku), held against the store's serving FC
+        def inventory_blocks():
+            for block_start in range(0, args.stores, max(1, SALES_ROWS_PER_BLOCK // args.skus)):
+                stores = np.arange(block_start, min(block_start + max(1, SALES_ROWS_PER_BLOCK // args.skus), args.stores))
+                block_rng = rng_for(args.seed, 6, block_start)
+                shape = (len(stores), args.skus)
+                stock = block_rng.poisson(popularity[None, :] * 10, size=shape)
+                yield [
+                    (np.broadcast_to(store_fc[stores][:, None], shape).ravel(), 'int4'),
+                    (np.broadcast_to((stores + 1)[:, None], shape).ravel(), 'int4'),
+                    (np.broadcast_to(np.arange(1, args.skus + 1)[None, :], shape).ravel(), 'int4'),
+                    (stock.ravel(), 'int4'),
+                ]
+        copy_binary(cur, "inventory", ["dc_id", "store_id", "sku_id", "current_stock"], inventory_blocks())
+
+        # FC stock: InventoryItem.sku holds the product name, as in seed_data.py
+        fc_stock = rng.poisson(popularity[None, :] * 200, size=(args.fcs, args.skus))
+        copy_csv(cur, "InventoryItem", ["sku", "quantity", "fulfillment_center_id"], (
+            (f"SKU {sku + 1:06d}", int(fc_stock[fc, sku]), fc + 1)
+            for fc in range(args.fcs) for sku in range(args.skus)
+        ))
+        copy_binary(cur, "tracking_logs", ["vehicle_id", "latitude", "longitude", "timestamp"],
+                    tracking_blocks(args, fc_coords))
+        for table, column in (("stores", "store_id"), ("products", "sku_id"), ("vehicles", "vehicle_id"),
+                              ("FulfillmentCenter", "id")):
+            cur.execute(f"SELECT setval(pg_get_serial_sequence('{table}', '{column}'), GREATEST(MAX({column}), 1)) FROM {table};")
+        conn.commit()
+        logging.info(f"Loaded dimensions and tracking history in {time.perf_counter() - started:.1f}s")
+
+        sales_started = time.perf_counter()
+        block = stores_per_sales_block(args)
+        bounds = np.linspace(0, args.stores, args.workers + 1).astype(int) // block * block
+        bounds[-1] = args.stores
+        ranges = [(int(a), int(b)) for a, b in zip(bounds, bounds[1:]) if b > a]
+        if args.workers > 1:
+            with ProcessPoolExecutor(max_workers=args.workers) as pool:
+                loaded = sum(pool.map(load_sales_range, [args] * len(ranges), *zip(*ranges)))
+        else:
+            loaded = sum(load_sales_range(args, a, b) for a, b in ranges)
+        elapsed = time.perf_counter() - sales_started
+        logging.info(f"Loaded {loaded:,} sales rows in {elapsed:.1f}s ({loaded / max(elapsed, 1e-9):,.0f} rows/s)")
+
+        cur.execute("ANALYZE;")
+        conn.commit()
+        logging.info(f"Data generation completed in {time.perf_counter() - started:.1f}s")
+    except Exception as e:
+        logging.error(f"Error generating data: {e}")
+        conn.rollback()
+    finally:
+        cur.close()
+        conn.close()
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Generate a deterministic walmart_db at benchmark scale")
+    parser.add_argument("--stores", type=int, default=1000)
+    parser.add_argument("--skus", type=int, default=200)
+    parser.add_argument("--days", type=int, default=365)
+    parser.add_argument("--fcs", type=int, default=10)
+    parser.add_argument("--vehicles", type=int, default=200)
+    parser.add_argument("--tracking-days", type=float, default=7)
+    parser.add_argument("--ping-interval", type=int, default=60, help="Seconds between tracking_logs pings")
+    parser.add_argument("--end-date", type=date.fromisoformat, default=DEFAULT_END_DATE)
+    parser.add_argument("--workers", type=int, default=1, help="Parallel COPY connections for sales")
+    parser.add_argument("--seed", type=int, default=42)
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    generate(parse_args())
@@ -0,0 +1,230 @@
+"""
+partition_migration.py
+Purpose: Migrates existing plain sales and tracking_logs tables to the partitioned, indexed layout created by
+db_setup.py, and compares query plans/timings of the hot lookups (get_sales_data per store and SKU, latest vehicle
+position) between the plain heap layout and the partitioned one.
+
+Execution: Run once on databases created before partitioning; --compare can be rerun on generated data at any time.
+Command: python scripts/partition_migration.py [--compare] [--drop-legacy]
+"""
+import json
+import argparse
+import logging
+import psycopg2
+from datetime import timedelta
+from dotenv import dotenv_values
+
+from db_setup import create_schema, create_partitions, create_future_partitions, is_partitioned
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+ENV_VALUES = dotenv_values(".env")
+
+DB_PARAMS = {
+    "dbname": "walmart_db",
+    "user": "walmart_user",
+    "password": ENV_VALUES.get("DB_USER_PASSWORD", "securepassword"),
+    "host": "localhost",
+    "port": "5432"
+}
+
+# (table, id column, partition key, partition step)
+PARTITIONED_TABLES = [
+    ("sales", "sale_id", "sale_date", "month"),
+    ("tracking_logs", "log_id", "timestamp", "day"),
+]
+
+QUERIES = {
+    "get_sales_data": """
+        SELECT sale_date AS ds, quantity AS y
+        FROM {table}
+        WHERE sku_id = %s AND store_id = %s
+        ORDER BY sale_date
+    """,
+    "latest_position": """
+        SELECT latitude, longitude, timestamp
+        FROM {table}
+        WHERE vehicle_id = %s
+        ORDER BY timestamp DESC LIMIT 1
+    """,
+    "vehicle_history_day": """
+        SELECT latitude, longitude, timestamp
+        FROM {table}
+        WHERE vehicle_id = %s AND timestamp >= %s AND timestamp < %s::timestamp + INTERVAL '1 day'
+        ORDER BY timestamp
+    """,
+}
+
+
+def table_exists(cur, table):
+    cur.execute("SELECT to_regclass(%s) IS NOT NULL", (table,))
+    return cur.fetchone()[0]
+
+
+def rename_to_legacy(cur, table, id_column):
+    """Moves a plain table and the names it owns (primary key index, serial sequence) out of the way."""
+    legacy = f"{table}_legacy"
+    cur.execute(f"ALTER TABLE {table} RENAME TO {legacy};")
+    cur.execute(f"ALTER TABLE {legacy} RENAME CONSTRAINT {table}_pkey TO {legacy}_pkey;")
+    cur.execute("SELECT pg_get_serial_sequence(%s, %s)", (legacy, id_column))
+    sequence = cur.fetchone()[0]
+    if sequence:
+        cur.execute(f"ALTER SEQUENCE {sequence} RENAME TO {legacy}_{id_column}_seq;")
+    return legacy
+
+
+def copy_legacy_rows(cur, table, id_column, key_column, step):
+    legacy = f"{table}_legacy"
+    cur.execute(f"SELECT MIN({key_column}), MAX({key_column}), COUNT(*) FILTER (WHERE {key_column} IS NULL) FROM {legacy};")
+    low, high, null_keys = cur.fetchone()
+    if low is None:
+        logging.info(f"{legacy} is empty, nothing to copy")
+        return 0
+    created = create_partitions(cur, table, key_column, step, low, high + timedelta(days=1))
+    cur.execute(f"SELECT * FROM {legacy} LIMIT 0;")
+    columns = ", ".join(desc[0] for desc in cur.description)
+    cur.execute(f"INSERT INTO {table} ({columns}) SELECT {columns} FROM {legacy} WHERE {key_column} IS NOT NULL;")
+    copied = cur.rowcount
+    cur.execute(
+        f"SELECT setval(pg_get_serial_sequence('{table}', '{id_column}'), GREATEST((SELECT MAX({id_column}) FROM {table}), 1));"
+    )
+    if null_keys:
+        logging.warning(f"Skipped {null_keys} {legacy} rows without {key_column}")
+    logging.info(f"Copied {copied} rows from {legacy} into {created} new {table} partitions")
+    return copied
+
+
+def migrate(drop_legacy=False):
+    """
+    Renames the plain tables, creates the partitioned ones and copies the rows over in a single transaction, so a
+    failure at any step leaves the original tables in place. Returns False on error.
+    """
+    conn = None
+    cur = None
+    try:
+        conn = psycopg2.connect(**DB_PARAMS)
+        cur = conn.cursor()
+        pending = [t for t in PARTITIONED_TABLES if table_exists(cur, t[0]) and not is_partitioned(cur, t[0])]
+        if not pending:
+            logging.info("sales and tracking_logs are already partitioned")
+            return True
+        for table, id_column, _, _ in pending:
+            rename_to_legacy(cur, table, id_column)
+
+        if not create_schema(cur):
+            raise RuntimeError("partitioned sales/tracking_logs were not created")
+        for table, id_column, key_column, step in pending:
+            copy_legacy_rows(cur, table, id_column, key_column, step)
+            cur.execute(f"ANALYZE {table};")
+            if drop_legacy:
+                cur.execute(f"DROP TABLE {table}_legacy;")
+        conn.commit()
+        create_future_partitions(conn)
+        logging.info("Partition migration completed")
+        return True
+    except Exception as e:
+        logging.error(f"Error migrating to partitioned tables: {e}")
+        if conn:
+            conn.rollback()
+        return False
+    finally:
+        if cur:
+            cur.close()
+        if conn:
+            conn.close()
+
+
+def explain(cur, query, params):
+    cur.execute("EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) " + query, params)
+    plan = cur.fetchone()[0]
+    plan = plan[0] if isinstance(plan, list) else json.loads(plan)[0]
+    root = plan["Plan"]
+    nodes = []
+    stack = [root]
+    while stack:
+        node = stack.pop()
+        nodes.append(node["Node Type"])
+        stack.extend(node.get("Plans", []))
+    return {
+        "execution_ms": plan["Execution Time"],
+        "planning_ms": plan["Planning Time"],
+        "shared_buffers": root.get("Shared Hit Blocks", 0) + root.get("Shared Read Blocks", 0),
+        "nodes": sorted(set(nodes)),
+    }
+
+
+def compare(runs=5):
+    """
+    Times the hot queries against heap tables (sales_legacy / tracking_logs_legacy, or a *_heap copy of the
+    partitioned table when no legacy table is left) and against the partitioned tables. Reports the median of runs.
+    The *_heap copies are dropped afterwards.
+    """
+    conn = None
+    cur = None
+    copies = []
+    try:
+        conn = psycopg2.connect(**DB_PARAMS)
+        cur = conn.cursor()
+        heap = {}
+        for table, _, _, _ in PARTITIONED_TABLES:
+            heap[table] = f"{table}_legacy"
+            if not table_exists(cur, heap[table]):
+                heap[table] = f"{table}_heap"
+                logging.info(f"Creating heap copy {heap[table]} for comparison")
+                cur.execute(f"DROP TABLE IF EXISTS {heap[table]};")
+                cur.execute(f"CREATE TABLE {heap[table]} AS SELECT * FROM {table};")
+                cur.execute(f"ANALYZE {heap[table]};")
+                copies.append(heap[table])
+        conn.commit()
+
+        cur.execute(f"SELECT store_id, sku_id FROM {heap['sales']} LIMIT 1;")
+        sale = cur.fetchone()
+        cur.execute(
+            f"SELECT vehicle_id, date_trunc('day', MAX(timestamp)) FROM {heap['tracking_logs']} GROUP BY vehicle_id LIMIT 1;"
+        )
+        track = cur.fetchone()
+        params = {
+            "get_sales_data": (sale[1], sale[0]) if sale else None,
+            "latest_position": (track[0],) if track else None,
+            "vehicle_history_day": (track[0], track[1], track[1]) if track else None,
+        }
+        tables = {"get_sales_data": "sales", "latest_position": "tracking_logs", "vehicle_history_day": "tracking_logs"}
+        for name, query in QUERIES.items():
+            if params[name] is None:
+                logging.warning(f"No data for {name}, skipping")
+                continue
+            for label, table in (("heap", heap[tables[name]]), ("partitioned", tables[name])):
+                results = [explain(cur, query.format(table=table), params[name]) for _ in range(runs)]
+                median = sorted(results, key=lambda r: r["execution_ms"])[len(results) // 2]
+                logging.info(
+                    f"{name} [{label}]: {median['execution_ms']:.2f} ms execution, {median['planning_ms']:.2f} ms planning, "
+                    f"{median['shared_buffers']} buffers, plan {', '.join(median['nodes'])}"
+                )
+        conn.rollback()
+    except Exception as e:
+        logging.error(f"Error comparing query plans: {e}")
+        if conn:
+            conn.rollback()
+    finally:
+        if copies and cur:
+            try:
+                for copy in copies:
+                    cur.execute(f"DROP TABLE IF EXISTS {copy};")
+                conn.commit()
+            except Exception as e:
+                logging.error(f"Error dropping comparison copies {copies}: {e}")
+        if cur:
+            cur.close()
+        if conn:
+            conn.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Partition sales and tracking_logs and compare query plans")
+    parser.add_argument("--compare", action="store_true", help="Only compare heap vs partitioned query timings")
+    parser.add_argument("--drop-legacy", action="store_true", help="Drop the *_legacy tables after migrating")
+    args = parser.parse_args()
+    if args.compare:
+        compare()
+    else:
+        migrate(drop_legacy=args.drop_legacy)
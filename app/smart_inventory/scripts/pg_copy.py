@@ -0,0 +1,102 @@
+"""
+pg_copy.py
+Purpose: Streaming COPY helpers shared by the bulk loaders (generate_data.py, telemetry_ingest.py): a file object over
+an iterator of byte chunks, PGCOPY binary encoding of numpy columns, and csv COPY for rows with text columns.
+"""
+import io
+import struct
+import numpy as np
+
+COPY_BUFFER_SIZE = 1 << 20
+
+# Binary COPY field encodings: (numpy dtype, byte length)
+PG_TYPES = {
+    'int4': ('>i4', 4),
+    'float8': ('>f8', 8),
+    'date': ('>i4', 4),
+    'timestamp': ('>i8', 8),
+}
+
+
+class CopyStream(io.RawIOBase):
+    """Read-only file object over an iterator of bytes chunks, so COPY can stream without building the whole table."""
+
+    def __init__(self, chunks):
+        self.chunks = iter(chunks)
+        self.pending = memoryview(b"")
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        while not self.pending:
+            try:
+                self.pending = memoryview(next(self.chunks))
+            except StopIteration:
+                return 0
+        n = min(len(buffer), len(self.pending))
+        buffer[:n] = self.pending[:n]
+        self.pending = self.pending[n:]
+        return n
+
+
+def binary_tuples(columns):
+    """
+    Encodes equal-length numpy arrays as PGCOPY binary tuples. columns: list of (array, pg type); dates are days and
+    timestamps microseconds since 2000-01-01, as the binary format expects.
+    """
+    n = len(columns[0][0])
+    fields = [('count', '>i2')]
+    for i, (_, pg_type) in enumerate(columns):
+        fields += [(f'len{i}', '>i4'), (f'val{i}', PG_TYPES[pg_type][0])]
+    rows = np.empty(n, dtype=np.dtype(fields))
+    rows['count'] = len(columns)
+    for i, (values, pg_type) in enumerate(columns):
+        rows[f'len{i}'] = PG_TYPES[pg_type][1]
+        rows[f'val{i}'] = values
+    return rows.tobytes()
+
+
+def copy_binary(cur, table, column_names, blocks):
+    """COPY ... FROM STDIN (FORMAT binary) from an iterator of column blocks, see binary_tuples()."""
+    def chunks():
+        yield b"PGCOPY\n\xff\r\n\x00" + struct.pack(">ii", 0, 0)
+        for block in blocks:
+            yield binary_tuples(block)
+        yield struct.pack(">h", -1)
+    cur.copy_expert(
+        f"COPY {table} ({', '.join(column_names)}) FROM STDIN WITH (FORMAT binary)",
+        CopyStream(chunks()),
+        size=COPY_BUFFER_SIZE
+    )
+
+
+def csv_field(value):
+    """
+    One csv COPY field. None is an unquoted empty field (NULL). Text that is empty or holds a delimiter, quote, line
+    break or backslash is quoted with inner quotes doubled, so it cannot split a row or read back as NULL or \\.
+    """
+    if value is None:
+        return ""
+    text = str(value)
+    if not text or any(c in text for c in ',"\r\n\\'):
+        return '"' + text.replace('"', '""') + '"'
+    return text
+
+
+def copy_csv(cur, table, column_names, rows):
+    """COPY ... FROM STDIN (FORMAT csv) for the small tables that carry text columns."""
+    def chunks():
+        batch = []
+        for row in rows:
+            batch.append(",".join(csv_field(v) for v in row))
+            if len(batch) == 10_000:
+                yield ("\n".join(batch) + "\n").encode()
+                batch = []
+        if batch:
+            yield ("\n".join(batch) + "\n").encode()
+    cur.copy_expert(
+        f"COPY {table} ({', '.join(column_names)}) FROM STDIN WITH (FORMAT csv)",
+        CopyStream(chunks()),
+        size=COPY_BUFFER_SIZE
+    )
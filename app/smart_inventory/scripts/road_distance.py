@@ -0,0 +1,506 @@
+"""
+road_distance.py
+Purpose: Road distance/duration service for RouteAI planning. Origin-destination pairs are keyed by geohash and kept in
+a persistent SQLite cache with TTL and size-bounded LRU eviction; an in-process LRU fronts single-pair lookups. Tables
+are read from SQLite in bulk and assembled with numpy. Missing pairs are fetched in batched matrix requests from a
+pluggable backend: HaversineBackend (great-circle x detour factor, fully offline and the default), OSRMBackend (a local
+osrm-routed /table service) or MapboxBackend (Matrix API).
+
+Configuration (.env): ROAD_BACKEND=haversine|osrm|mapbox, OSRM_URL, MAPBOX_TOKEN, ROAD_CACHE_PATH.
+Execution: Optional; run after seed_data.py to warm the cache for every FulfillmentCenter and store pair.
+Command: python scripts/road_distance.py
+"""
+import os
+import json
+import time
+import logging
+import sqlite3
+import threading
+import urllib.request
+from collections import OrderedDict
+import numpy as np
+from dotenv import dotenv_values
+
+logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(levelname)s - %(message)s')
+
+ENV_VALUES = dotenv_values(".env")
+
+CACHE_PATH = ENV_VALUES.get("ROAD_CACHE_PATH") or os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "road_distance_cache.sqlite3"
+)
+GEOHASH_PRECISION = 8  # ~38 m x 19 m cells
+CACHE_TTL_S = 30 * 24 * 3600
+CACHE_MAX_ENTRIES = 2_000_000
+EVICT_TARGET = 0.9  # LRU eviction trims to this share of max_entries, so the next puts do not evict again at once
+EXPIRY_SWEEP_S = 3600  # Expired pairs are never served; sweeping them out once an hour is enough
+MEMORY_MAX_ENTRIES = 200_000
+MAX_CACHED_PAIRS = 1_000_000  # Larger tables from a local backend are computed directly instead of cached
+SQL_CHUNK = 400
+
+DETOUR_FACTOR = 1.3  # Road km per great-circle km
+AVERAGE_SPEED_KMH = 60  # Matches the 60 km/h used for estimated_time in route_optimization.py
+
+_GEOHASH_ALPHABET = "0123456789bcdefghjkmnpqrstuvwxyz"
+
+
+def geohash(lat, lng, precision=GEOHASH_PRECISION):
+    lat_range = [-90.0, 90.0]
+    lng_range = [-180.0, 180.0]
+    chars = []
+    bits = 0
+    bit_count = 0
+    even = True
+    while len(chars) < precision:
+        rng, value = (lng_range, lng) if even else (lat_range, lat)
+        mid = (rng[0] + rng[1]) / 2
+        if value >= mid:
+            bits = (bits << 1) | 1
+            rng[0] = mid
+        else:
+            bits <<= 1
+            rng[1] = mid
+        even = not even
+        bit_count += 1
+        if bit_count == 5:
+            chars.append(_GEOHASH_ALPHABET[bits])
+            bits = 0
+            bit_count = 0
+    return "".join(chars)
+
+
+def haversine_pairs(origins, destinations):
+    """Great-circle km from each (lat, lng) row of origins to the same row of destinations."""
+    origins = np.radians(np.asarray(origins, dtype=float)).reshape(-1, 2)
+    destinations = np.radians(np.asarray(destinations, dtype=float)).reshape(-1, 2)
+    d_lat = destinations[:, 0] - origins[:, 0]
+    d_lng = destinations[:, 1] - origins[:, 1]
+    a = np.sin(d_lat / 2) ** 2 + np.cos(origins[:, 0]) * np.cos(destinations[:, 0]) * np.sin(d_lng / 2) ** 2
+    return 2 * 6371 * np.arcsin(np.sqrt(np.clip(a, 0, 1)))
+
+
+def route_path(origins, destinations):
+    """Waypoints origin 0, destination 0, origin 1, ... so the even legs of one route request are the pairs."""
+    coords = np.empty((2 * len(origins), 2))
+    coords[0::2], coords[1::2] = origins, destinations
+    return ";".join(f"{lng:.6f},{lat:.6f}" for lat, lng in coords)
+
+
+def _legs_from(body, n):
+    """(distance_km, duration_s) of the requested pairs from a route response; inf when there is no route."""
+    if body.get("code") == "NoRoute":
+        return np.full(n, np.inf), np.full(n, np.inf)
+    legs = body["routes"][0]["legs"][0::2]
+    return (np.array([leg["distance"] for leg in legs], dtype=float) / 1000,
+            np.array([leg["duration"] for leg in legs], dtype=float))
+
+
+def haversine_table(origins, destinations):
+    """Great-circle km from every (lat, lng) row of origins to every row of destinations."""
+    origins = np.radians(np.asarray(origins, dtype=float))
+    destinations = np.radians(np.asarray(destinations, dtype=float))
+    d_lat = origins[:, 0:1] - destinations[None, :, 0]
+    d_lng = origins[:, 1:2] - destinations[None, :, 1]
+    a = np.sin(d_lat / 2) ** 2 + np.cos(origins[:, 0:1]) * np.cos(destinations[None, :, 0]) * np.sin(d_lng / 2) ** 2
+    return 2 * 6371 * np.arcsin(np.sqrt(np.clip(a, 0, 1)))
+
+
+class HaversineBackend:
+    """Offline stand-in for a routing engine: great-circle distance scaled by a detour factor."""
+    local = True
+    max_coordinates = None
+    max_pairs = None
+
+    def __init__(self, detour_factor=DETOUR_FACTOR, speed_kmh=AVERAGE_SPEED_KMH):
+        self.detour_factor = detour_factor
+        self.speed_kmh = speed_kmh
+
+    def table(self, origins, destinations):
+        distance_km = haversine_table(origins, destinations) * self.detour_factor
+        return distance_km, distance_km / self.speed_kmh * 3600
+
+    def pairs(self, origins, destinations):
+        distance_km = haversine_pairs(origins, destinations) * self.detour_factor
+        return distance_km, distance_km / self.speed_kmh * 3600
+
+
+class OSRMBackend:
+    """Table service of a local osrm-routed instance (http://localhost:5000 by default)."""
+    local = True
+    max_coordinates = 1000
+    max_pairs = 250  # osrm-routed's default --max-viaroute-size is 500 waypoints
+
+    def __init__(self, url="http://localhost:5000", profile="driving", timeout=30):
+        self.url = url.rstrip("/")
+        self.profile = profile
+        self.timeout = timeout
+
+    def table(self, origins, destinations):
+        coords = list(origins) + list(destinations)
+        path = ";".join(f"{lng:.6f},{lat:.6f}" for lat, lng in coords)
+        sources = ";".join(str(i) for i in range(len(origins)))
+        targets = ";".join(str(len(origins) + i) for i in range(len(destinations)))
+        url = (f"{self.url}/table/v1/{self.profile}/{path}"
+               f"?sources={sources}&destinations={targets}&annotations=distance,duration")
+        with urllib.request.urlopen(url, timeout=self.timeout) as response:
+            body = json.load(response)
+        if body.get("code") != "Ok":
+            raise RuntimeError(f"OSRM table error: {body.get('message', body.get('code'))}")
+        return _matrix_from(body["distances"]) / 1000, _matrix_from(body["durations"])
+
+    def pairs(self, origins, destinations):
+        url = f"{self.url}/route/v1/{self.profile}/{route_path(origins, destinations)}?overview=false"
+        with urllib.request.urlopen(url, timeout=self.timeout) as response:
+            body = json.load(response)
+        if body.get("code") not in ("Ok", "NoRoute"):
+            raise RuntimeError(f"OSRM route error: {body.get('message', body.get('code'))}")
+        return _legs_from(body, len(origins))
+
+
+class MapboxBackend:
+    """Mapbox Matrix API; at most 25 coordinates per request, so tables are split into blocks."""
+    local = False
+    max_coordinates = 25
+    max_pairs = 12  # The Directions API takes 25 waypoints
+
+    def __init__(self, token, profile="mapbox/driving", timeout=30):
+        self.token = token
+        self.profile = profile
+        self.timeout = timeout
+
+    def table(self, origins, destinations):
+        coords = list(origins) + list(destinations)
+        path = ";".join(f"{lng:.6f},{lat:.6f}" for lat, lng in coords)
+        sources = ";".join(str(i) for i in range(len(origins)))
+        targets = ";".join(str(len(origins) + i) for i in range(len(destinations)))
+        url = (f"https://api.mapbox.com/directions-matrix/v1/{self.profile}/{path}"
+               f"?sources={sources}&destinations={targets}&annotations=distance,duration&access_token={self.token}")
+        with urllib.request.urlopen(url, timeout=self.timeout) as response:
+            body = json.load(response)
+        if body.get("code") != "Ok":
+            raise RuntimeError(f"Mapbox matrix error: {body.get('message', body.get('code'))}")
+        return _matrix_from(body["distances"]) / 1000, _matrix_from(body["durations"])
+
+    def pairs(self, origins, destinations):
+        url = (f"https://api.mapbox.com/directions/v5/{self.profile}/{route_path(origins, destinations)}"
+               f"?overview=false&access_token={self.token}")
+        with urllib.request.urlopen(url, timeout=self.timeout) as response:
+            body = json.load(response)
+        if body.get("code") not in ("Ok", "NoRoute"):
+            raise RuntimeError(f"Mapbox directions error: {body.get('message', body.get('code'))}")
+        return _legs_from(body, len(origins))
+
+
+def _matrix_from(rows):
+    """Routing engines return null for unroutable pairs; those become inf so the solver avoids them."""
+    return np.array([[np.inf if v is None else v for v in row] for row in rows], dtype=float)
+
+
+class RoadDistanceCache:
+    """Persistent OD cache: in-process LRU over a SQLite table with TTL expiry and size-bounded LRU eviction."""
+
+    def __init__(self, path=CACHE_PATH, ttl_s=CACHE_TTL_S, max_entries=CACHE_MAX_ENTRIES,
+                 memory_entries=MEMORY_MAX_ENTRIES):
+        self.ttl_s = ttl_s
+        self.max_entries = max_entries
+        self.memory_entries = memory_entries
+        self.memory = OrderedDict()
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.executescript("""
+            PRAGMA journal_mode = WAL;
+            PRAGMA synchronous = NORMAL;
+            CREATE TABLE IF NOT EXISTS od_cache (
+                origin TEXT NOT NULL,
+                destination TEXT NOT NULL,
+                distance_km REAL NOT NULL,
+                duration_s REAL NOT NULL,
+                created_at REAL NOT NULL,
+                accessed_at REAL NOT NULL,
+                PRIMARY KEY (origin, destination)
+            ) WITHOUT ROWID;
+            CREATE INDEX IF NOT EXISTS od_cache_accessed_at ON od_cache (accessed_at);
+        """)
+        # Upper bound on the row count, kept up to date by put_many so eviction needs no COUNT(*) per insert. Upserts
+        # of existing pairs are counted as new rows; evict() recounts before trimming.
+        (self.count,) = self.conn.execute("SELECT COUNT(*) FROM od_cache").fetchone()
+        self.swept_at = 0.0
+
+    def _remember(self, key, value):
+        self.memory[key] = value
+        self.memory.move_to_end(key)
+        if len(self.memory) > self.memory_entries:
+            self.memory.popitem(last=False)
+
+    def get_many(self, origins, destinations):
+        """
+        Cached (distance_km, duration_s) arrays of shape (len(origins), len(destinations)) for unique geohash keys, NaN
+        where a pair is missing or expired. SQLite joins the keys against od_cache and returns (row, column, value)
+        tuples that are scattered into the arrays in one step; the in-process LRU only fronts get_pairs().
+        """
+        now = time.time()
+        distance_km = np.full((len(origins), len(destinations)), np.nan)
+        duration_s = np.full((len(origins), len(destinations)), np.nan)
+        with self.lock:
+            for i in range(0, len(origins), SQL_CHUNK):
+                o_chunk = origins[i:i + SQL_CHUNK]
+                o_values = ",".join(f"({i + k}, ?)" for k in range(len(o_chunk)))
+                for j in range(0, len(destinations), SQL_CHUNK):
+                    d_chunk = destinations[j:j + SQL_CHUNK]
+                    d_values = ",".join(f"({j + k}, ?)" for k in range(len(d_chunk)))
+                    keys = f"o (i, origin) AS (VALUES {o_values}), d (j, destination) AS (VALUES {d_values})"
+                    rows = self.conn.execute(
+                        f"""
+                        WITH {keys}
+                        SELECT o.i, d.j, c.distance_km, c.duration_s
+                        FROM o CROSS JOIN d
+                        JOIN od_cache c ON c.origin = o.origin AND c.destination = d.destination
+                        WHERE c.created_at >= ?
+                        """,
+                        (*o_chunk, *d_chunk, now - self.ttl_s)
+                    ).fetchall()
+                    if not rows:
+                        continue
+                    hits = np.array(rows, dtype=float)
+                    rows_i, cols_j = hits[:, 0].astype(np.int64), hits[:, 1].astype(np.int64)
+                    distance_km[rows_i, cols_j] = hits[:, 2]
+                    duration_s[rows_i, cols_j] = hits[:, 3]
+                    self.conn.execute(
+                        f"""
+                        WITH {keys}
+                        UPDATE od_cache SET accessed_at = ?
+                        WHERE origin IN (SELECT origin FROM o) AND destination IN (SELECT destination FROM d)
+                          AND created_at >= ?
+                        """,
+                        (*o_chunk, *d_chunk, now, now - self.ttl_s)
+                    )
+            self.conn.commit()
+        return distance_km, duration_s
+
+    def get_pairs(self, keys):
+        """Cached (distance_km, duration_s) for each live (origin, destination) geohash key pair."""
+        now = time.time()
+        found = {}
+        with self.lock:
+            pending = []
+            for key in keys:
+                value = self.memory.get(key)
+                if value is not None and now - value[2] < self.ttl_s:
+                    self.memory.move_to_end(key)
+                    found[key] = value[:2]
+                else:
+                    pending.append(key)
+            for i in range(0, len(pending), SQL_CHUNK):
+                chunk = pending[i:i + SQL_CHUNK]
+                values = ",".join("(?, ?)" for _ in chunk)
+                params = [k for key in chunk for k in key]
+                rows = self.conn.execute(
+                    f"""
+                    SELECT origin, destination, distance_km, duration_s, created_at FROM od_cache
+                    WHERE (origin, destination) IN (VALUES {values}) AND created_at >= ?
+                    """,
+                    (*params, now - self.ttl_s)
+                ).fetchall()
+                for origin, destination, distance_km, duration_s, created_at in rows:
+                    found[(origin, destination)] = (distance_km, duration_s)
+                    self._remember((origin, destination), (distance_km, duration_s, created_at))
+                if rows:
+                    self.conn.execute(
+                        f"UPDATE od_cache SET accessed_at = ? WHERE (origin, destination) IN (VALUES {values})",
+                        (now, *params)
+                    )
+            if pending:
+                self.conn.commit()
+        return found
+
+    def put_many(self, entries):
+        """entries: iterable of (origin, destination, distance_km, duration_s)."""
+        now = time.time()
+        rows = [(o, d, float(km), float(s), now, now) for o, d, km, s in entries]
+        with self.lock:
+            for o, d, km, s, _, _ in rows:
+                self._remember((o, d), (km, s, now))
+            self.conn.executemany(
+                """
+                INSERT INTO od_cache (origin, destination, distance_km, duration_s, created_at, accessed_at)
+                VALUES (?, ?, ?, ?, ?, ?)
+                ON CONFLICT (origin, destination) DO UPDATE
+                SET distance_km = excluded.distance_km, duration_s = excluded.duration_s,
+                    created_at = excluded.created_at, accessed_at = excluded.accessed_at
+                """,
+                rows
+            )
+            self.conn.commit()
+            self.count += len(rows)
+            due = self.count > self.max_entries or now - self.swept_at > EXPIRY_SWEEP_S
+        if due:
+            self.evict()
+
+    def evict(self):
+        """
+        Drops expired pairs. When the running count is over max_entries, recounts and drops the least recently used
+        pairs down to EVICT_TARGET of it. put_many calls this only when the running count passes max_entries or a sweep is due.
+        """
+        with self.lock:
+            now = time.time()
+            expired = self.conn.execute("DELETE FROM od_cache WHERE created_at < ?", (now - self.ttl_s,)).rowcount
+            self.count = max(0, self.count - expired)
+            self.swept_at = now
+            if self.count > self.max_entries:
+                (self.count,) = self.conn.execute("SELECT COUNT(*) FROM od_cache").fetchone()
+                excess = self.count - int(self.max_entries * EVICT_TARGET)
+            else:
+                excess = 0
+            if excess > 0:
+                self.conn.execute(
+                    """
+                    DELETE FROM od_cache WHERE (origin, destination) IN (
+                        SELECT origin, destination FROM od_cache ORDER BY accessed_at LIMIT ?
+                    )
+                    """,
+                    (excess,)
+                )
+                self.count -= excess
+            self.conn.commit()
+
+    def close(self):
+        self.conn.close()
+
+
+class RoadDistanceService:
+    """Bulk road distance/duration lookups; only pairs missing from the cache reach the backend."""
+
+    def __init__(self, backend=None, cache=None):
+        self.backend = backend or HaversineBackend()
+        self.cache = cache
+
+    def matrix(self, points):
+        """(distance_km, duration_s) square matrices over (lat, lng) points, zero on the diagonal."""
+        distance_km, duration_s = self.table(points, points)
+        np.fill_diagonal(distance_km, 0)
+        np.fill_diagonal(duration_s, 0)
+        return distance_km, duration_s
+
+    def table(self, origins, destinations):
+        """(distance_km, duration_s) arrays of shape (len(origins), len(destinations))."""
+        origins = np.asarray(origins, dtype=float).reshape(-1, 2)
+        destinations = np.asarray(destinations, dtype=float).reshape(-1, 2)
+        if self.cache is None or (self.backend.local and len(origins) * len(destinations) > MAX_CACHED_PAIRS):
+            return self._fetch(origins, destinations)
+
+        o_keys, o_first, o_inverse = np.unique(
+            [geohash(lat, lng) for lat, lng in origins], return_index=True, return_inverse=True
+        )
+        d_keys, d_first, d_inverse = np.unique(
+            [geohash(lat, lng) for lat, lng in destinations], return_index=True, return_inverse=True
+        )
+        distance_km, duration_s = self.cache.get_many(o_keys.tolist(), d_keys.tolist())
+
+        missing = np.isnan(distance_km)
+        missing_o = np.flatnonzero(missing.any(axis=1))
+        if len(missing_o):
+            missing_d = np.flatnonzero(missing[missing_o].any(axis=0))
+            km, seconds = self._fetch(origins[o_first[missing_o]], destinations[d_first[missing_d]])
+            block = np.ix_(missing_o, missing_d)
+            distance_km[block], duration_s[block] = km, seconds
+            routable_i, routable_j = np.nonzero(np.isfinite(km))
+            self.cache.put_many(zip(
+                o_keys[missing_o[routable_i]].tolist(), d_keys[missing_d[routable_j]].tolist(),
+                km[routable_i, routable_j], seconds[routable_i, routable_j]
+            ))
+            logging.debug(f"Road distance cache: fetched {len(routable_i)} pairs from {type(self.backend).__name__}")
+
+        rows, cols = o_inverse.reshape(-1)[:, None], d_inverse.reshape(-1)[None, :]
+        return distance_km[rows, cols], duration_s[rows, cols]
+
+    def pairs(self, origins, destinations):
+        """(distance_km, duration_s) arrays from each origin to the same row of destinations, e.g. a route's legs."""
+        origins = np.asarray(origins, dtype=float).reshape(-1, 2)
+        destinations = np.asarray(destinations, dtype=float).reshape(-1, 2)
+        if self.cache is None or (self.backend.local and len(origins) > MAX_CACHED_PAIRS):
+            return self._fetch_pairs(origins, destinations)
+
+        keys = [(geohash(*o), geohash(*d)) for o, d in zip(origins, destinations)]
+        unique = list(dict.fromkeys(keys))
+        found = self.cache.get_pairs(unique)
+        first = {}
+        for i, key in enumerate(keys):
+            first.setdefault(key, i)
+        missing = [key for key in unique if key not in found]
+        if missing:
+            rows = [first[key] for key in missing]
+            km, seconds = self._fetch_pairs(origins[rows], destinations[rows])
+            fetched = [(o, d, km[i], seconds[i]) for i, (o, d) in enumerate(missing) if np.isfinite(km[i])]
+            self.cache.put_many(fetched)
+            found.update({(o, d): (k, s) for o, d, k, s in fetched})
+            logging.debug(f"Road distance cache: fetched {len(fetched)} legs from {type(self.backend).__name__}")
+
+        values = np.array([found.get(key, (np.inf, np.inf)) for key in keys], dtype=float).reshape(-1, 2)
+        return values[:, 0], values[:, 1]
+
+    def _fetch_pairs(self, origins, destinations):
+        """Calls the backend's pair lookup in blocks of at most max_pairs."""
+        block = self.backend.max_pairs or max(len(origins), 1)
+        distance_km = np.empty(len(origins))
+        duration_s = np.empty(len(origins))
+        for i in range(0, len(origins), block):
+            distance_km[i:i + block], duration_s[i:i + block] = self.backend.pairs(
+                origins[i:i + block], destinations[i:i + block]
+            )
+        return distance_km, duration_s
+
+    def _fetch(self, origins, destinations):
+        """Calls the backend in blocks that respect its coordinate limit per request."""
+        limit = self.backend.max_coordinates
+        if not limit or len(origins) + len(destinations) <= limit:
+            return self.backend.table(origins, destinations)
+        block = max(1, limit // 2)
+        distance_km = np.empty((len(origins), len(destinations)))
+        duration_s = np.empty((len(origins), len(destinations)))
+        for i in range(0, len(origins), block):
+            for j in range(0, len(destinations), block):
+                km, seconds = self.backend.table(origins[i:i + block], destinations[j:j + block])
+                distance_km[i:i + block, j:j + block] = km
+                duration_s[i:i + block, j:j + block] = seconds
+        return distance_km, duration_s
+
+
+def backend_from_env():
+    # An empty value in .env (e.g. OSRM_URL=) counts as unset
+    name = (ENV_VALUES.get("ROAD_BACKEND") or "haversine").lower()
+    if name == "osrm":
+        return OSRMBackend(ENV_VALUES.get("OSRM_URL") or "http://localhost:5000")
+    if name == "mapbox":
+        token = ENV_VALUES.get("MAPBOX_TOKEN")
+        if token:
+            return MapboxBackend(token)
+        logging.warning("ROAD_BACKEND=mapbox but MAPBOX_TOKEN is missing, using haversine backend")
+    return HaversineBackend()
+
+
+_service = None
+
+
+def get_road_service():
+    """Process-wide service built from .env settings, shared by the routing and ETA code."""
+    global _service
+    if _service is None:
+        _service = RoadDistanceService(backend_from_env(), RoadDistanceCache())
+    return _service
+
+
+def warm_cache():
+    import pandas as pd
+    from route_optimization import engine
+    try:
+        fcs = pd.read_sql("SELECT latitude AS lat, longitude AS lng FROM FulfillmentCenter WHERE latitude IS NOT NULL;", engine)
+        stores = pd.read_sql("SELECT lat, lng FROM stores WHERE lat IS NOT NULL AND lng IS NOT NULL;", engine)
+        points = pd.concat([fcs, stores])[['lat', 'lng']].to_numpy(dtype=float)
+        started = time.perf_counter()
+        get_road_service().matrix(points)
+        logging.info(f"Warmed road distance cache for {len(points)} points in {time.perf_counter() - started:.2f}s")
+    except Exception as e:
+        logging.error(f"Error warming road distance cache: {e}")
+
+
+if __name__ == "__main__":
+    warm_cache()
@@ -1,4 +1,3 @@
-
 """
 route_optimization.py
 Purpose: Optimizes last-mile delivery routes for Walmart's SmartRetailSync project using OR-Tools, prioritizing urgent
@@ -12,9 +11,12 @@ from sqlalchemy import create_engine
 import psycopg2
 from ortools.constraint_solver import routing_enums_pb2, pywrapcp
 import logging
+import time
 import numpy as np
 from datetime import datetime
 
+from road_distance import get_road_service
+
 logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(levelname)s - %(message)s')
 
 DB_PARAMS = {
@@ -28,149 +30,309 @@ DB_PARAMS = {
 SQLALCHEMY_URI = f"postgresql+psycopg2://{DB_PARAMS['user']}:{DB_PARAMS['password']}@{DB_PARAMS['host']}:{DB_PARAMS['port']}/{DB_PARAMS['dbname']}"
 engine = create_engine(SQLALCHEMY_URI)
 
-def create_distance_matrix():
+SOLVE_TIME_LIMIT_S = 60  # Upper bound; the search normally ends earlier on SOLVE_STALL_S
+SOLVE_STALL_S = 3  # Guided local search stops after this long without a better solution
+DEFAULT_FLEET = [5000] * 3  # Vehicle capacities when the vehicles table is empty
+PRIORITY_PENALTY_KM = 10000  # Extra drop cost, in km, of a store at priority_score 1.0
+CARRYOVER_PRIORITY = 0.25  # Priority added for every previous run a store was dropped in
+UNREACHABLE_KM = 1e6  # Arc length used for pairs the road distance backend could not route
+
+def read_frame(conn, query, params=None):
+    """Runs a read on conn (a DBAPI connection) and returns the rows as a DataFrame."""
+    with conn.cursor() as cur:
+        cur.execute(query, params)
+        return pd.DataFrame(cur.fetchall(), columns=[d[0] for d in cur.description])
+
+def create_distance_matrix(conn):
+    """
+    Road distance (km) and duration (s) matrices from road_distance over every fulfillment center followed by every
+    store with coordinates. Returns (distance_matrix, duration_matrix, locations, dc_ids, store_ids); the first
+    len(dc_ids) nodes are the depots and node len(dc_ids) + i is store_ids[i].
+    """
     try:
-        query = """
-            SELECT DISTINCT origin, destination, distance_km
-            FROM logistics
-            WHERE origin = 'Atlanta';
-        """
-        df = pd.read_sql(query, engine)
-        destinations = sorted(list(set(df['destination'].unique()) - {'Atlanta'}))
-        locations = ['Atlanta'] + destinationsEnhancements with Real-World Explanations
-        n = len(locations)
-        distance_matrix = np.zeros((n, n))
-        for _, row in df.iterrows():
-            i = locations.index(row['origin'])
-            j = locations.index(row['destination'])
-            distance_matrix[i][j] = row['distance_km']
-            distance_matrix[j][i] = row['distance_km']
+        fcs = read_frame(
+            conn,
+            "SELECT id, latitude, longitude FROM FulfillmentCenter WHERE latitude IS NOT NULL AND longitude IS NOT NULL ORDER BY id;"
+        )
+        stores = read_frame(
+            conn,
+            "SELECT store_id, store_location, lat, lng FROM stores WHERE lat IS NOT NULL AND lng IS NOT NULL ORDER BY store_id;"
+        )
+        if fcs.empty:
+            logging.error("No fulfillment centers with coordinates")
+            return None, None, None, None, None
+        locations = [f"FC {fc_id}" for fc_id in fcs['id']] + stores['store_location'].tolist()
+        coords = np.vstack([
+            fcs[['latitude', 'longitude']].to_numpy(dtype=float),
+            stores[['lat', 'lng']].to_numpy(dtype=float)
+        ])
+        distance_matrix, duration_matrix = get_road_service().matrix(coords)
         logging.debug(f"Distance matrix shape: {distance_matrix.shape}")
         logging.debug(f"Locations: {locations}")
-        return distance_matrix, locations
+        return distance_matrix, duration_matrix, locations, fcs['id'].astype(int).tolist(), stores['store_id'].astype(int).tolist()
     except Exception as e:
         logging.error(f"Error creating distance matrix: {e}")
-        return None, None
+        return None, None, None, None, None
 
-def get_delivery_demands():
+def get_delivery_demands(conn):
+    """
+    Per-store demand from reorder_alerts, indexed by store_id (store_location is not unique), with the store's most
+    urgent SKU and a priority that grows with every previous run the store was dropped in.
+    """
     try:
         query = """
-            SELECT r.sku_id, r.store_location, (r.reorder_threshold - r.current_stock)::integer AS demand
+            SELECT r.store_id, s.store_location, r.sku_id,
+                   (r.reorder_threshold - r.current_stock)::integer AS demand,
+                   COALESCE(r.priority_score, 0) AS priority_score,
+                   COALESCE(d.times_dropped, 0) AS times_dropped
             FROM reorder_alerts r
+            JOIN stores s ON s.store_id = r.store_id
+            LEFT JOIN dropped_deliveries d ON d.store_id = r.store_id
             WHERE r.reorder_threshold > r.current_stock;
         """
-        df = pd.read_sql(query, engine)
+        df = read_frame(conn, query)
         if df.empty:
             logging.warning("No demands from reorder_alerts")
-            return {}
+            return pd.DataFrame()
         logging.debug(f"Demands DataFrame (raw): {df.to_dict()}")
         df['demand'] = df['demand'].clip(lower=0).round().astype(int)
-        demands = df.groupby('store_location')['demand'].sum().to_dict()
-        logging.debug(f"Aggregated demands: {demands}")
-        logging.debug(f"Total demand: {sum(demands.values())}")
-        if 'Atlanta' in demands:
-            logging.warning(f"Removing depot demand for Atlanta: {demands['Atlanta']}")
-            del demands['Atlanta']
+        top_sku = df.sort_values('priority_score').drop_duplicates('store_id', keep='last')
+        demands = df.groupby('store_id').agg(
+            store_location=('store_location', 'first'),
+            demand=('demand', 'sum'),
+            priority_score=('priority_score', 'max'),
+            times_dropped=('times_dropped', 'max')
+        )
+        demands['sku_id'] = top_sku.set_index('store_id')['sku_id']
+        demands['priority_score'] += CARRYOVER_PRIORITY * demands['times_dropped']
+        logging.debug(f"Aggregated demands: {demands['demand'].to_dict()}")
+        logging.debug(f"Total demand: {demands['demand'].sum()}")
         return demands
     except Exception as e:
         logging.error(f"Error getting delivery demands: {e}")
-        return {}
+        return pd.DataFrame()
 
-def optimize_routes():
+def get_fleet(conn):
     try:
-        conn = psycopg2.connect(**DB_PARAMS)
+        df = read_frame(conn, "SELECT vehicle_id, capacity FROM vehicles ORDER BY vehicle_id;")
+        if df.empty:
+            logging.warning(f"No vehicles found, using default fleet {DEFAULT_FLEET}")
+            return list(range(1, len(DEFAULT_FLEET) + 1)), list(DEFAULT_FLEET)
+        return df['vehicle_id'].astype(int).tolist(), df['capacity'].astype(int).tolist()
+    except Exception as e:
+        logging.error(f"Error getting fleet: {e}")
+        return list(range(1, len(DEFAULT_FLEET) + 1)), list(DEFAULT_FLEET)
+
+def drop_penalties(distance_matrix, priorities, demands=None):
+    """
+    Disjunction penalty per node in solver cost units (metres). Every penalty exceeds the longest possible detour, so
+    a store is only dropped when capacity runs out, and the least urgent stores are dropped first. Nodes without
+    demand get no penalty and are left out of the routes.
+    """
+    distance_matrix = np.asarray(distance_matrix, dtype=float)
+    floor = int(np.max(distance_matrix[np.isfinite(distance_matrix)], initial=0) * 1000 * 2) + 1
+    return [
+        0 if demands is not None and not demands[node] else floor + int(float(p) * PRIORITY_PENALTY_KM * 1000)
+        for node, p in enumerate(priorities)
+    ]
+
+def solve_vrp(data, time_limit_s=SOLVE_TIME_LIMIT_S, stall_s=SOLVE_STALL_S, solution_limit=None):
+    """
+    Solves a capacitated VRP without touching the database.
+    data: distance_matrix (km), demands, vehicle_capacities, num_vehicles and either depot or starts/ends, plus optional
+    penalties (one per node). With penalties every non-depot node becomes an optional visit. The search ends after
+    stall_s without improvement, or at time_limit_s. solution_limit additionally ends it after that many solutions,
+    which gives a repeatable result when the stall and time limits are set high enough not to fire.
+    Returns routes (node lists per vehicle, depots excluded), dropped nodes and solve statistics, or None.
+    """
+    distance_matrix = np.asarray(data['distance_matrix'], dtype=float)
+    distance_matrix = np.where(np.isfinite(distance_matrix), distance_matrix, UNREACHABLE_KM)
+    num_nodes = len(distance_matrix)
+    if 'starts' in data:
+        manager = pywrapcp.RoutingIndexManager(num_nodes, data['num_vehicles'], data['starts'], data['ends'])
+        depots = set(data['starts']) | set(data['ends'])
+    else:
+        manager = pywrapcp.RoutingIndexManager(num_nodes, data['num_vehicles'], data['depot'])
+        depots = {data['depot']}
+    routing = pywrapcp.RoutingModel(manager)
+    arc_cost = np.rint(distance_matrix * 1000).astype(np.int64)
+    def distance_callback(from_index, to_index):
+        return int(arc_cost[manager.IndexToNode(from_index), manager.IndexToNode(to_index)])
+    transit_callback_index = routing.RegisterTransitCallback(distance_callback)
+    routing.SetArcCostEvaluatorOfAllVehicles(transit_callback_index)
+    demands = [int(d) for d in data['demands']]
+    def demand_callback(from_index):
+        return demands[manager.IndexToNode(from_index)]
+    demand_callback_index = routing.RegisterUnaryTransitCallback(demand_callback)
+    routing.AddDimensionWithVehicleCapacity(
+        demand_callback_index, 0, data['vehicle_capacities'], True, 'Capacity'
+    )
+    penalties = data.get('penalties')
+    if penalties is not None:
+        for node in range(num_nodes):
+            if node not in depots:
+                routing.AddDisjunction([manager.NodeToIndex(node)], int(penalties[node]))
+    started = time.perf_counter()
+    first_solution = []
+    best = {'cost': None, 'at': started, 'solutions': 0}
+    def on_solution():
+        now = time.perf_counter()
+        best['solutions'] += 1
+        if not first_solution:
+            first_solution.append(now - started)
+        cost = routing.CostVar().Max()
+        if best['cost'] is None or cost < best['cost']:
+            best['cost'], best['at'] = cost, now
+    routing.AddAtSolutionCallback(on_solution)
+    # Guided local search never finishes on its own; end it once it stops improving instead of at the time limit
+    routing.AddSearchMonitor(routing.solver().CustomLimit(
+        lambda: bool(first_solution) and time.perf_counter() - best['at'] > stall_s
+    ))
+    search_parameters = pywrapcp.DefaultRoutingSearchParameters()
+    search_parameters.first_solution_strategy = (
+        routing_enums_pb2.FirstSolutionStrategy.PATH_CHEAPEST_ARC)
+    search_parameters.local_search_metaheuristic = (
+        routing_enums_pb2.LocalSearchMetaheuristic.GUIDED_LOCAL_SEARCH)
+    search_parameters.time_limit.FromMilliseconds(int(time_limit_s * 1000))
+    if solution_limit:
+        search_parameters.solution_limit = solution_limit
+    solution = routing.SolveWithParameters(search_parameters)
+    solve_time = time.perf_counter() - started
+    if not solution:
+        return None
+    routes = []
+    total_distance = 0.0
+    for vehicle in range(data['num_vehicles']):
+        index = routing.Start(vehicle)
+        route = []
+        while not routing.IsEnd(index):
+            previous_index = index
+            index = solution.Value(routing.NextVar(index))
+            total_distance += distance_matrix[manager.IndexToNode(previous_index)][manager.IndexToNode(index)]
+            if not routing.IsEnd(index):
+                route.append(manager.IndexToNode(index))
+        routes.append(route)
+    dropped = [
+        node for node in range(num_nodes)
+        if node not in depots
+        and solution.Value(routing.NextVar(manager.NodeToIndex(node))) == manager.NodeToIndex(node)
+    ]
+    return {
+        'routes': routes,
+        'dropped': dropped,
+        'objective': solution.ObjectiveValue(),
+        'distance_km': float(total_distance),
+        'vehicles_used': sum(1 for route in routes if route),
+        'time_to_first_solution_s': first_solution[0] if first_solution else solve_time,
+        'solve_time_s': solve_time,
+        'solutions': best['solutions']
+    }
+
+def record_dropped_stores(cur, dropped):
+    """
+    Carries dropped stores over to the next run. Every other store is cleared, whether it was served this run or no
+    longer has an alert.
+    """
+    cur.execute("DELETE FROM dropped_deliveries WHERE NOT (store_id = ANY(%s));", ([d[0] for d in dropped],))
+    if dropped:
+        cur.executemany(
+            """
+            INSERT INTO dropped_deliveries (store_id, demand, priority_score, times_dropped, dropped_at)
+            VALUES (%s, %s, %s, 1, CURRENT_TIMESTAMP)
+            ON CONFLICT (store_id) DO UPDATE
+            SET demand = EXCLUDED.demand,
+                priority_score = EXCLUDED.priority_score,
+                times_dropped = dropped_deliveries.times_dropped + 1,
+                dropped_at = EXCLUDED.dropped_at
+            """,
+            dropped
+        )
+
+def clear_plan(cur):
+    """Empties the previous plan inside the caller's transaction; readers keep the old plan until the new one commits."""
+    cur.execute("TRUNCATE TABLE delivery_routes RESTART IDENTITY;")
+    cur.execute("TRUNCATE TABLE logistics_metrics RESTART IDENTITY;")
+
+def optimize_routes(conn=None):
+    """
+    Solves and stores the full route plan; uses conn (e.g. from the pipeline's pool) for every read and write when
+    given. The previous plan is replaced in one transaction after a successful solve and kept on failure. Returns
+    False on error.
+    """
+    own_conn = conn is None
+    cur = None
+    try:
+        if own_conn:
+            conn = psycopg2.connect(**DB_PARAMS)
         cur = conn.cursor()
-        cur.execute("TRUNCATE TABLE delivery_routes RESTART IDENTITY;")
-        cur.execute("TRUNCATE TABLE logistics_metrics RESTART IDENTITY;")
-        conn.commit()
-        distance_matrix, locations = create_distance_matrix()
+        distance_matrix, duration_matrix, locations, dc_ids, store_ids = create_distance_matrix(conn)
         if distance_matrix is None:
             logging.error("Failed to create distance matrix")
-            return
-        demands = get_delivery_demands()
-        if not demands:
+            return False
+        demands = get_delivery_demands(conn)
+        if demands.empty:
             logging.warning("No delivery demands found")
-            return
-        reorder_locations = set(demands.keys())
-        logistics_locations = set(locations[1:])
-        missing_locations = reorder_locations - logistics_locations
-        if missing_locations:
-            logging.warning(f"Locations in reorder_alerts but not in logistics: {missing_locations}")
+            clear_plan(cur)
+            record_dropped_stores(cur, [])
+            conn.commit()
+            return True
+        num_depots = len(dc_ids)
+        missing_stores = set(demands.index) - set(store_ids)
+        if missing_stores:
+            logging.warning(f"Stores in reorder_alerts without coordinates: {sorted(missing_stores)}")
+        node_store = [None] * num_depots + store_ids
         demand_vector = [0] * len(locations)
-        for loc in locations[1:]:
-            demand_vector[locations.index(loc)] = int(demands.get(loc, 0))
+        priority_vector = [0.0] * len(locations)
+        for node in range(num_depots, len(locations)):
+            store_id = node_store[node]
+            if store_id in demands.index:
+                demand_vector[node] = int(demands.loc[store_id, 'demand'])
+                priority_vector[node] = float(demands.loc[store_id, 'priority_score'])
         logging.debug(f"Demand vector: {demand_vector}")
+        vehicle_ids, capacities = get_fleet(conn)
+        if sum(demand_vector) > sum(capacities):
+            logging.warning(f"Total demand {sum(demand_vector)} exceeds fleet capacity {sum(capacities)}, dropping least urgent stores")
+        starts = [i % num_depots for i in range(len(capacities))]  # Vehicles are spread over the fulfillment centers
         data = {
             'distance_matrix': distance_matrix,
             'demands': demand_vector,
-            'vehicle_capacities': [5000] * 3,
-            'num_vehicles': 3,
-            'depot': 0
+            'vehicle_capacities': capacities,
+            'num_vehicles': len(capacities),
+            'starts': starts,
+            'ends': starts,
+            'penalties': drop_penalties(distance_matrix, priority_vector, demand_vector)
         }
-        manager = pywrapcp.RoutingIndexManager(len(data['distance_matrix']), data['num_vehicles'], data['depot'])
-        routing = pywrapcp.RoutingModel(manager)
-        def distance_callback(from_index, to_index):
-            from_node = manager.IndexToNode(from_index)
-            to_node = manager.IndexToNode(to_index)
-            return int(data['distance_matrix'][from_node][to_node] * 1000)
-        transit_callback_index = routing.RegisterTransitCallback(distance_callback)
-        routing.SetArcCostEvaluatorOfAllVehicles(transit_callback_index)
-        def demand_callback(from_index):
-            from_node = manager.IndexToNode(from_index)
-            return data['demands'][from_node]
-        demand_callback_index = routing.RegisterUnaryTransitCallback(demand_callback)
-        routing.AddDimensionWithVehicleCapacity(
-            demand_callback_index, 0, data['vehicle_capacities'], True, 'Capacity'
-        )
-        search_parameters = pywrapcp.DefaultRoutingSearchParameters()
-        search_parameters.first_solution_strategy = (
-            routing_enums_pb2.FirstSolutionStrategy.PATH_CHEAPEST_ARC)
-        search_parameters.local_search_metaheuristic = (
-            routing_enums_pb2.LocalSearchMetaheuristic.GUIDED_LOCAL_SEARCH)
-        search_parameters.time_limit.seconds = 60
-        solution = routing.SolveWithParameters(search_parameters)
-        if solution:
+        result = solve_vrp(data)
+        if result:
+            logging.info(f"First feasible solution after {result['time_to_first_solution_s']:.3f}s")
             routes = []
-            total_distance = 0
-            for vehicle_id in range(data['num_vehicles']):
-                index = routing.Start(vehicle_id)
-                sequence = 0
-                route_distance = 0
-                route = []
-                while not routing.IsEnd(index):
-                    node = manager.IndexToNode(index)
-                    route.append(locations[node])
-                    if node != 0:
-                        store = locations[node]
-                        sku_query = f"""
-                            SELECT sku_id FROM reorder_alerts WHERE store_location = '{store}'
-                            LIMIT 1;
-                        """
-                        sku_df = pd.read_sql(sku_query, engine)
-                        sku_id = int(sku_df['sku_id'].iloc[0]) if not sku_df.empty else 1
-                        next_index = solution.Value(routing.NextVar(index))
-                        distance = float(data['distance_matrix'][node][manager.IndexToNode(next_index)])
-                        if sequence == 0:
-                            prev_distance = float(data['distance_matrix'][0][node])
-                        else:
-                            prev_node = manager.IndexToNode(previous_index)
-                            prev_distance = float(data['distance_matrix'][prev_node][node])
-                        estimated_time = int(max(1, (prev_distance / 60) + 0.25))  # 60 km/h + 15 min stop
-                        routes.append((vehicle_id, sku_id, store, sequence, prev_distance, estimated_time))
-                    previous_index = index
-                    index = solution.Value(routing.NextVar(index))
-                    sequence += 1
-                    route_distance += routing.GetArcCostForVehicle(previous_index, index, vehicle_id) / 1000
-                total_distance += route_distance
-                logging.info(f"Vehicle {vehicle_id} route: {' -> '.join(route)}")
-                logging.info(f"Vehicle {vehicle_id} route distance: {route_distance:.2f} km")
+            for vehicle, route in enumerate(result['routes']):
+                depot = starts[vehicle]
+                prev_node = depot
+                for sequence, node in enumerate(route, start=1):
+                    store = demands.loc[node_store[node]]
+                    prev_distance = float(distance_matrix[prev_node][node])
+                    estimated_time = int(max(1, (duration_matrix[prev_node][node] / 3600) + 0.25))  # drive time + 15 min stop
+                    routes.append((vehicle_ids[vehicle], dc_ids[depot], int(store['sku_id']), node_store[node],
+                                   sequence, prev_distance, estimated_time, float(store['priority_score'])))
+                    prev_node = node
+                logging.info(f"Vehicle {vehicle_ids[vehicle]} route: {' -> '.join([locations[depot]] + [locations[n] for n in route] + [locations[depot]])}")
+            dropped = [
+                (node_store[node], demand_vector[node], priority_vector[node])
+                for node in result['dropped'] if demand_vector[node] > 0
+            ]
+            if dropped:
+                logging.warning(f"Dropped stores (store_id, demand, priority): {dropped}")
+            clear_plan(cur)
+            record_dropped_stores(cur, dropped)
+            total_distance = result['distance_km']
             if routes:
                 cur.executemany(
                     """
-                    INSERT INTO delivery_routes (vehicle_id, sku_id, store_location, sequence, distance_km, estimated_time)
-                    VALUES (%s, %s, %s, %s, %s, %s)
+                    INSERT INTO delivery_routes (vehicle_id, dc_id, sku_id, store_id, sequence, distance_km, estimated_time, priority_score)
+                    VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
                     """,
-                    [(int(r[0]), int(r[1]), r[2], int(r[3]), float(r[4]), int(r[5])) for r in routes]
+                    routes
                 )
                 fuel_cost_per_km = 0.1
                 co2_per_km = 0.2
@@ -183,19 +345,23 @@ def optimize_routes():
                     """,
                     (datetime.now().date(), float(total_distance), float(total_cost), float(total_co2))
                 )
-                conn.commit()
                 logging.info(f"Saved {len(routes)} route entries. Total distance: {total_distance:.2f} km, Cost: ${total_cost:.2f}, CO2: {total_co2:.2f} kg")
             else:
                 logging.warning("No routes generated")
+            conn.commit()
         else:
-            logging.warning("No VRP solution found")
+            logging.error("No VRP solution found")
+            return False
+        return True
     except Exception as e:
         logging.error(f"Error optimizing routes: {e}")
-        conn.rollback()
+        if conn:
+            conn.rollback()
+        return False
     finally:
         if cur:
             cur.close()
-        if conn:
+        if own_conn and conn:
             conn.close()
 
 if __name__ == "__main__":
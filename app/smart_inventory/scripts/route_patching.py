@@ -0,0 +1,411 @@
+"""
+route_patching.py
+Purpose: Patches the current delivery_routes plan when a few reorder alerts are new or changed, instead of rerunning the
+full OR-Tools solve in route_optimization.py. Stops are placed by cheapest insertion and repaired with 2-opt and
+relocate moves under vehicle capacity, and only the touched vehicles' rows are rewritten. Only the neighbourhood of the
+changed stores is loaded: the vehicles already serving them, the vehicles with one of the NEARBY_STOPS closest planned
+stops, and up to IDLE_VEHICLES unused vehicles. When the patched plan is worse than QUALITY_THRESHOLD allows, or a stop
+does not fit any loaded vehicle, it falls back to optimize_routes().
+
+Execution: Run after demand_forecasting.py for urgent alerts, between full route_optimization.py runs.
+Command: python scripts/route_patching.py <store_id> [<store_id> ...]
+"""
+import sys
+import json
+import math
+import time
+import uuid
+import logging
+import numpy as np
+import psycopg2
+from psycopg2.extras import execute_values
+
+from route_optimization import optimize_routes, read_frame
+from road_distance import get_road_service
+
+logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(levelname)s - %(message)s')
+
+DB_PARAMS = {
+    "dbname": "walmart_db",
+    "user": "walmart_user",
+    "password": "securepassword",
+    "host": "localhost",
+    "port": "5432"
+}
+
+QUALITY_THRESHOLD = 0.25  # Max growth of km per stop, relative to the plan being patched, before a full solve
+MAX_RELOCATE_MOVES = 50
+NEARBY_STOPS = 20  # Planned stops nearest to each changed store whose vehicles are candidates for it
+IDLE_VEHICLES = 2  # Unused vehicles (largest first) also offered to the changed stores
+EPSILON = 1e-9
+
+
+def route_distance(depot, stops, dist):
+    if not stops:
+        return 0.0
+    path = np.array([depot] + stops + [depot])
+    return float(dist[path[:-1], path[1:]].sum())
+
+
+def plan_distance(routes, dist):
+    return sum(route_distance(r['depot'], r['stops'], dist) for r in routes if r['depot'] is not None)
+
+
+def insertion_cost(depot, stops, node, dist):
+    """Cheapest position and added km for inserting node into depot -> stops -> depot."""
+    path = np.array([depot] + stops + [depot])
+    deltas = dist[path[:-1], node] + dist[node, path[1:]] - dist[path[:-1], path[1:]]
+    pos = int(np.argmin(deltas))
+    return pos, float(deltas[pos])
+
+
+def cheapest_insertion(routes, node, demand, dist, depot_nodes):
+    """
+    Returns (route index, position, depot, added km) of the cheapest capacity-feasible insertion, or None.
+    Idle vehicles have no depot yet and are evaluated from every depot in depot_nodes.
+    """
+    best = None
+    for r_idx, route in enumerate(routes):
+        if route['load'] + demand > route['capacity']:
+            continue
+        depots = [route['depot']] if route['depot'] is not None else depot_nodes
+        for depot in depots:
+            pos, delta = insertion_cost(depot, route['stops'], node, dist)
+            if best is None or delta < best[3]:
+                best = (r_idx, pos, depot, delta)
+    return best
+
+
+def two_opt(depot, stops, dist):
+    """Reverses segments of a single route while that shortens it."""
+    path = [depot] + list(stops) + [depot]
+    improved = True
+    while improved:
+        improved = False
+        for i in range(1, len(path) - 2):
+            for j in range(i + 1, len(path) - 1):
+                delta = (dist[path[i - 1]][path[j]] + dist[path[i]][path[j + 1]]
+                         - dist[path[i - 1]][path[i]] - dist[path[j]][path[j + 1]])
+                if delta < -EPSILON:
+                    path[i:j + 1] = path[i:j + 1][::-1]
+                    improved = True
+    return path[1:-1]
+
+
+def relocate(routes, demands, dist, touched):
+    """
+    Moves single stops out of touched routes into any route with spare capacity, best move first, while the plan gets
+    shorter. Routes that receive a stop are added to touched.
+    """
+    for _ in range(MAX_RELOCATE_MOVES):
+        best = None
+        for src in touched:
+            route = routes[src]
+            path = [route['depot']] + route['stops'] + [route['depot']]
+            for i in range(1, len(path) - 1):
+                node = path[i]
+                gain = dist[path[i - 1]][node] + dist[node][path[i + 1]] - dist[path[i - 1]][path[i + 1]]
+                for dst, target in enumerate(routes):
+                    if dst == src or target['depot'] is None:
+                        continue
+                    if target['load'] + demands[node] > target['capacity']:
+                        continue
+                    pos, delta = insertion_cost(target['depot'], target['stops'], node, dist)
+                    if delta - gain < -EPSILON and (best is None or delta - gain < best[0]):
+                        best = (delta - gain, src, i - 1, dst, pos)
+        if best is None:
+            return
+        _, src, stop_idx, dst, pos = best
+        node = routes[src]['stops'].pop(stop_idx)
+        routes[src]['load'] -= demands[node]
+        routes[dst]['stops'].insert(pos, node)
+        routes[dst]['load'] += demands[node]
+        touched.add(dst)
+
+
+def patch_plan(routes, changes, demands, priorities, dist, depot_nodes):
+    """
+    Applies changed stops to routes in place. changes lists store nodes whose demand is new or updated in demands;
+    nodes with no remaining demand are only removed. Returns (touched route indices, nodes that did not fit).
+    """
+    touched = set()
+    for r_idx, route in enumerate(routes):
+        kept = [node for node in route['stops'] if node not in changes]
+        if len(kept) != len(route['stops']):
+            route['stops'] = kept
+            route['load'] = sum(demands.get(node, 0) for node in kept)
+            touched.add(r_idx)
+
+    unplaced = []
+    for node in sorted(changes, key=lambda n: priorities.get(n, 0), reverse=True):
+        demand = demands.get(node, 0)
+        if demand <= 0:
+            continue
+        best = cheapest_insertion(routes, node, demand, dist, depot_nodes)
+        if best is None:
+            unplaced.append(node)
+            continue
+        r_idx, pos, depot, _ = best
+        routes[r_idx]['depot'] = depot
+        routes[r_idx]['stops'].insert(pos, node)
+        routes[r_idx]['load'] += demand
+        touched.add(r_idx)
+
+    for r_idx in touched:
+        route = routes[r_idx]
+        if route['stops']:
+            route['stops'] = two_opt(route['depot'], route['stops'], dist)
+    relocate(routes, demands, dist, touched)
+    for r_idx in touched:
+        route = routes[r_idx]
+        if route['stops']:
+            route['stops'] = two_opt(route['depot'], route['stops'], dist)
+    return touched, unplaced
+
+
+def km_per_stop(routes, dist):
+    stops = sum(len(r['stops']) for r in routes)
+    return plan_distance(routes, dist) / stops if stops else 0.0
+
+
+def load_plan(conn, store_ids):
+    """
+    Reads the changed stores' neighbourhood of the current plan and its alert demand into node-indexed structures for
+    patch_plan(). Returns None when none of the stores has coordinates.
+    """
+    params = {'ids': sorted(store_ids), 'nearby': NEARBY_STOPS, 'idle': IDLE_VEHICLES}
+    vehicles = read_frame(
+        conn,
+        """
+        WITH changed AS (
+            SELECT store_id, lat, lng FROM stores
+            WHERE store_id = ANY(%(ids)s) AND lat IS NOT NULL AND lng IS NOT NULL
+        ),
+        candidates AS (
+            SELECT vehicle_id FROM delivery_routes WHERE store_id IN (SELECT store_id FROM changed)
+            UNION
+            SELECT nearby.vehicle_id FROM changed c
+            CROSS JOIN LATERAL (
+                SELECT dr.vehicle_id FROM delivery_routes dr
+                JOIN stores s ON s.store_id = dr.store_id
+                WHERE s.lat IS NOT NULL AND s.lng IS NOT NULL
+                ORDER BY (s.lat - c.lat) ^ 2 + ((s.lng - c.lng) * cos(radians(c.lat))) ^ 2
+                LIMIT %(nearby)s
+            ) nearby
+            UNION
+            (SELECT v.vehicle_id FROM vehicles v
+             WHERE EXISTS (SELECT 1 FROM changed)
+               AND NOT EXISTS (SELECT 1 FROM delivery_routes dr WHERE dr.vehicle_id = v.vehicle_id)
+             ORDER BY v.capacity DESC, v.vehicle_id LIMIT %(idle)s)
+        )
+        SELECT v.vehicle_id, v.capacity FROM vehicles v
+        WHERE v.vehicle_id IN (SELECT vehicle_id FROM candidates)
+        ORDER BY v.vehicle_id;
+        """,
+        params
+    )
+    if vehicles.empty:
+        return None
+    current = read_frame(
+        conn,
+        """
+        SELECT vehicle_id, dc_id, store_id, sequence
+        FROM delivery_routes
+        WHERE vehicle_id = ANY(%(vehicles)s)
+        ORDER BY vehicle_id, sequence;
+        """,
+        {'vehicles': vehicles['vehicle_id'].astype(int).tolist()}
+    )
+    store_set = sorted(set(current['store_id'].dropna().astype(int)) | set(store_ids))
+    stores = read_frame(
+        conn,
+        """
+        SELECT store_id, lat, lng FROM stores
+        WHERE store_id = ANY(%(ids)s) AND lat IS NOT NULL AND lng IS NOT NULL
+        ORDER BY store_id;
+        """,
+        {'ids': store_set}
+    )
+    alerts = read_frame(
+        conn,
+        """
+        SELECT store_id, sku_id, (reorder_threshold - current_stock)::integer AS demand, priority_score
+        FROM reorder_alerts
+        WHERE reorder_threshold > current_stock AND store_id = ANY(%(ids)s);
+        """,
+        {'ids': store_set}
+    )
+    fcs = read_frame(
+        conn,
+        """
+        SELECT id, latitude, longitude FROM FulfillmentCenter
+        WHERE latitude IS NOT NULL AND longitude IS NOT NULL
+        ORDER BY id;
+        """
+    )
+
+    fc_node = {int(fc_id): i for i, fc_id in enumerate(fcs['id'])}
+    store_node = {int(store_id): len(fc_node) + i for i, store_id in enumerate(stores['store_id'])}
+    coords = np.vstack([
+        fcs[['latitude', 'longitude']].to_numpy(dtype=float),
+        stores[['lat', 'lng']].to_numpy(dtype=float)
+    ])
+    dist, durations = get_road_service().matrix(coords)
+
+    by_store = alerts.groupby('store_id')
+    demands = {store_node[s]: int(d) for s, d in by_store['demand'].sum().items() if s in store_node}
+    priorities = {store_node[s]: float(p) for s, p in by_store['priority_score'].max().items() if s in store_node}
+    top_sku = {
+        store_node[int(row['store_id'])]: int(row['sku_id'])
+        for _, row in alerts.sort_values('priority_score').drop_duplicates('store_id', keep='last').iterrows()
+        if int(row['store_id']) in store_node
+    }
+
+    routes = []
+    for _, vehicle in vehicles.iterrows():
+        rows = current[current['vehicle_id'] == vehicle['vehicle_id']]
+        stops = [store_node[int(s)] for s in dict.fromkeys(rows['store_id'].dropna()) if int(s) in store_node]
+        dc_id = rows['dc_id'].dropna()
+        depot = fc_node.get(int(dc_id.iloc[0])) if not dc_id.empty else None
+        if depot is None and stops:
+            depot = 0
+        routes.append({
+            'vehicle_id': int(vehicle['vehicle_id']),
+            'depot': depot,
+            'stops': stops,
+            'capacity': int(vehicle['capacity']),
+            'load': sum(demands.get(node, 0) for node in stops)
+        })
+
+    node_ids = {node: store_id for store_id, node in store_node.items()}
+    node_ids.update({node: fc_id for fc_id, node in fc_node.items()})
+    return {
+        'routes': routes,
+        'dist': dist,
+        'durations': durations,
+        'demands': demands,
+        'priorities': priorities,
+        'top_sku': top_sku,
+        'changes': {store_node[s] for s in store_ids if s in store_node},
+        'depot_nodes': list(fc_node.values()),
+        'node_ids': node_ids
+    }
+
+
+def route_rows(route, plan):
+    """delivery_routes rows for one patched vehicle, with the same time model as route_optimization.py."""
+    dist = plan['dist']
+    durations = plan['durations']
+    rows = []
+    prev = route['depot']
+    elapsed_hours = 0.0
+    for sequence, node in enumerate(route['stops'], start=1):
+        prev_distance = float(dist[prev][node])
+        estimated_time = int(max(1, (durations[prev][node] / 3600) + 0.25))  # drive time + 15 min stop
+        elapsed_hours += estimated_time
+        rows.append((
+            route['vehicle_id'], plan['node_ids'][route['depot']], plan['node_ids'][node],
+            plan['top_sku'].get(node, 1), sequence, prev_distance, estimated_time,
+            max(1, math.ceil(elapsed_hours / 24)), plan['priorities'].get(node, 0.0)
+        ))
+        prev = node
+    return rows
+
+
+def notify_routes_changed(cur, detail, wall_time_s):
+    """
+    Records the rewrite in pipeline_runs and notifies on its channel, both delivered on commit. The notification tells
+    api/main.py to reload its delivery_routes cache; the row lets its pipeline_runs poll catch patches it missed.
+    """
+    cur.execute("SELECT to_regclass('pipeline_runs') IS NOT NULL;")
+    if cur.fetchone()[0]:
+        cur.execute(
+            """
+            INSERT INTO pipeline_runs (run_id, stage, status, wall_time_s, detail)
+            VALUES (%s, 'route_patch', 'success', %s, %s);
+            """,
+            (uuid.uuid4().hex, wall_time_s, detail[:1000])
+        )
+    cur.execute("SELECT pg_notify('pipeline_runs', %s);", (json.dumps({"changed": ["delivery_routes"]}),))
+
+
+def full_solve(conn):
+    """Falls back to route_optimization on the patch's connection and announces the new plan like a patch does."""
+    conn.rollback()  # Ends the patch's read transaction, which would block the full solve's table rewrite
+    started = time.perf_counter()
+    if optimize_routes(conn):
+        with conn.cursor() as cur:
+            notify_routes_changed(cur, "full solve", time.perf_counter() - started)
+        conn.commit()
+
+
+def patch_routes(store_ids):
+    """Inserts the given stores' new or changed alerts into the current plan; returns True if patched in place."""
+    started = time.perf_counter()
+    conn = None
+    cur = None
+    try:
+        if not store_ids:
+            logging.warning("No stores to patch")
+            return False
+        conn = psycopg2.connect(**DB_PARAMS)
+        cur = conn.cursor()
+        plan = load_plan(conn, store_ids)
+        if plan is None or not plan['changes']:
+            logging.warning(f"No known stores among {store_ids}")
+            return False
+        routes = plan['routes']
+        baseline = km_per_stop(routes, plan['dist'])
+        touched, unplaced = patch_plan(
+            routes, plan['changes'], plan['demands'], plan['priorities'], plan['dist'], plan['depot_nodes']
+        )
+        if unplaced:
+            logging.warning(f"Stores {[plan['node_ids'][n] for n in unplaced]} do not fit any nearby vehicle, running full solve")
+            full_solve(conn)
+            return False
+        patched = km_per_stop(routes, plan['dist'])
+        if baseline and patched > baseline * (1 + QUALITY_THRESHOLD):
+            logging.warning(f"Patched plan at {patched:.1f} km/stop vs {baseline:.1f} km/stop, running full solve")
+            full_solve(conn)
+            return False
+
+        affected = [routes[i] for i in sorted(touched)]
+        rows = [row for route in affected for row in route_rows(route, plan)]
+        cur.execute(
+            "DELETE FROM delivery_routes WHERE vehicle_id = ANY(%s);",
+            ([route['vehicle_id'] for route in affected],)
+        )
+        if rows:
+            execute_values(
+                cur,
+                """
+                INSERT INTO delivery_routes (vehicle_id, dc_id, store_id, sku_id, sequence, distance_km,
+                                             estimated_time, eta_days, priority_score)
+                VALUES %s
+                """,
+                rows
+            )
+        notify_routes_changed(
+            cur, f"vehicles {','.join(str(route['vehicle_id']) for route in affected)}", time.perf_counter() - started
+        )
+        conn.commit()
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        logging.info(
+            f"Patched {len(affected)} routes ({len(rows)} stops) in {elapsed_ms:.1f} ms, "
+            f"{baseline:.1f} -> {patched:.1f} km/stop"
+        )
+        return True
+    except Exception as e:
+        logging.error(f"Error patching routes: {e}")
+        if conn:
+            conn.rollback()
+        return False
+    finally:
+        if cur:
+            cur.close()
+        if conn:
+            conn.close()
+
+
+if __name__ == "__main__":
+    patch_routes([int(arg) for arg in sys.argv[1:]])
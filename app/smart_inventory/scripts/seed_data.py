@@ -20,16 +20,20 @@ DB_PARAMS = {
     "port": "5432"
 }
 
-def seed_data():
-    """Populates tables with demo data."""
+def seed_data(conn=None):
+    """Populates tables with demo data, on conn when given (e.g. a pooled connection). Returns False on error."""
+    own_conn = conn is None
+    cur = None
     try:
-        conn = psycopg2.connect(**DB_PARAMS)
+        if own_conn:
+            conn = psycopg2.connect(**DB_PARAMS)
         cur = conn.cursor()
 
         cur.execute("""
             TRUNCATE TABLE stores, products, inventory, forecasts, reorder_alerts,
             delivery_routes, tracking_logs, logistics_metrics, sales,
-            FulfillmentCenter, InventoryItem, vehicles, users
+            FulfillmentCenter, InventoryItem, vehicles, users, dropped_deliveries, tracking_segments,
+            replenishment_allocations
             RESTART IDENTITY CASCADE;
         """)
         conn.commit()
@@ -237,14 +241,16 @@ def seed_data():
 
         conn.commit()
         print("Data seeding completed successfully")
+        return True
     except Error as e:
         print(f"Error seeding data: {e}")
         if conn:
             conn.rollback()
+        return False
     finally:
         if cur:
             cur.close()
-        if conn:
+        if own_conn and conn:
             conn.close()
 
 if __name__ == "__main__":
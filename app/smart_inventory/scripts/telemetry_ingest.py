@@ -0,0 +1,519 @@
+"""
+telemetry_ingest.py
+Purpose: Batched ingest of vehicle positions into tracking_logs, replacing one INSERT per update-location event.
+Positions arrive over a TCP line protocol or HTTP POST, are deduplicated and downsampled per vehicle (stationary
+vehicles keep one ping per STATIONARY_KEEPALIVE_S), buffered in a bounded queue and flushed with binary COPY in
+size/time-bounded batches. A full queue pushes back on producers (TCP reads pause, HTTP answers 503). Batches that
+cannot be written are spooled to disk, fsynced, and replayed on the next start; shutdown drains and flushes.
+Positions of vehicle_ids missing from vehicles would fail the tracking_logs foreign key for their whole batch; they
+are set aside in a reject file instead. Timestamps are written in the server's TimeZone, the clock the backend's
+NOW() and tracking_compaction.py use for the naive timestamp column.
+The listeners have no authentication of their own (the backend socket path checks a JWT per update), so they bind to
+127.0.0.1 unless --host says otherwise; expose them only behind something that authenticates the fleet.
+With --eta every flushed batch also updates the fleet ETA engine (eta_engine.py), served at GET /eta/<vehicle_id>,
+GET /eta/store/<store_id> and GET /eta?since=<version>.
+
+Input formats, one position per line (TCP) or per NDJSON line / JSON array element (HTTP POST /positions):
+    vehicle_id,lat,lng[,epoch_seconds]
+    {"vehicleId": 2, "lat": 29.83, "lng": -95.38, "timestamp": 1751400000.0}   (update-location payload)
+Timestamps are epoch seconds in UTC; positions without one are stamped on arrival.
+
+Execution: Long-running service next to the TrackX backend; --simulate starts a local stand-in fleet.
+Command: python scripts/telemetry_ingest.py [--eta] [--simulate 5000 --interval 0.1]
+"""
+import os
+import json
+import math
+import time
+import signal
+import random
+import asyncio
+import logging
+import argparse
+from datetime import timedelta, timezone
+from urllib.parse import parse_qs
+import numpy as np
+import pandas as pd
+import psycopg2
+from dotenv import dotenv_values
+
+from pg_copy import copy_binary
+from eta_engine import EtaEngine
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+ENV_VALUES = dotenv_values(".env")
+
+DB_PARAMS = {
+    "dbname": "walmart_db",
+    "user": "walmart_user",
+    "password": ENV_VALUES.get("DB_USER_PASSWORD", "securepassword"),
+    "host": "localhost",
+    "port": "5432"
+}
+
+HOST = "127.0.0.1"
+TCP_PORT = 7070
+HTTP_PORT = 7071
+SPOOL_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "telemetry_spool.csv")
+REJECT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "telemetry_rejects.csv")
+
+QUEUE_MAX_BATCHES = 1000  # Each queue entry is one parsed read/request, typically hundreds of positions
+FLUSH_MAX_ROWS = 50_000
+FLUSH_INTERVAL_S = 1.0
+FLUSH_RETRIES = 3
+STATIONARY_METERS = 25  # Moves shorter than this count as standing still
+STATIONARY_KEEPALIVE_S = 60
+STATS_INTERVAL_S = 10
+ETA_PLAN_POLL_S = 30
+READ_CHUNK = 1 << 16
+MAX_LINE_BYTES = 4096  # A TCP line longer than this is dropped as malformed
+MAX_BODY_BYTES = 8 << 20  # Larger HTTP bodies are answered with 413
+VEHICLE_REFRESH_S = 10  # Unknown vehicle_ids reload the vehicles table at most this often
+PG_EPOCH = pd.Timestamp("2000-01-01")
+METERS_PER_DEGREE = 111_320
+HTTP_REASONS = {200: "OK", 202: "Accepted", 400: "Bad Request", 404: "Not Found", 413: "Payload Too Large",
+                503: "Service Unavailable"}
+
+
+def parse_line(line, now):
+    """One position from a csv or JSON line, or None if it is malformed."""
+    try:
+        line = line.strip()
+        if not line:
+            return None
+        if line[:1] in (b"{", "{"):
+            event = json.loads(line)
+            return (int(event["vehicleId"]), float(event["lat"]), float(event["lng"]),
+                    float(event.get("timestamp") or now))
+        fields = line.split(b"," if isinstance(line, bytes) else ",")
+        return (int(fields[0]), float(fields[1]), float(fields[2]), float(fields[3]) if len(fields) > 3 else now)
+    except (ValueError, KeyError, IndexError, TypeError):
+        return None
+
+
+class Downsampler:
+    """
+    Keeps the last stored position per vehicle. Drops repeats and out-of-order pings, and pings of vehicles that
+    moved less than STATIONARY_METERS unless STATIONARY_KEEPALIVE_S passed since the last stored one.
+    """
+
+    def __init__(self, stationary_meters=STATIONARY_METERS, keepalive_s=STATIONARY_KEEPALIVE_S):
+        self.stationary_meters = stationary_meters
+        self.keepalive_s = keepalive_s
+        self.last = {}
+        self.duplicates = 0
+        self.stationary = 0
+
+    def accept(self, positions):
+        kept = []
+        last = self.last
+        for position in positions:
+            vehicle_id, lat, lng, ts = position
+            previous = last.get(vehicle_id)
+            if previous is not None:
+                p_lat, p_lng, p_ts = previous
+                if ts <= p_ts:
+                    self.duplicates += 1
+                    continue
+                d_lat = (lat - p_lat) * METERS_PER_DEGREE
+                d_lng = (lng - p_lng) * METERS_PER_DEGREE * math.cos(math.radians(lat))
+                if d_lat * d_lat + d_lng * d_lng < self.stationary_meters ** 2 and ts - p_ts < self.keepalive_s:
+                    self.stationary += 1
+                    continue
+            last[vehicle_id] = (lat, lng, ts)
+            kept.append(position)
+        return kept
+
+
+def server_local_micros(seconds, tz):
+    """UTC epoch seconds -> binary COPY timestamps (microseconds since 2000-01-01) as wall-clock time in tz."""
+    local = pd.to_datetime(np.asarray(seconds, dtype=float), unit="s", utc=True).tz_convert(tz).tz_localize(None)
+    return ((local - PG_EPOCH) // pd.Timedelta(microseconds=1)).to_numpy(dtype=np.int64)
+
+
+class TelemetryIngest:
+    def __init__(self, spool_path=SPOOL_PATH, flush_max_rows=FLUSH_MAX_ROWS, flush_interval_s=FLUSH_INTERVAL_S, eta=None,
+                 reject_path=REJECT_PATH):
+        self.queue = asyncio.Queue(maxsize=QUEUE_MAX_BATCHES)
+        self.downsampler = Downsampler()
+        self.spool_path = spool_path
+        self.reject_path = reject_path
+        self.flush_max_rows = flush_max_rows
+        self.flush_interval_s = flush_interval_s
+        self.conn = None
+        self.server_tz = timezone.utc
+        self.vehicle_ids = np.empty(0, dtype=np.int64)
+        self.vehicles_loaded_at = float("-inf")
+        self.eta = eta
+        self.stopping = asyncio.Event()
+        self.draining = asyncio.Event()  # Set once no handler can queue anything more
+        self.connections = {}  # handler task -> writer
+        self.stats = {'received': 0, 'malformed': 0, 'rejected': 0, 'flushed': 0, 'spooled': 0, 'unknown_vehicle': 0,
+                      'flushes': 0, 'flush_s': 0.0}
+
+    # Input side
+
+    async def submit(self, lines):
+        """Parses a batch of lines and queues it; waits while the queue is full."""
+        now = time.time()
+        positions = [p for p in (parse_line(line, now) for line in lines) if p is not None]
+        self.stats['malformed'] += len(lines) - len(positions)
+        self.stats['received'] += len(positions)
+        if positions:
+            await self.queue.put(positions)
+        return len(positions)
+
+    def track(self, writer):
+        task = asyncio.current_task()
+        self.connections[task] = writer
+        task.add_done_callback(self.connections.pop)
+
+    async def handle_tcp(self, reader, writer):
+        self.track(writer)
+        tail = b""
+        try:
+            while True:  # Runs to EOF; on shutdown the transport is closed, so received bytes are still queued
+                chunk = await reader.read(READ_CHUNK)
+                if not chunk:
+                    break
+                lines = (tail + chunk).split(b"\n")
+                tail = lines.pop()
+                if len(tail) > MAX_LINE_BYTES:
+                    self.stats['malformed'] += 1
+                    tail = b""
+                await self.submit(lines)  # Blocks reading from this socket while the queue is full
+            if tail:
+                await self.submit([tail])
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def handle_http(self, reader, writer):
+        """Minimal HTTP/1.1 with keep-alive: POST /positions (NDJSON, csv lines or JSON array), GET /health."""
+        self.track(writer)
+        try:
+            while not self.stopping.is_set():
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                method, path, _ = request_line.decode("latin-1").split(" ", 2)
+                headers = {}
+                while True:
+                    header = await reader.readline()
+                    if header in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = header.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                length = int(headers.get("content-length", 0))
+                if length > MAX_BODY_BYTES:
+                    # The body is left unread, so the connection cannot be reused
+                    status, payload = 413, {"error": f"Body larger than {MAX_BODY_BYTES} bytes"}
+                    headers["connection"] = "close"
+                else:
+                    status, payload = await self.route_http(method, path, await reader.readexactly(length))
+                data = json.dumps(payload).encode()
+                head = [f"HTTP/1.1 {status} {HTTP_REASONS[status]}", "Content-Type: application/json",
+                        f"Content-Length: {len(data)}"]
+                if status == 503:
+                    head.append("Retry-After: 1")
+                writer.write(("\r\n".join(head) + "\r\n\r\n").encode() + data)
+                await writer.drain()
+                if headers.get("connection", "").lower() == "close":
+                    break
+        except (ConnectionError, ValueError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def route_http(self, method, path, body):
+        if method == "GET" and path == "/health":
+            return 200, dict(self.stats, queued_batches=self.queue.qsize())
+        if method == "POST" and path == "/positions":
+            return await self.accept_http(body)
+        if method == "GET" and path.startswith("/eta") and self.eta is not None:
+            return self.eta_response(path)
+        return 404, {"error": "Not found"}
+
+    async def accept_http(self, body):
+        if self.queue.full():
+            self.stats['rejected'] += 1
+            return 503, {"error": "Ingest queue full, retry later"}
+        if body.lstrip()[:1] == b"[":
+            try:
+                lines = [json.dumps(event) for event in json.loads(body)]
+            except ValueError:
+                return 400, {"error": "Invalid JSON"}
+        else:
+            lines = body.split(b"\n")
+        return 202, {"accepted": await self.submit(lines)}
+
+    def eta_response(self, path):
+        """Reads from the engine's published table; no computation happens per request."""
+        route, _, query = path.partition("?")
+        parts = route.strip("/").split("/")
+        try:
+            if parts == ["eta"]:
+                since = int(parse_qs(query).get("since", ["0"])[0])
+                return 200, self.eta.changed_since(since)
+            if len(parts) == 2:
+                record = self.eta.get(int(parts[1]))
+            elif len(parts) == 3 and parts[1] == "store":
+                record = self.eta.eta_for_store(int(parts[2]))
+            else:
+                record = None
+        except ValueError:
+            return 400, {"error": "Invalid id"}
+        return (200, record) if record is not None else (404, {"error": "No ETA"})
+
+    # Output side
+
+    def connect(self):
+        if self.conn is None or self.conn.closed:
+            self.conn = psycopg2.connect(**DB_PARAMS)
+            with self.conn.cursor() as cur:
+                cur.execute("SET synchronous_commit = off;")
+                cur.execute("SHOW TimeZone;")
+                self.server_tz = self.resolve_timezone(cur, cur.fetchone()[0])
+            self.conn.commit()
+        return self.conn
+
+    @staticmethod
+    def resolve_timezone(cur, name):
+        """The session TimeZone as a tz pandas accepts; a fixed offset when the name is not an IANA zone."""
+        try:
+            pd.Timestamp(0, tz=name)
+            return name
+        except Exception:
+            cur.execute("SELECT EXTRACT(EPOCH FROM LOCALTIMESTAMP - (NOW() AT TIME ZONE 'UTC'));")
+            offset = float(cur.fetchone()[0])
+            logging.warning(f"Server TimeZone {name!r} is not an IANA zone, using a fixed UTC offset of {offset:.0f}s")
+            return timezone(timedelta(seconds=offset))
+
+    def known_vehicles(self, conn, vehicle_ids):
+        """
+        Mask of rows whose vehicle_id is in vehicles. An unknown id reloads the table, at most every
+        VEHICLE_REFRESH_S, so newly registered vehicles are picked up without a reload per batch.
+        """
+        known = np.isin(vehicle_ids, self.vehicle_ids)
+        if not known.all() and time.monotonic() - self.vehicles_loaded_at > VEHICLE_REFRESH_S:
+            with conn.cursor() as cur:
+                cur.execute("SELECT vehicle_id FROM vehicles;")
+                self.vehicle_ids = np.array([row[0] for row in cur.fetchall()], dtype=np.int64)
+            conn.commit()
+            self.vehicles_loaded_at = time.monotonic()
+            known = np.isin(vehicle_ids, self.vehicle_ids)
+        return known
+
+    def disconnect(self):
+        if self.conn is not None:
+            try:
+                self.conn.close()
+            except psycopg2.Error:
+                pass
+            self.conn = None
+
+    def write_batch(self, positions):
+        """
+        Blocking COPY of positions into tracking_logs; runs in the default executor. Rows of unknown vehicles are
+        written to the reject file after the commit instead of failing the batch's foreign key check.
+        """
+        batch = np.array(positions, dtype=float)
+        conn = self.connect()
+        try:
+            known = self.known_vehicles(conn, batch[:, 0].astype(np.int64))
+            good = batch[known]
+            if len(good):
+                with conn.cursor() as cur:
+                    copy_binary(cur, "tracking_logs", ["vehicle_id", "latitude", "longitude", "timestamp"], [[
+                        (good[:, 0].astype(np.int32), 'int4'),
+                        (good[:, 1], 'float8'),
+                        (good[:, 2], 'float8'),
+                        (server_local_micros(good[:, 3], self.server_tz), 'timestamp'),
+                    ]])
+                conn.commit()
+        except Exception as e:
+            conn.rollback()
+            if isinstance(e, psycopg2.errors.ForeignKeyViolation):
+                self.vehicles_loaded_at = float("-inf")  # A vehicle was deleted meanwhile; reload before the retry
+            raise
+        if not known.all():
+            self.reject([positions[i] for i in np.flatnonzero(~known)])
+        return len(good)
+
+    def reject(self, positions):
+        with open(self.reject_path, "a") as f:
+            f.writelines(f"{v},{lat!r},{lng!r},{ts!r}\n" for v, lat, lng, ts in positions)
+        self.stats['unknown_vehicle'] += len(positions)
+        vehicles = sorted({int(p[0]) for p in positions})
+        logging.warning(f"Rejected {len(positions)} positions of unknown vehicles {vehicles[:10]} to {self.reject_path}")
+
+    def spool(self, positions):
+        with open(self.spool_path, "a") as f:
+            f.writelines(f"{v},{lat!r},{lng!r},{ts!r}\n" for v, lat, lng, ts in positions)
+            f.flush()
+            os.fsync(f.fileno())
+        self.stats['spooled'] += len(positions)
+        logging.warning(f"Spooled {len(positions)} positions to {self.spool_path}")
+
+    def feed_eta(self, positions):
+        batch = np.array(positions, dtype=float)
+        self.eta.update_positions(batch[:, 0].astype(np.int64), batch[:, 1], batch[:, 2], batch[:, 3])
+
+    async def flush(self, positions):
+        loop = asyncio.get_running_loop()
+        started = time.perf_counter()
+        if self.eta is not None:
+            try:
+                await loop.run_in_executor(None, self.feed_eta, positions)
+            except Exception as e:
+                logging.error(f"Error updating ETAs: {e}")
+        for attempt in range(FLUSH_RETRIES):
+            try:
+                self.stats['flushed'] += await loop.run_in_executor(None, self.write_batch, positions)
+                self.stats['flushes'] += 1
+                self.stats['flush_s'] += time.perf_counter() - started
+                return
+            except Exception as e:
+                logging.error(f"Error flushing {len(positions)} positions (attempt {attempt + 1}): {e}")
+                self.disconnect()
+                await asyncio.sleep(0.5 * 2 ** attempt)
+        await loop.run_in_executor(None, self.spool, positions)
+
+    async def replay_spool(self):
+        """
+        Moves the spool aside to .replay before replaying it, so batches that fail again are spooled afresh. A .replay
+        left by a crash mid-replay is replayed first; its already-written batches are written again (at least once).
+        """
+        replay_path = self.spool_path + ".replay"
+        for path in (replay_path, self.spool_path):
+            if not os.path.exists(path):
+                continue
+            if path != replay_path:
+                os.replace(path, replay_path)
+            with open(replay_path) as f:
+                positions = [p for p in (parse_line(line, time.time()) for line in f) if p is not None]
+            logging.info(f"Replaying {len(positions)} spooled positions from {path}")
+            for i in range(0, len(positions), self.flush_max_rows):
+                await self.flush(positions[i:i + self.flush_max_rows])
+            os.remove(replay_path)
+
+    async def flusher(self):
+        """Drains the queue into batches of at most flush_max_rows, flushing at least every flush_interval_s."""
+        pending = []
+        deadline = time.monotonic() + self.flush_interval_s
+        while True:
+            timeout = deadline - time.monotonic()
+            try:
+                positions = await asyncio.wait_for(self.queue.get(), timeout) if timeout > 0 else self.queue.get_nowait()
+                pending.extend(self.downsampler.accept(positions))
+                while len(pending) < self.flush_max_rows and not self.queue.empty():
+                    pending.extend(self.downsampler.accept(self.queue.get_nowait()))
+            except (asyncio.TimeoutError, asyncio.QueueEmpty):
+                pass
+            if self.draining.is_set() and self.queue.empty():
+                break
+            if len(pending) >= self.flush_max_rows or time.monotonic() >= deadline:
+                if pending:
+                    await self.flush(pending[:self.flush_max_rows])
+                    pending = pending[self.flush_max_rows:]
+                deadline = time.monotonic() + self.flush_interval_s
+        while not self.queue.empty():
+            pending.extend(self.downsampler.accept(self.queue.get_nowait()))
+        for i in range(0, len(pending), self.flush_max_rows):
+            await self.flush(pending[i:i + self.flush_max_rows])
+
+    async def report(self):
+        previous = dict(self.stats)
+        while not self.stopping.is_set():
+            await asyncio.sleep(STATS_INTERVAL_S)
+            rate = (self.stats['received'] - previous['received']) / STATS_INTERVAL_S
+            flushes = max(1, self.stats['flushes'] - previous['flushes'])
+            logging.info(
+                f"{rate:,.0f} positions/s in, {self.stats['flushed'] - previous['flushed']:,} flushed, "
+                f"{self.downsampler.stationary:,} stationary and {self.downsampler.duplicates:,} duplicate dropped, "
+                f"{(self.stats['flush_s'] - previous['flush_s']) / flushes * 1000:.0f} ms/flush, "
+                f"queue {self.queue.qsize()}/{QUEUE_MAX_BATCHES}"
+            )
+            previous = dict(self.stats)
+
+    async def refresh_eta_plan(self):
+        loop = asyncio.get_running_loop()
+        while not self.stopping.is_set():
+            await asyncio.sleep(ETA_PLAN_POLL_S)
+            await loop.run_in_executor(None, self.eta.refresh_if_changed)
+
+    async def run(self, host=HOST, tcp_port=TCP_PORT, http_port=HTTP_PORT, simulate=0, interval=1.0):
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(sig, self.stopping.set)
+        if self.eta is not None:
+            await loop.run_in_executor(None, self.eta.load_from_db)
+        await self.replay_spool()
+        tcp = await asyncio.start_server(self.handle_tcp, host, tcp_port)
+        http = await asyncio.start_server(self.handle_http, host, http_port)
+        logging.info(f"Telemetry ingest listening on tcp://{host}:{tcp_port} and http://{host}:{http_port}")
+        flusher = asyncio.create_task(self.flusher())
+        tasks = [asyncio.create_task(self.report())]
+        if self.eta is not None:
+            tasks.append(asyncio.create_task(self.refresh_eta_plan()))
+        if simulate:
+            tasks.append(asyncio.create_task(simulate_fleet("127.0.0.1", tcp_port, simulate, interval, self.stopping)))
+        await self.stopping.wait()
+        logging.info("Shutting down: closing listeners and flushing buffered positions")
+        for task in tasks:
+            task.cancel()
+        tcp.close()
+        http.close()
+        # Closing each connection ends its handler at EOF. The flusher keeps draining meanwhile, so handlers blocked
+        # on a full queue get their last read in before the final flush starts.
+        handlers = list(self.connections.items())
+        for _, writer in handlers:
+            writer.close()
+        await asyncio.gather(*(task for task, _ in handlers), return_exceptions=True)
+        await tcp.wait_closed()
+        await http.wait_closed()
+        self.draining.set()
+        await flusher
+        self.disconnect()
+        logging.info(f"Ingest stopped: {self.stats}")
+
+
+async def simulate_fleet(host, port, vehicles, interval, stopping, seed=7):
+    """
+    Local stand-in for the fleet (what routeai/simulate_vehicle.js does for one vehicle): every interval seconds each
+    vehicle reports over TCP; about a third of them are parked and repeat their position.
+    """
+    rng = random.Random(seed)
+    positions = [[12.9716 + rng.uniform(-3, 3), 77.5946 + rng.uniform(-3, 3)] for _ in range(vehicles)]
+    parked = [rng.random() < 0.35 for _ in range(vehicles)]
+    _, writer = await asyncio.open_connection(host, port)
+    try:
+        while not stopping.is_set():
+            started = time.monotonic()
+            now = time.time()
+            lines = []
+            for v in range(vehicles):
+                if not parked[v]:
+                    positions[v][0] += rng.uniform(-0.002, 0.002)
+                    positions[v][1] += rng.uniform(-0.002, 0.002)
+                lines.append(f"{v + 1},{positions[v][0]:.6f},{positions[v][1]:.6f},{now:.3f}\n")
+            writer.write("".join(lines).encode())
+            await writer.drain()  # Backpressure from the ingest side shows up here
+            await asyncio.sleep(max(0.0, interval - (time.monotonic() - started)))
+    finally:
+        writer.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Batched vehicle telemetry ingest into tracking_logs")
+    parser.add_argument("--host", default=HOST, help="Listen address; the listeners do not authenticate clients")
+    parser.add_argument("--tcp-port", type=int, default=TCP_PORT)
+    parser.add_argument("--http-port", type=int, default=HTTP_PORT)
+    parser.add_argument("--simulate", type=int, default=0, help="Start a stand-in fleet of this many vehicles")
+    parser.add_argument("--interval", type=float, default=1.0, help="Seconds between simulated reports per vehicle")
+    parser.add_argument("--eta", action="store_true", help="Maintain fleet ETAs from the ingested positions")
+    args = parser.parse_args()
+    ingest = TelemetryIngest(eta=EtaEngine() if args.eta else None)
+    asyncio.run(ingest.run(args.host, args.tcp_port, args.http_port, args.simulate, args.interval))
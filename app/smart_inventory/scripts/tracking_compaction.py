@@ -0,0 +1,485 @@
+"""
+tracking_compaction.py
+Purpose: Rolls tracking_logs history up into tracking_segments and serves vehicle path playback over both tables.
+Raw rows are kept for a hot window (HOT_HOURS). Older rows are grouped per vehicle into segments of at most one
+hour, split at trip gaps (TRIP_GAP_S without a ping). Each segment is stored as a delta/varint-encoded blob, the
+binary form of an encoded polyline with a time channel. The raw rows are then deleted, or whole daily partitions
+are dropped once they are fully compacted. Empty daily partitions past the hot window are dropped as well.
+
+Retention tiers:
+    raw rows             newer than HOT_HOURS
+    full-resolution      segments up to FULL_RESOLUTION_DAYS old
+    thinned              one point per COLD_RESOLUTION_S until SEGMENT_RETENTION_DAYS, then deleted
+
+Blob layout: one format byte, then a zigzag varint triple per point: (dlat, dlng, dt). dlat/dlng are deltas of
+degrees x 1e5 (~1 m) and dt is a delta of whole seconds. The first point is a delta from (0, 0, start_time).
+
+Execution: Run hourly (cron) after create_future_partitions; --report compares raw vs compacted storage.
+Command: python scripts/tracking_compaction.py [--hot-hours 48] [--report] [--vehicle 1 --start 2025-07-01 --end 2025-07-02]
+"""
+import argparse
+import logging
+import numpy as np
+import pandas as pd
+import psycopg2
+from psycopg2.extras import execute_values
+from datetime import datetime, timedelta
+from dotenv import dotenv_values
+
+from db_setup import is_partitioned
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+ENV_VALUES = dotenv_values(".env")
+
+DB_PARAMS = {
+    "dbname": "walmart_db",
+    "user": "walmart_user",
+    "password": ENV_VALUES.get("DB_USER_PASSWORD", "securepassword"),
+    "host": "localhost",
+    "port": "5432"
+}
+
+HOT_HOURS = 48
+SEGMENT_SECONDS = 3600
+TRIP_GAP_S = 600  # A pause this long closes the segment, so trips start a new one
+FULL_RESOLUTION_DAYS = 30
+COLD_RESOLUTION_S = 60
+SEGMENT_RETENTION_DAYS = 365
+RETENTION_BATCH = 5000
+FETCH_ROWS = 200_000  # tracking_logs rows held in memory at a time while compacting
+COORD_SCALE = 1e5
+PATH_FORMAT = 1
+
+
+def zigzag(values):
+    values = values.astype(np.int64)
+    return ((values << 1) ^ (values >> 63)).astype(np.uint64)
+
+
+def unzigzag(values):
+    return (values >> np.uint64(1)).astype(np.int64) ^ -(values & np.uint64(1)).astype(np.int64)
+
+
+def varint_encode(values):
+    """LEB128 encoding of a uint64 array, vectorised over the values (at most 10 passes)."""
+    lengths = np.ones(len(values), dtype=np.int64)
+    rest = values >> np.uint64(7)
+    while rest.any():
+        lengths += rest > 0
+        rest >>= np.uint64(7)
+    offsets = np.cumsum(lengths) - lengths
+    out = np.empty(int(lengths.sum()), dtype=np.uint8)
+    rest = values.copy()
+    for k in range(int(lengths.max(initial=0))):
+        live = lengths > k
+        more = (lengths[live] > k + 1).astype(np.uint8) << 7
+        out[offsets[live] + k] = (rest[live] & np.uint64(0x7F)).astype(np.uint8) | more
+        rest >>= np.uint64(7)
+    return out
+
+
+def varint_decode(data):
+    """Inverse of varint_encode for a uint8 array."""
+    if not len(data):
+        return np.empty(0, dtype=np.uint64)
+    last = data < 0x80
+    ends = np.flatnonzero(last)
+    starts = np.concatenate(([0], ends[:-1] + 1))
+    shift = np.arange(len(data)) - np.repeat(starts, ends - starts + 1)
+    parts = (data & 0x7F).astype(np.uint64) << (7 * shift).astype(np.uint64)
+    return np.bitwise_or.reduceat(parts, starts)
+
+
+def encode_path(lat, lng, seconds, start_second):
+    """Encodes one segment; seconds are integer epoch seconds, start_second the segment's start_time."""
+    ilat = np.round(np.asarray(lat) * COORD_SCALE).astype(np.int64)
+    ilng = np.round(np.asarray(lng) * COORD_SCALE).astype(np.int64)
+    deltas = np.column_stack((
+        np.diff(ilat, prepend=0),
+        np.diff(ilng, prepend=0),
+        np.diff(np.asarray(seconds, dtype=np.int64), prepend=start_second),
+    ))
+    return bytes([PATH_FORMAT]) + varint_encode(zigzag(deltas.ravel())).tobytes()
+
+
+def decode_path(blob, start_second):
+    """Returns (lat, lng, epoch seconds) arrays for a segment blob."""
+    blob = bytes(blob)
+    if blob[0] != PATH_FORMAT:
+        raise ValueError(f"Unknown tracking path format {blob[0]}")
+    deltas = unzigzag(varint_decode(np.frombuffer(blob, dtype=np.uint8, offset=1))).reshape(-1, 3)
+    totals = np.cumsum(deltas, axis=0)
+    return totals[:, 0] / COORD_SCALE, totals[:, 1] / COORD_SCALE, totals[:, 2] + start_second
+
+
+def encode_polyline(lat, lng):
+    """Google encoded polyline text (precision 5) for handing a decoded path to the map frontends."""
+    ilat = np.round(np.asarray(lat) * COORD_SCALE).astype(np.int64)
+    ilng = np.round(np.asarray(lng) * COORD_SCALE).astype(np.int64)
+    deltas = np.column_stack((np.diff(ilat, prepend=0), np.diff(ilng, prepend=0))).ravel()
+    chars = []
+    for value in zigzag(deltas).tolist():
+        while value >= 0x20:
+            chars.append(chr((0x20 | (value & 0x1F)) + 63))
+            value >>= 5
+        chars.append(chr(value + 63))
+    return "".join(chars)
+
+
+def to_datetime(second):
+    return datetime(1970, 1, 1) + timedelta(seconds=int(second))
+
+
+def build_segments(vehicle_ids, lat, lng, seconds):
+    """
+    Splits points sorted by (vehicle, time) at vehicle changes, hour boundaries and trip gaps, and encodes each piece.
+    Returns rows for tracking_segments.
+    """
+    if not len(vehicle_ids):
+        return []
+    breaks = np.flatnonzero(
+        (np.diff(vehicle_ids) != 0)
+        | (np.diff(seconds // SEGMENT_SECONDS) != 0)
+        | (np.diff(seconds) > TRIP_GAP_S)
+    ) + 1
+    bounds = np.concatenate(([0], breaks, [len(vehicle_ids)]))
+    rows = []
+    for lo, hi in zip(bounds[:-1], bounds[1:]):
+        start, end = int(seconds[lo]), int(seconds[hi - 1])
+        path = encode_path(lat[lo:hi], lng[lo:hi], seconds[lo:hi], start)
+        rows.append((int(vehicle_ids[lo]), to_datetime(start), to_datetime(end), int(hi - lo), 0, psycopg2.Binary(path)))
+    return rows
+
+
+def stream_points(cur, fetch_rows=FETCH_ROWS):
+    """
+    Yields (vehicle_ids, lat, lng, seconds) arrays from a cursor ordered by vehicle, then time, about fetch_rows at a
+    time. Each chunk ends at a (vehicle, hour) boundary; the rows after it are carried into the next chunk, so
+    build_segments always sees whole segments.
+    """
+    carry = None
+    while True:
+        rows = cur.fetchmany(fetch_rows)
+        if not rows:
+            if carry is not None and len(carry[0]):
+                yield carry
+            return
+        vehicle_ids, lat, lng, seconds = zip(*rows)
+        chunk = (
+            np.array(vehicle_ids, dtype=np.int64),
+            np.array(lat, dtype=float),
+            np.array(lng, dtype=float),
+            np.round(np.array(seconds, dtype=float)).astype(np.int64),
+        )
+        if carry is not None:
+            chunk = tuple(np.concatenate(pair) for pair in zip(carry, chunk))
+        vehicle_ids, seconds = chunk[0], chunk[3]
+        # The last (vehicle, hour) may continue in the next fetch; it is a contiguous suffix in this order
+        open_group = (vehicle_ids == vehicle_ids[-1]) & (seconds // SEGMENT_SECONDS == seconds[-1] // SEGMENT_SECONDS)
+        closed = np.flatnonzero(~open_group)
+        split = int(closed[-1]) + 1 if len(closed) else 0
+        carry = tuple(c[split:] for c in chunk)
+        if split:
+            yield tuple(c[:split] for c in chunk)
+
+
+def db_now(cur):
+    """tracking_logs timestamps are the server's local CURRENT_TIMESTAMP, so windows are measured on that clock."""
+    cur.execute("SELECT LOCALTIMESTAMP;")
+    return cur.fetchone()[0]
+
+
+def day_partitions(cur):
+    """Names of the tracking_logs_YYYYMMDD partitions; the default partition is not a day."""
+    cur.execute("""
+        SELECT c.relname FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = 'tracking_logs'::regclass AND c.relname ~ '^tracking_logs_[0-9]{8}$'
+    """)
+    return {row[0] for row in cur.fetchall()}
+
+
+def drop_empty_partitions(conn, cur, partitions, cutoff):
+    """
+    Drops daily partitions that end before the cutoff and hold no rows, e.g. days with no traffic. compact() only
+    walks forward from the oldest row, so these would otherwise never be revisited. Returns how many were dropped.
+    """
+    dropped = 0
+    for partition in sorted(partitions):
+        day = datetime.strptime(partition[len("tracking_logs_"):], "%Y%m%d")
+        if day + timedelta(days=1) > cutoff:
+            continue
+        cur.execute(f"LOCK TABLE {partition} IN ACCESS EXCLUSIVE MODE;")
+        cur.execute(f"SELECT EXISTS (SELECT 1 FROM {partition});")
+        if not cur.fetchone()[0]:
+            cur.execute(f"DROP TABLE {partition};")
+            partitions.discard(partition)
+            dropped += 1
+        conn.commit()
+    return dropped
+
+
+def compact(hot_hours=HOT_HOURS, now=None, conn=None):
+    """
+    Compacts tracking_logs rows older than the hot window, one day per transaction. Each day is streamed through a
+    server-side cursor in (vehicle, time) order, so memory stays at FETCH_ROWS rows however busy the fleet is. Days
+    whose daily partition is entirely past the cutoff are read under an exclusive lock and dropped. Otherwise the
+    day is read and deleted in one REPEATABLE READ snapshot, so rows arriving mid-run are left for the next run,
+    never lost. Rows without a vehicle_id cannot be played back; they are left in place and reported. Returns the rows
+    compacted, or None on error.
+    """
+    own_conn = conn is None
+    cur = None
+    try:
+        if own_conn:
+            conn = psycopg2.connect(**DB_PARAMS)
+        cur = conn.cursor()
+        now = now or db_now(cur)
+        cutoff = (now - timedelta(hours=hot_hours)).replace(minute=0, second=0, microsecond=0)
+        partitions = day_partitions(cur) if is_partitioned(cur, "tracking_logs") else set()
+        emptied = drop_empty_partitions(conn, cur, partitions, cutoff)
+        cur.execute("SELECT MIN(timestamp) FROM tracking_logs WHERE timestamp < %s AND vehicle_id IS NOT NULL;", (cutoff,))
+        oldest = cur.fetchone()[0]
+        if oldest is None:
+            logging.info(f"No tracking_logs rows older than {cutoff}, {emptied} empty partitions dropped")
+            conn.commit()
+            return 0
+        conn.commit()
+
+        day = oldest.replace(hour=0, minute=0, second=0, microsecond=0)
+        total_rows = total_segments = dropped = orphaned = 0
+        while day < cutoff:
+            day_end = min(day + timedelta(days=1), cutoff)
+            partition = f"tracking_logs_{day:%Y%m%d}"
+            whole = day_end == day + timedelta(days=1) and partition in partitions
+            # Must be the transaction's first statement: the stream and the DELETE below share its snapshot
+            cur.execute("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ;")
+            if whole:
+                cur.execute(f"LOCK TABLE {partition} IN ACCESS EXCLUSIVE MODE;")
+                source, where, params = partition, "TRUE", ()
+            else:
+                source, where, params = "tracking_logs", "timestamp >= %s AND timestamp < %s", (day, day_end)
+            cur.execute(f"SELECT COUNT(*) FROM {source} WHERE {where} AND vehicle_id IS NULL;", params)
+            orphans = cur.fetchone()[0]
+
+            stream = conn.cursor(name=f"tracking_compaction_{day:%Y%m%d}")
+            stream.itersize = FETCH_ROWS
+            # DESC matches the (vehicle_id, timestamp DESC) index read backwards; segments only need vehicles contiguous
+            stream.execute(f"""
+                SELECT vehicle_id, latitude, longitude, EXTRACT(EPOCH FROM timestamp)
+                FROM {source}
+                WHERE {where} AND vehicle_id IS NOT NULL
+                ORDER BY vehicle_id DESC, timestamp
+            """, params)
+            rows = segments = 0
+            for points in stream_points(stream):
+                batch = build_segments(*points)
+                execute_values(cur, """
+                    INSERT INTO tracking_segments (vehicle_id, start_time, end_time, point_count, resolution_s, path)
+                    VALUES %s
+                """, batch, page_size=1000)
+                rows += len(points[0])
+                segments += len(batch)
+            stream.close()
+
+            if whole and not orphans:
+                cur.execute(f"DROP TABLE {partition};")
+                dropped += 1
+            elif rows:
+                cur.execute(f"DELETE FROM {source} WHERE {where} AND vehicle_id IS NOT NULL;", params)
+            conn.commit()
+            total_rows += rows
+            total_segments += segments
+            orphaned += orphans
+            if rows:
+                logging.info(f"Compacted {rows} rows from {day:%Y-%m-%d} into {segments} segments")
+            if orphans:
+                logging.warning(f"Left {orphans} tracking_logs rows without vehicle_id from {day:%Y-%m-%d} in place")
+            day += timedelta(days=1)
+
+        logging.info(
+            f"Compaction done: {total_rows} rows -> {total_segments} segments, {dropped + emptied} partitions dropped, "
+            f"{orphaned} rows without vehicle_id left (hot window starts {cutoff})"
+        )
+        return total_rows
+    except Exception as e:
+        logging.error(f"Error compacting tracking logs: {e}")
+        if conn:
+            conn.rollback()
+        return None
+    finally:
+        if cur:
+            cur.close()
+        if own_conn and conn:
+            conn.close()
+
+
+def thin_path(blob, start_second, resolution_s):
+    """Keeps the first point of every resolution_s bucket plus the final point."""
+    lat, lng, seconds = decode_path(blob, start_second)
+    _, keep = np.unique((seconds - start_second) // resolution_s, return_index=True)
+    keep = np.union1d(keep, [len(seconds) - 1])
+    return encode_path(lat[keep], lng[keep], seconds[keep], start_second), len(keep)
+
+
+def apply_retention(now=None, conn=None):
+    """Thins segments past FULL_RESOLUTION_DAYS to COLD_RESOLUTION_S and deletes those past SEGMENT_RETENTION_DAYS."""
+    own_conn = conn is None
+    cur = None
+    try:
+        if own_conn:
+            conn = psycopg2.connect(**DB_PARAMS)
+        cur = conn.cursor()
+        now = now or db_now(cur)
+        cur.execute(
+            "DELETE FROM tracking_segments WHERE end_time < %s;", (now - timedelta(days=SEGMENT_RETENTION_DAYS),)
+        )
+        expired = cur.rowcount
+        conn.commit()
+
+        thinned = 0
+        last_id = 0
+        while True:
+            # Keyset pages: each batch is bounded and no page rescans segments already thinned
+            cur.execute("""
+                SELECT segment_id, EXTRACT(EPOCH FROM start_time)::BIGINT, path
+                FROM tracking_segments
+                WHERE end_time < %s AND resolution_s < %s AND segment_id > %s
+                ORDER BY segment_id
+                LIMIT %s
+            """, (now - timedelta(days=FULL_RESOLUTION_DAYS), COLD_RESOLUTION_S, last_id, RETENTION_BATCH))
+            batch = cur.fetchall()
+            if not batch:
+                break
+            last_id = batch[-1][0]
+            updates = []
+            for segment_id, start_second, path in batch:
+                thin, count = thin_path(path, start_second, COLD_RESOLUTION_S)
+                updates.append((segment_id, count, psycopg2.Binary(thin)))
+            execute_values(cur, """
+                UPDATE tracking_segments AS s
+                SET point_count = v.point_count, path = v.path, resolution_s = %s
+                FROM (VALUES %%s) AS v (segment_id, point_count, path)
+                WHERE s.segment_id = v.segment_id
+            """ % COLD_RESOLUTION_S, updates, page_size=1000)
+            conn.commit()
+            thinned += len(updates)
+
+        logging.info(f"Retention: {expired} segments expired, {thinned} thinned to {COLD_RESOLUTION_S}s")
+        return True
+    except Exception as e:
+        logging.error(f"Error applying tracking retention: {e}")
+        if conn:
+            conn.rollback()
+        return False
+    finally:
+        if cur:
+            cur.close()
+        if own_conn and conn:
+            conn.close()
+
+
+def read_vehicle_path(vehicle_id, start, end, conn=None):
+    """
+    A vehicle's positions in [start, end), decoded from tracking_segments and merged with the raw tracking_logs rows.
+    Returns a DataFrame with timestamp, latitude and longitude ordered by time.
+    """
+    own_conn = conn is None
+    cur = None
+    try:
+        if own_conn:
+            conn = psycopg2.connect(**DB_PARAMS)
+        cur = conn.cursor()
+        cur.execute("""
+            SELECT EXTRACT(EPOCH FROM start_time)::BIGINT, path
+            FROM tracking_segments
+            WHERE vehicle_id = %s AND start_time < %s AND end_time >= %s
+            ORDER BY start_time
+        """, (vehicle_id, end, start))
+        parts = [decode_path(path, start_second) for start_second, path in cur.fetchall()]
+
+        raw = conn.cursor(name=f"tracking_path_{vehicle_id}")
+        raw.execute("""
+            SELECT latitude, longitude, EXTRACT(EPOCH FROM timestamp)
+            FROM tracking_logs
+            WHERE vehicle_id = %s AND timestamp >= %s AND timestamp < %s
+        """, (vehicle_id, start, end))
+        while True:
+            rows = raw.fetchmany(FETCH_ROWS)
+            if not rows:
+                break
+            parts.append(tuple(np.array(c, dtype=float) for c in zip(*rows)))
+        raw.close()
+
+        if not parts:
+            return pd.DataFrame(columns=["timestamp", "latitude", "longitude"])
+        lat, lng, seconds = (np.concatenate(c) for c in zip(*parts))
+        path = pd.DataFrame({
+            "timestamp": pd.to_datetime(seconds, unit="s"),
+            "latitude": lat,
+            "longitude": lng,
+        })
+        path = path[(path["timestamp"] >= pd.Timestamp(start)) & (path["timestamp"] < pd.Timestamp(end))]
+        return path.sort_values("timestamp", kind="stable").reset_index(drop=True)
+    except Exception as e:
+        logging.error(f"Error reading path for vehicle {vehicle_id}: {e}")
+        return pd.DataFrame(columns=["timestamp", "latitude", "longitude"])
+    finally:
+        if cur:
+            cur.close()
+        if own_conn and conn:
+            conn.close()
+
+
+def storage_report():
+    """Logs bytes per point for raw tracking_logs rows vs tracking_segments, including indexes and TOAST."""
+    conn = None
+    cur = None
+    try:
+        conn = psycopg2.connect(**DB_PARAMS)
+        cur = conn.cursor()
+        cur.execute("""
+            SELECT COALESCE(SUM(pg_total_relation_size(inhrelid)), 0) + pg_total_relation_size('tracking_logs')
+            FROM pg_inherits WHERE inhparent = 'tracking_logs'::regclass
+        """)
+        raw_bytes = cur.fetchone()[0]
+        cur.execute("SELECT COUNT(*) FROM tracking_logs;")
+        raw_rows = cur.fetchone()[0]
+        cur.execute("SELECT COUNT(*), COALESCE(SUM(point_count), 0), pg_total_relation_size('tracking_segments') FROM tracking_segments;")
+        segments, points, segment_bytes = cur.fetchone()
+        raw_per_row = raw_bytes / raw_rows if raw_rows else 0
+        per_point = segment_bytes / points if points else 0
+        logging.info(f"tracking_logs: {raw_rows} rows, {raw_bytes / 1e6:.1f} MB, {raw_per_row:.1f} B/row")
+        logging.info(f"tracking_segments: {segments} segments, {points} points, {segment_bytes / 1e6:.1f} MB, {per_point:.1f} B/point")
+        if raw_per_row and per_point:
+            logging.info(f"Compaction ratio: {raw_per_row / per_point:.1f}x")
+    except Exception as e:
+        logging.error(f"Error reporting tracking storage: {e}")
+    finally:
+        if cur:
+            cur.close()
+        if conn:
+            conn.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compact tracking_logs into encoded path segments")
+    parser.add_argument("--hot-hours", type=int, default=HOT_HOURS, help="Hours of raw rows to keep")
+    parser.add_argument("--report", action="store_true", help="Only report raw vs compacted storage")
+    parser.add_argument("--vehicle", type=int, help="Print the decoded path of this vehicle instead of compacting")
+    parser.add_argument("--start", type=pd.Timestamp, help="Path start (with --vehicle)")
+    parser.add_argument("--end", type=pd.Timestamp, help="Path end (with --vehicle)")
+    args = parser.parse_args()
+    if args.report:
+        storage_report()
+    elif args.vehicle is not None:
+        end = args.end or pd.Timestamp.now()
+        start = args.start or end - pd.Timedelta(days=1)
+        path = read_vehicle_path(args.vehicle, start.to_pydatetime(), end.to_pydatetime())
+        print(path.to_string(index=False))
+        print(encode_polyline(path["latitude"], path["longitude"]))
+    else:
+        compact(args.hot_hours)
+        apply_retention()
+        storage_report()
@@ -0,0 +1,299 @@
+"""
+vrp_benchmark.py
+Purpose: Benchmarks the routing entry points (route_optimization.solve_vrp and route_patching.patch_plan) on seeded
+synthetic CVRP instances shaped like walmart_db data, without a database. Depots are the FulfillmentCenter sites from
+seed_data.py, store demand follows the reorder_alerts shortfall model (reorder_threshold - current_stock over 5 SKUs)
+and the fleet is drawn from the vehicles capacities. Each size runs in its own interpreter and every case records the
+peak resident memory it added, which covers the OR-Tools C++ heap as well as Python objects. Each run appends solve
+time, objective, vehicles used and peak RSS to a JSON history under benchmark_results/ and flags regressions against
+the last run saved as a baseline. solve_vrp runs to a fixed solution count rather than on the clock, so objectives
+repeat between runs on the same seed; a time ceiling only guards against runaway sizes.
+
+Execution: Run after changing route_optimization.py or route_patching.py.
+Command: python scripts/vrp_benchmark.py [--sizes 10 50 100] [--save-baseline]
+"""
+import os
+import sys
+import json
+import time
+import logging
+import argparse
+import resource
+import subprocess
+import numpy as np
+from datetime import datetime
+
+from route_optimization import solve_vrp, drop_penalties, SOLVE_STALL_S
+from route_patching import patch_plan, route_distance
+from road_distance import RoadDistanceService, HaversineBackend
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+HISTORY_PATH = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "..", "benchmark_results", "vrp_benchmark_history.json"
+)
+
+SIZES = [10, 50, 100, 500, 1000, 5000]
+FC_SITES = [(12.9716, 77.5946), (28.7041, 77.1025), (19.0760, 72.8777)]  # FulfillmentCenter rows in seed_data.py
+VEHICLE_CAPACITIES = [1000, 1500, 1200, 800]  # vehicles rows in seed_data.py
+SKUS_PER_STORE = 5
+SAFETY_STOCK = 20  # Same as demand_forecasting.generate_reorder_alerts
+STORES_PER_FC = 500  # Extra depots are added around the seeded sites beyond this many stores per depot
+PATCH_SHARE = 0.05  # Share of stores treated as new alerts in the patching case
+
+REGRESSION_TOLERANCE = {
+    'solve_time_s': 0.20,
+    'time_to_first_solution_s': 0.20,
+    'objective': 0.02,
+    'peak_rss_mb': 0.20
+}
+MIN_TIME_DELTA_S = 0.05  # Timing changes smaller than this are treated as noise
+SOLUTION_LIMIT = 100  # Deterministic stop for solve_vrp; the stall window is disabled
+
+
+def time_limit_for(num_nodes):
+    """Ceiling for one solve. Runs that reach it end on wall-clock time and are left out of objective comparisons."""
+    return max(10 * SOLVE_STALL_S, min(300, num_nodes // 10))
+
+
+def generate_instance(num_nodes, seed, capacity_ratio=1.1):
+    """
+    Seeded CVRP instance with num_nodes nodes (depots included). The fleet covers capacity_ratio times the total
+    demand, so values below 1.0 produce over-subscribed instances where stores have to be dropped.
+    """
+    rng = np.random.default_rng(seed * 100003 + num_nodes)
+    num_depots = max(1, min(max(len(FC_SITES), num_nodes // STORES_PER_FC), num_nodes // 2))
+    sites = np.array(FC_SITES, dtype=float)
+    depots = sites[np.arange(num_depots) % len(sites)]
+    depots[len(sites):] += rng.normal(0, 2.0, size=(max(0, num_depots - len(sites)), 2))
+    num_stores = num_nodes - num_depots
+    home = rng.integers(0, num_depots, size=num_stores)
+    stores = depots[home] + rng.normal(0, 2.5, size=(num_stores, 2))
+    stores[:, 0] = stores[:, 0].clip(8.0, 33.0)
+    stores[:, 1] = stores[:, 1].clip(69.0, 88.0)
+
+    # reorder_alerts shortfall: threshold = monthly forecast (capped at 100) + safety stock, stock below threshold
+    daily_sales = rng.gamma(shape=4.0, scale=3.0, size=(num_stores, SKUS_PER_STORE))
+    threshold = np.minimum(np.round(daily_sales * 30), 100) + SAFETY_STOCK
+    stock = np.floor(rng.uniform(0, 1, size=threshold.shape) * threshold)
+    shortfall = threshold - stock
+    priority = (shortfall / threshold).max(axis=1)
+
+    total_demand = int(shortfall.sum())
+    capacities = []
+    while sum(capacities) < capacity_ratio * total_demand:
+        capacities.append(int(rng.choice(VEHICLE_CAPACITIES)))
+    coords = np.vstack([depots, stores])
+    return {
+        'coords': coords,
+        'distance_matrix': RoadDistanceService(HaversineBackend()).matrix(coords)[0],
+        'demands': [0] * num_depots + shortfall.sum(axis=1).astype(int).tolist(),
+        'priorities': [0.0] * num_depots + priority.tolist(),
+        'vehicle_capacities': capacities,
+        'num_vehicles': len(capacities),
+        'starts': [i % num_depots for i in range(len(capacities))],
+        'ends': [i % num_depots for i in range(len(capacities))],
+        'num_depots': num_depots
+    }
+
+
+def read_status_mb(field):
+    """VmRSS / VmHWM of this process in MB, or None where /proc is unavailable."""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith(field + ":"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        return None
+    return None
+
+
+def reset_peak_rss():
+    """Resets VmHWM to the current RSS (Linux 4.0+); returns False where that is not supported."""
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def measure(func):
+    """
+    Runs func once and returns (result, wall seconds, peak RSS added in MB). On Linux the high-water mark is reset
+    first, so earlier cases in the process do not hide this one's peak; elsewhere the ru_maxrss growth is used.
+    """
+    if reset_peak_rss():
+        before = read_status_mb("VmRSS")
+        peak = lambda: read_status_mb("VmHWM")
+    else:
+        before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+        peak = lambda: resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    started = time.perf_counter()
+    result = func()
+    elapsed = time.perf_counter() - started
+    return result, elapsed, max(0.0, peak() - before)
+
+
+def bench_solve(instance, penalties):
+    """Returns (metrics, solve_vrp result or None)."""
+    data = {key: instance[key] for key in ('distance_matrix', 'demands', 'vehicle_capacities', 'num_vehicles', 'starts', 'ends')}
+    if penalties:
+        data['penalties'] = drop_penalties(instance['distance_matrix'], instance['priorities'])
+    num_nodes = len(instance['demands'])
+    result, elapsed, peak_mb = measure(
+        lambda: solve_vrp(data, time_limit_for(num_nodes), stall_s=float('inf'), solution_limit=SOLUTION_LIMIT)
+    )
+    if not result:
+        return {'solved': False, 'solve_time_s': elapsed, 'peak_rss_mb': peak_mb}, None
+    return {
+        'solved': True,
+        'solve_time_s': result['solve_time_s'],
+        'time_to_first_solution_s': result['time_to_first_solution_s'],
+        'objective': result['objective'],
+        'distance_km': result['distance_km'],
+        'vehicles_used': result['vehicles_used'],
+        'dropped': len(result['dropped']),
+        'solution_limit_reached': result['solutions'] >= SOLUTION_LIMIT,
+        'peak_rss_mb': peak_mb
+    }, result
+
+
+def bench_patch(instance, solved):
+    """Removes PATCH_SHARE of the served stores from a solved plan and times re-inserting them with patch_plan."""
+    dist = instance['distance_matrix']
+    demands = dict(enumerate(instance['demands']))
+    priorities = dict(enumerate(instance['priorities']))
+    served = [node for route in solved['routes'] for node in route]
+    rng = np.random.default_rng(len(served))
+    changes = set(rng.choice(served, size=max(1, int(len(served) * PATCH_SHARE)), replace=False).tolist())
+    routes = []
+    for vehicle, route in enumerate(solved['routes']):
+        stops = [node for node in route if node not in changes]
+        routes.append({
+            'vehicle_id': vehicle,
+            'depot': instance['starts'][vehicle],
+            'stops': stops,
+            'capacity': instance['vehicle_capacities'][vehicle],
+            'load': sum(demands[node] for node in stops)
+        })
+    depot_nodes = list(range(instance['num_depots']))
+    (touched, unplaced), elapsed, peak_mb = measure(
+        lambda: patch_plan(routes, changes, demands, priorities, dist, depot_nodes)
+    )
+    return {
+        'solve_time_s': elapsed,
+        'objective': int(sum(route_distance(r['depot'], r['stops'], dist) for r in routes) * 1000),
+        'vehicles_used': sum(1 for r in routes if r['stops']),
+        'routes_touched': len(touched),
+        'unplaced': len(unplaced),
+        'peak_rss_mb': peak_mb
+    }
+
+
+def run_size(size, seed):
+    results = {}
+    feasible = generate_instance(size, seed)
+    metrics, solved = bench_solve(feasible, penalties=True)
+    results[f"solve_vrp/n={size}"] = metrics
+    if solved and any(solved['routes']):
+        results[f"patch_plan/n={size}"] = bench_patch(feasible, solved)
+    oversubscribed = generate_instance(size, seed, capacity_ratio=0.6)
+    results[f"solve_vrp_oversubscribed/n={size}"], _ = bench_solve(oversubscribed, penalties=True)
+    return results
+
+
+def run_suite(sizes, seed):
+    """Runs each size in a fresh interpreter, so memory freed by one size cannot be reused to flatter the next."""
+    results = {}
+    for size in sizes:
+        logging.info(f"Benchmarking {size} nodes")
+        output = subprocess.check_output(
+            [sys.executable, os.path.abspath(__file__), "--child-size", str(size), "--seed", str(seed)], text=True
+        )
+        results.update(json.loads(output))
+    return results
+
+
+def find_regressions(results, baseline):
+    regressions = []
+    for case, metrics in results.items():
+        base = baseline['results'].get(case)
+        if not base:
+            continue
+        if base.get('solved', True) and not metrics.get('solved', True):
+            regressions.append(f"{case}: no solution (baseline solved)")
+            continue
+        # Objectives of solves cut off by the time ceiling depend on machine speed, not on the code
+        comparable_objective = metrics.get('solution_limit_reached', True) and base.get('solution_limit_reached', True)
+        for metric, tolerance in REGRESSION_TOLERANCE.items():
+            if metric == 'objective' and not comparable_objective:
+                continue
+            if metric in metrics and base.get(metric):
+                delta = metrics[metric] - base[metric]
+                if metric.endswith('_s') and delta < MIN_TIME_DELTA_S:
+                    continue
+                growth = delta / base[metric]
+                if growth > tolerance:
+                    regressions.append(f"{case}: {metric} {base[metric]:.4g} -> {metrics[metric]:.4g} (+{growth:.0%})")
+    return regressions
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], text=True, stderr=subprocess.DEVNULL).strip()
+    except Exception:
+        return None
+
+
+def load_history(path):
+    if not os.path.exists(path):
+        return []
+    with open(path) as f:
+        return json.load(f)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the VRP solver entry points on synthetic instances")
+    parser.add_argument("--sizes", type=int, nargs="+", default=SIZES)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--history", default=HISTORY_PATH)
+    parser.add_argument("--save-baseline", action="store_true", help="Mark this run as the new regression baseline")
+    parser.add_argument("--child-size", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child_size is not None:
+        print(json.dumps(run_size(args.child_size, args.seed)))
+        return 0
+
+    history = load_history(args.history)
+    results = run_suite(args.sizes, args.seed)
+    run = {
+        'timestamp': datetime.now().isoformat(timespec='seconds'),
+        'revision': git_revision(),
+        'seed': args.seed,
+        'max_rss_mb': resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024,
+        'baseline': args.save_baseline,
+        'results': results
+    }
+    baselines = [entry for entry in history if entry.get('baseline') and entry.get('seed') == args.seed]
+    regressions = find_regressions(results, baselines[-1]) if baselines else []
+    run['regressions'] = regressions
+    history.append(run)
+    os.makedirs(os.path.dirname(os.path.abspath(args.history)), exist_ok=True)
+    with open(args.history, "w") as f:
+        json.dump(history, f, indent=2)
+
+    for case, metrics in results.items():
+        logging.info(f"{case}: " + ", ".join(
+            f"{k}={v:.4g}" if isinstance(v, float) else f"{k}={v}" for k, v in metrics.items()
+        ))
+    if not baselines:
+        logging.info("No baseline recorded yet; rerun with --save-baseline to set one")
+    for regression in regressions:
+        logging.warning(f"Regression: {regression}")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
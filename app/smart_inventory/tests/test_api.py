@@ -0,0 +1,107 @@
+import os
+import importlib.util
+
+import pandas as pd
+import pytest
+from fastapi.testclient import TestClient
+
+# api/main.py shares its module name with the orchestrator, so it is loaded under its own name
+spec = importlib.util.spec_from_file_location(
+    "inventory_api", os.path.join(os.path.dirname(__file__), "..", "api", "main.py")
+)
+api = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(api)
+
+FORECASTS = pd.DataFrame({
+    "store_id": [3, 1, 2, 1, 2, 3, 1],
+    "sku_id": [1, 2, 1, 1, 3, 2, 3],
+    "predicted_demand": [30, 12, 20, 11, 23, 32, 13],
+})
+
+
+@pytest.fixture
+def client(monkeypatch):
+    reads = []
+
+    def read_sql(query, engine):
+        reads.append(query)
+        return FORECASTS.copy()
+
+    monkeypatch.setattr(api.pd, "read_sql", read_sql)
+    monkeypatch.setattr(api, "cache", api.DatasetCache())
+    client = TestClient(api.app)  # Not entered as a context manager: the lifespan would start the DB listener
+    client.reads = reads
+    return client
+
+
+def test_pages_follow_key_order(client):
+    rows = []
+    cursor = None
+    pages = 0
+    while True:
+        params = {"limit": 3, **({"after": cursor} if cursor else {})}
+        body = client.get("/forecasts", params=params).json()
+        rows += list(zip(body["data"]["store_id"], body["data"]["sku_id"]))
+        pages += 1
+        cursor = body["next"]
+        if cursor is None:
+            break
+    assert pages == 3
+    assert rows == sorted(zip(FORECASTS["store_id"], FORECASTS["sku_id"]))
+    assert len(client.reads) == 1
+
+
+def test_filters(client):
+    body = client.get("/forecasts", params={"store_id": 2}).json()
+    assert body["count"] == 2
+    assert body["data"]["store_id"] == [2, 2]
+    assert body["data"]["sku_id"] == [1, 3]
+    assert body["data"]["predicted_demand"] == [20, 23]
+
+    body = client.get("/forecasts", params={"store_id": 1, "sku_id": 3}).json()
+    assert body["data"]["predicted_demand"] == [13]
+
+
+def test_filtered_pages(client):
+    first = client.get("/forecasts", params={"store_id": 1, "limit": 2}).json()
+    assert first["data"]["sku_id"] == [1, 2]
+    second = client.get("/forecasts", params={"store_id": 1, "limit": 2, "after": first["next"]}).json()
+    assert second["data"]["sku_id"] == [3]
+    assert second["next"] is None
+
+
+def test_bad_requests(client):
+    assert client.get("/unknown").status_code == 404
+    assert client.get("/forecasts", params={"store_id": "x"}).status_code == 400
+    assert client.get("/forecasts", params={"after": "not-a-cursor"}).status_code == 400
+
+
+def test_etag_revalidation(client):
+    response = client.get("/forecasts", params={"limit": 2})
+    etag = response.headers["etag"]
+    assert response.status_code == 200
+
+    def revalidate(if_none_match):
+        return client.get("/forecasts", params={"limit": 2}, headers={"If-None-Match": if_none_match}).status_code
+
+    assert revalidate(etag) == 304
+    assert revalidate(f'"other", {etag}') == 304
+    assert revalidate(f"W/{etag}") == 304
+    assert revalidate("*") == 304
+    assert revalidate('"other"') == 200
+    assert revalidate(etag[:-1] + 'x"') == 200
+    assert revalidate(f'"stale{etag}"') == 200  # Contains the tag as a substring
+    # Another page of the same snapshot has its own tag
+    other_page = client.get("/forecasts", params={"limit": 3}, headers={"If-None-Match": etag})
+    assert other_page.status_code == 200
+    assert other_page.headers["etag"] != etag
+
+
+def test_etag_changes_with_content(client, monkeypatch):
+    etag = client.get("/forecasts").headers["etag"]
+    changed = FORECASTS.assign(predicted_demand=FORECASTS["predicted_demand"] + 1)
+    monkeypatch.setattr(api.pd, "read_sql", lambda query, engine: changed)
+    api.cache.reload(["forecasts"])
+    response = client.get("/forecasts", headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.headers["etag"] != etag
@@ -0,0 +1,78 @@
+import pandas as pd
+
+import replenishment_allocation as ra
+
+
+def shortfalls(rows):
+    return pd.DataFrame(rows, columns=["store_id", "sku_id", "sku", "demand", "priority_score", "lat", "lng"])
+
+
+def stock(rows):
+    return pd.DataFrame(rows, columns=["inventory_item_id", "fc_id", "sku", "quantity"])
+
+
+def fcs(rows):
+    return pd.DataFrame(rows, columns=["id", "latitude", "longitude", "current_workload", "handling_capacity"])
+
+
+# FC 1 sits next to the stores, FC 2 about 110 km north
+FCS = fcs([(1, 12.97, 77.59, 0, 1000), (2, 13.97, 77.59, 0, 1000)])
+
+
+def test_nearest_fc_supplies_first():
+    allocations, unmet = ra.solve_allocation(
+        shortfalls([(10, 1, "SKU001", 30, 1.0, 12.98, 77.60)]),
+        stock([(100, 1, "SKU001", 20), (200, 2, "SKU001", 50)]),
+        FCS,
+    )
+    by_item = allocations.set_index("inventory_item_id")["quantity"]
+    assert by_item.to_dict() == {100: 20, 200: 10}
+    assert unmet.empty
+
+
+def test_fc_capacity_limits_allocation():
+    allocations, unmet = ra.solve_allocation(
+        shortfalls([(10, 1, "SKU001", 30, 1.0, 12.98, 77.60)]),
+        stock([(100, 1, "SKU001", 50)]),
+        fcs([(1, 12.97, 77.59, 90, 100)]),
+    )
+    assert allocations["quantity"].sum() == 10
+    assert unmet["quantity"].tolist() == [20]
+
+
+def test_low_priority_goes_short_first():
+    allocations, unmet = ra.solve_allocation(
+        shortfalls([(10, 1, "SKU001", 10, 0.2, 12.98, 77.60), (11, 1, "SKU001", 10, 0.9, 12.99, 77.61)]),
+        stock([(100, 1, "SKU001", 10)]),
+        FCS,
+    )
+    assert allocations["store_id"].tolist() == [11]
+    assert unmet[["store_id", "quantity"]].values.tolist() == [[10, 10]]
+
+
+def test_sku_must_match():
+    allocations, unmet = ra.solve_allocation(
+        shortfalls([(10, 1, "SKU001", 5, 1.0, 12.98, 77.60)]),
+        stock([(100, 1, "SKU002", 50)]),
+        FCS,
+    )
+    assert allocations.empty
+    assert unmet["quantity"].tolist() == [5]
+
+
+def test_stock_at_unknown_fc_is_ignored():
+    # FC 3 has no coordinates, so it is not in fcs; its stock must not be referenced
+    allocations, unmet = ra.solve_allocation(
+        shortfalls([(10, 1, "SKU001", 5, 1.0, 12.98, 77.60)]),
+        stock([(300, 3, "SKU001", 50), (100, 1, "SKU001", 2)]),
+        FCS,
+    )
+    assert allocations[["fc_id", "inventory_item_id", "quantity"]].values.tolist() == [[1, 100, 2]]
+    assert unmet["quantity"].tolist() == [3]
+
+
+def test_no_shortfalls():
+    allocations, unmet = ra.solve_allocation(
+        shortfalls([(10, 1, "SKU001", 0, 1.0, 12.98, 77.60)]), stock([(100, 1, "SKU001", 5)]), FCS
+    )
+    assert allocations.empty and unmet.empty
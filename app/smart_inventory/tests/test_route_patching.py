@@ -0,0 +1,87 @@
+import numpy as np
+
+import route_patching as rp
+
+
+def line_dist(xs):
+    """Distance matrix of points on a line, so the best tours are easy to read off."""
+    xs = np.asarray(xs, dtype=float)
+    return np.abs(xs[:, None] - xs[None, :])
+
+
+def route(vehicle_id, depot, stops, capacity, demands):
+    return {'vehicle_id': vehicle_id, 'depot': depot, 'stops': list(stops), 'capacity': capacity,
+            'load': sum(demands.get(node, 0) for node in stops)}
+
+
+def test_two_opt_untangles_a_route():
+    dist = line_dist([0, 1, 2, 3, 4])
+    stops = rp.two_opt(0, [3, 1, 4, 2], dist)
+    assert sorted(stops) == [1, 2, 3, 4]
+    # Out to the far end and back is the shortest tour; either direction will do
+    assert rp.route_distance(0, stops, dist) == 8
+
+
+def test_two_opt_keeps_an_optimal_route():
+    dist = line_dist([0, 1, 2, 3])
+    assert rp.two_opt(0, [1, 2, 3], dist) == [1, 2, 3]
+
+
+def test_relocate_moves_stop_to_the_closer_route():
+    # Depots at 0 and 10; stop 3 (x=9) sits on the far route
+    dist = line_dist([0, 10, 1, 9])
+    demands = {2: 1, 3: 1}
+    routes = [route(1, 0, [2, 3], 5, demands), route(2, 1, [], 5, demands)]
+    touched = {0}
+    rp.relocate(routes, demands, dist, touched)
+    assert routes[0]['stops'] == [2] and routes[1]['stops'] == [3]
+    assert routes[0]['load'] == 1 and routes[1]['load'] == 1
+    assert touched == {0, 1}
+
+
+def test_relocate_respects_capacity():
+    dist = line_dist([0, 10, 1, 9])
+    demands = {2: 1, 3: 3}
+    routes = [route(1, 0, [2, 3], 5, demands), route(2, 1, [], 2, demands)]
+    rp.relocate(routes, demands, dist, {0})
+    assert routes[0]['stops'] == [2, 3] and routes[1]['stops'] == []
+
+
+def test_patch_plan_inserts_new_stop_cheapest():
+    # Nodes: depots 0 (x=0) and 1 (x=10), stores 2 (x=1), 3 (x=9), new store 4 (x=8)
+    dist = line_dist([0, 10, 1, 9, 8])
+    demands = {2: 1, 3: 1, 4: 2}
+    routes = [route(1, 0, [2], 5, demands), route(2, 1, [3], 5, demands)]
+    touched, unplaced = rp.patch_plan(routes, {4}, demands, {4: 1.0}, dist, [0, 1])
+    assert unplaced == []
+    assert touched == {1}
+    assert sorted(routes[1]['stops']) == [3, 4] and routes[1]['load'] == 3
+    assert rp.route_distance(1, routes[1]['stops'], dist) == 4
+    assert routes[0]['stops'] == [2]
+
+
+def test_patch_plan_removes_stop_without_demand():
+    dist = line_dist([0, 1, 2])
+    demands = {1: 1}
+    routes = [route(1, 0, [1, 2], 5, {1: 1, 2: 1})]
+    touched, unplaced = rp.patch_plan(routes, {2}, demands, {}, dist, [0])
+    assert touched == {0} and unplaced == []
+    assert routes[0]['stops'] == [1] and routes[0]['load'] == 1
+
+
+def test_patch_plan_uses_idle_vehicle_from_best_depot():
+    dist = line_dist([0, 10, 1, 9])
+    demands = {2: 4, 3: 3}
+    routes = [route(1, 0, [2], 5, demands), route(2, None, [], 5, demands)]
+    touched, unplaced = rp.patch_plan(routes, {3}, demands, {3: 1.0}, dist, [0, 1])
+    assert unplaced == []
+    assert routes[1]['depot'] == 1 and routes[1]['stops'] == [3]
+
+
+def test_patch_plan_reports_stops_that_do_not_fit():
+    dist = line_dist([0, 1, 2])
+    demands = {1: 4, 2: 3}
+    routes = [route(1, 0, [1], 5, demands)]
+    touched, unplaced = rp.patch_plan(routes, {2}, demands, {2: 1.0}, dist, [0])
+    assert unplaced == [2]
+    assert routes[0]['stops'] == [1]
@@ -0,0 +1,84 @@
+import numpy as np
+import pytest
+
+import tracking_compaction as tc
+
+
+EDGE_VALUES = [0, 1, -1, 63, -64, 64, -65, 2**31 - 1, -2**31, 2**62, -2**62, 2**63 - 1, -2**63]
+
+
+def test_zigzag_round_trip():
+    values = np.array(EDGE_VALUES, dtype=np.int64)
+    np.testing.assert_array_equal(tc.unzigzag(tc.zigzag(values)), values)
+
+
+def test_zigzag_interleaves_signs():
+    np.testing.assert_array_equal(tc.zigzag(np.array([0, -1, 1, -2, 2])), np.array([0, 1, 2, 3, 4], dtype=np.uint64))
+
+
+@pytest.mark.parametrize("value, encoded", [(0, [0x00]), (1, [0x01]), (127, [0x7F]), (128, [0x80, 0x01]),
+                                            (300, [0xAC, 0x02]), (2**64 - 1, [0xFF] * 9 + [0x01])])
+def test_varint_encoding_matches_leb128(value, encoded):
+    np.testing.assert_array_equal(tc.varint_encode(np.array([value], dtype=np.uint64)), encoded)
+
+
+def test_varint_round_trip():
+    rng = np.random.default_rng(7)
+    values = np.concatenate((
+        tc.zigzag(np.array(EDGE_VALUES, dtype=np.int64)),
+        rng.integers(0, 2**63, 1000, dtype=np.uint64) >> rng.integers(0, 63, 1000).astype(np.uint64),
+    ))
+    np.testing.assert_array_equal(tc.varint_decode(tc.varint_encode(values)), values)
+
+
+def test_varint_empty():
+    assert len(tc.varint_encode(np.empty(0, dtype=np.uint64))) == 0
+    assert len(tc.varint_decode(np.empty(0, dtype=np.uint8))) == 0
+
+
+def test_path_round_trip():
+    rng = np.random.default_rng(11)
+    lat = np.round(12.97 + np.cumsum(rng.normal(0, 1e-3, 500)), 5)
+    lng = np.round(77.59 + np.cumsum(rng.normal(0, 1e-3, 500)), 5)
+    seconds = 1_751_328_000 + np.cumsum(rng.integers(1, 30, 500))
+    start = int(seconds[0]) - 5
+    blob = tc.encode_path(lat, lng, seconds, start)
+    out_lat, out_lng, out_seconds = tc.decode_path(blob, start)
+    np.testing.assert_allclose(out_lat, lat, atol=1e-9)
+    np.testing.assert_allclose(out_lng, lng, atol=1e-9)
+    np.testing.assert_array_equal(out_seconds, seconds)
+
+
+def test_decode_rejects_unknown_format():
+    with pytest.raises(ValueError):
+        tc.decode_path(bytes([tc.PATH_FORMAT + 1, 0, 0, 0]), 0)
+
+
+def test_polyline_matches_reference():
+    # Example from Google's encoded polyline algorithm documentation
+    assert tc.encode_polyline([38.5, 40.7, 43.252], [-120.2, -120.95, -126.453]) == "_p~iF~ps|U_ulLnnqC_mqNvxq`@"
+
+
+class FakeCursor:
+    def __init__(self, rows):
+        self.rows = rows
+
+    def fetchmany(self, size):
+        batch, self.rows = self.rows[:size], self.rows[size:]
+        return batch
+
+
+def test_streamed_segments_match_single_pass():
+    rng = np.random.default_rng(3)
+    rows = []
+    for vehicle_id in (9, 4, 2):
+        seconds = 1_751_328_000 + np.cumsum(rng.integers(5, 400, 300))
+        rows.extend((vehicle_id, 12.9 + i * 1e-4, 77.5 - i * 1e-4, s) for i, s in enumerate(seconds))
+    vehicle_ids, lat, lng, seconds = (np.array(c) for c in zip(*rows))
+    expected = tc.build_segments(vehicle_ids, lat, lng, seconds)
+    assert len(expected) > 3
+    for fetch_rows in (1, 7, 50, 299, len(rows)):
+        chunks = list(tc.stream_points(FakeCursor(list(rows)), fetch_rows=fetch_rows))
+        assert sum(len(c[0]) for c in chunks) == len(rows)
+        streamed = [segment for chunk in chunks for segment in tc.build_segments(*chunk)]
+        assert [s[:5] + (s[5].adapted,) for s in streamed] == [s[:5] + (s[5].adapted,) for s in expected]